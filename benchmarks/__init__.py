@@ -0,0 +1,52 @@
+"""
+Benchmarks of the denoiser implementations. Run them from the repository root as modules, e.g.:
+python -m benchmarks.torch_inference --help
+"""
+
+import os
+import time
+import numpy as np
+import datasets
+
+def load_images(dataset, count, noiser=None):
+    """
+    Load the first images of the given dataset
+    :param dataset: the name of the dataset, or a directory of reference images (which needs a noiser)
+    :param count: how many images to load
+    :param noiser: an optional noiser to generate synthetic noise
+    :return: a list of (name, reference, noisy) triplets
+    """
+    if os.path.isdir(dataset):
+        the_dataset = datasets.BasicImageDataset(dataset)
+    else:
+        the_dataset = datasets.create(dataset)
+    if noiser:
+        the_dataset.set_noiser(noiser)
+    return the_dataset[0:min(count, len(the_dataset))]
+
+def center_crop(image, size):
+    """ Crop a size x size window from the center of the image """
+    height, width = image.shape[:2]
+    y = max(0, (height - size) // 2)
+    x = max(0, (width - size) // 2)
+    return image[y:y + size, x:x + size]
+
+def time_call(function, repeat=3, warmup=1):
+    """
+    Measure how long the given function takes
+    :param function: the function to call (without arguments)
+    :param repeat: the number of timed calls
+    :param warmup: the number of calls before timing, to leave caches and lazy setup out
+    :return: a tuple with the median duration in seconds and the result of the last call
+    """
+    result = None
+    for _ in range(warmup):
+        result = function()
+
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - start)
+
+    return float(np.median(durations)), result
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Speed and quality of BM3D for each profile and stage, on the whole image and tiled with different
+tile sizes. The quality is measured against the reference images, and the tiled outputs are also
+compared to the whole image output of the same configuration (tiling should barely change it).
+"""
+
+from argparse import ArgumentParser
+import numpy as np
+import pandas as pd
+import datasets
+import denoisers
+import metrics
+import noisers
+from benchmarks import load_images, center_crop, time_call
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--dataset", default=datasets.list_datasets()[0],
+                        help="Dataset the images are taken from, or a directory of reference images")
+    parser.add_argument("--noiser", help="Generate synthetic noise with the given noiser (required for a directory)")
+    parser.add_argument("--images", type=int, default=2,
+                        help="Number of images evaluated (default: 2)")
+    parser.add_argument("--size", type=int, default=0,
+                        help="Size of the square crop taken from the center of each image (default: whole image)")
+    parser.add_argument("--profiles", nargs="+", default=["np"],
+                        help="BM3D profiles to compare (default: np)")
+    parser.add_argument("--stages", nargs="+", default=["all", "hard"],
+                        help="BM3D stages to compare (default: all hard)")
+    parser.add_argument("--tile-sizes", type=int, nargs="+", default=[0, 256, 512],
+                        help="Tile sizes to compare, 0 for the whole image (default: 0 256 512)")
+    parser.add_argument("--n-jobs", type=int, default=-1,
+                        help="Number of processes for the tiles (default: all the cores)")
+    parser.add_argument("--sigma", type=float,
+                        help="sigma_psd for BM3D (default: the denoiser default)")
+    parser.add_argument("--output", help="Save the results to the given CSV file")
+    options = parser.parse_args()
+
+    psnr = metrics.create("psnr")
+    ssim = metrics.create("ssim")
+
+    images = load_images(options.dataset, options.images, noisers.create(options.noiser) if options.noiser else None)
+    if options.size:
+        images = [(name, center_crop(ref, options.size), center_crop(noisy, options.size))
+                  for name, ref, noisy in images]
+    megapixels = sum(noisy.shape[0] * noisy.shape[1] for _, _, noisy in images) / 1e6
+
+    denoiser = denoisers.create("bm3d")
+    if options.sigma is not None:
+        denoiser.set_params(sigma_psd=options.sigma)
+
+    rows = []
+    for profile in options.profiles:
+        for stage in options.stages:
+            whole = None
+            for tile_size in options.tile_sizes:
+                denoiser.set_params(profile=profile, stage=stage, tile_size=tile_size, n_jobs=options.n_jobs)
+                duration, outputs = time_call(lambda: [denoiser.denoise(noisy) for _, _, noisy in images],
+                                              repeat=1, warmup=0)
+                if tile_size == 0:
+                    whole = outputs
+
+                rows.append({
+                    "profile": profile,
+                    "stage": stage,
+                    "tile size": tile_size,
+                    "time (s/MP)": duration / megapixels,
+                    "psnr": np.mean([psnr.compare(ref, out) for (_, ref, _), out in zip(images, outputs)]),
+                    "ssim": np.mean([ssim.compare(ref, out) for (_, ref, _), out in zip(images, outputs)]),
+                    "psnr vs whole": np.mean([psnr.compare(w, out) for w, out in zip(whole, outputs)])
+                                     if whole is not None and tile_size else np.nan,
+                })
+
+    results = pd.DataFrame(rows)
+
+    # compare everything to the default configuration on the whole image
+    baseline = results[(results["tile size"] == 0) & (results.stage == "all")].set_index("profile")
+    if not baseline.empty:
+        results["speedup"] = results.profile.map(baseline["time (s/MP)"]) / results["time (s/MP)"]
+
+    print(results.to_string(index=False))
+    if options.output:
+        results.to_csv(options.output, index=False)
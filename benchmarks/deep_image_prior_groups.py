@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Speed of deep_image_prior fitting several images together (group_size) against one after the other,
+with a fixed number of iterations. The grouped networks start from the same weights and noise, so
+their outputs should match the ones of group_size=1.
+"""
+
+from argparse import ArgumentParser
+import sys
+import numpy as np
+import pandas as pd
+import datasets
+import denoisers
+import noisers
+from benchmarks import load_images, center_crop, time_call
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--dataset", default=datasets.list_datasets()[0],
+                        help="Dataset the images are taken from, or a directory of reference images")
+    parser.add_argument("--noiser", help="Generate synthetic noise with the given noiser (required for a directory)")
+    parser.add_argument("--images", type=int, default=4,
+                        help="Number of images evaluated (default: 4)")
+    parser.add_argument("--size", type=int, default=128,
+                        help="Size of the square crop taken from the center of each image (default: 128)")
+    parser.add_argument("--iterations", type=int, default=50,
+                        help="Number of iterations fitted for each image (default: 50)")
+    parser.add_argument("--group-sizes", type=int, nargs="+", default=[1, 2, 4],
+                        help="Group sizes to compare (default: 1 2 4)")
+    parser.add_argument("--batch-memory", type=int, default=1024,
+                        help="Memory budget in MB of a batch, as in denoise_comparator.py (default: 1024)")
+    parser.add_argument("--output", help="Save the results to the given CSV file")
+    options = parser.parse_args()
+
+    try:
+        denoiser = denoisers.create("deepimageprior")
+    except ImportError as e:
+        print("deep_image_prior is not available ({}), skipping the benchmark".format(e))
+        sys.exit(0)
+    denoiser.set_params(max_iterations=options.iterations, stop_criterion="none")
+
+    images = load_images(options.dataset, options.images, noisers.create(options.noiser) if options.noiser else None)
+    noisy = [center_crop(image, options.size) for _, _, image in images]
+
+    # how many images denoise_comparator.py would give to denoise_batch() at once
+    per_batch = len(next(denoiser.batch_indices(noisy, options.batch_memory << 20)))
+
+    rows = []
+    baseline = None
+    for group_size in options.group_sizes:
+        denoiser.set_params(group_size=group_size)
+        duration, outputs = time_call(lambda: denoiser.denoise_batch(noisy), repeat=1, warmup=0)
+        if baseline is None:
+            baseline = outputs
+
+        rows.append({
+            "group size": group_size,
+            "images per batch": per_batch,
+            "time (s/image)": duration / len(noisy),
+            "max difference": max(np.abs(a.astype(int) - b.astype(int)).max() for a, b in zip(baseline, outputs)),
+        })
+
+    results = pd.DataFrame(rows)
+    results["speedup"] = results["time (s/image)"].iloc[0] / results["time (s/image)"]
+
+    print(results.to_string(index=False))
+    if options.output:
+        results.to_csv(options.output, index=False)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Throughput of the denoisers releasing the GIL (by default the OpenCV blur family) when the jobs run
+on the worker processes or on threads, plus sequentially as a reference
+"""
+
+from argparse import ArgumentParser
+import time
+import pandas as pd
+import datasets
+import denoisers
+from benchmarks import load_images, center_crop
+from denoise_comparator import run
+from imagebuffer import ImageBuffer
+from scheduler import MemoryScheduler
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--denoisers", nargs="+", default=["blur", "gaussianblur", "medianblur"],
+                        help="Denoisers to benchmark (default: blur gaussianblur medianblur)")
+    parser.add_argument("--dataset", default=datasets.list_datasets()[0],
+                        help="Dataset the images are taken from")
+    parser.add_argument("--images", type=int, default=16,
+                        help="Number of images processed (default: 16)")
+    parser.add_argument("--size", type=int, default=0,
+                        help="Size of the square crop taken from the center of each image (default: whole image)")
+    parser.add_argument("--n-jobs", type=int, default=-1,
+                        help="Number of processes/threads (default: one per core)")
+    parser.add_argument("--output", help="Save the results to the given CSV file")
+    options = parser.parse_args()
+
+    images = load_images(options.dataset, options.images)
+    if options.size:
+        images = [(name, ref, center_crop(noisy, options.size)) for name, ref, noisy in images]
+    images = [(name, ImageBuffer(noisy)) for name, _, noisy in images]
+    megapixels = sum(noisy.shape[0] * noisy.shape[1] for _, noisy in images) / 1e6
+
+    rows = []
+    for name in options.denoisers:
+        denoiser = denoisers.create(name)
+        if not denoiser.releases_gil:
+            print("WARNING: {} doesn't release the GIL, it always runs on processes".format(name))
+        jobs = [((image_name, noisy, denoiser), denoiser, noisy.shape) for image_name, noisy in images]
+
+        for backend in ("sequential", "processes", "threads"):
+            start = time.perf_counter()
+            if backend == "sequential":
+                for args, _, _ in jobs:
+                    run(*args)
+            else:
+                scheduler = MemoryScheduler(n_jobs=options.n_jobs, use_threads=backend == "threads")
+                # the first call starts the worker processes, which is paid once per run
+                scheduler.run(run, jobs[:1])
+                start = time.perf_counter()
+                scheduler.run(run, jobs)
+                scheduler.shutdown()
+            duration = time.perf_counter() - start
+
+            rows.append({
+                "denoiser": name,
+                "backend": backend,
+                "time (s)": duration,
+                "throughput (MP/s)": megapixels / duration,
+            })
+
+    results = pd.DataFrame(rows)
+    sequential = results[results.backend == "sequential"].set_index("denoiser")
+    results["speedup"] = results.denoiser.map(sequential["time (s)"]) / results["time (s)"]
+
+    print(results.to_string(index=False))
+    if options.output:
+        results.to_csv(options.output, index=False)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Latency of the torch denoisers on onnxruntime compared to torch, plus the startup time of each
+backend (imports, model loading and first inference) measured in a fresh process
+"""
+
+from argparse import ArgumentParser
+import subprocess
+import sys
+import numpy as np
+import pandas as pd
+import datasets
+import denoisers
+import metrics
+from benchmarks import load_images, center_crop, time_call
+
+startup_script = """
+import time
+start = time.perf_counter()
+import numpy as np
+import denoisers
+denoiser = denoisers.create("{name}")
+denoiser.set_params(backend="{backend}", threads={threads})
+denoiser.denoise(np.zeros(({size}, {size}, 3), dtype=np.uint8))
+print(time.perf_counter() - start)
+"""
+
+def startup_time(name, backend, threads, size):
+    script = startup_script.format(name=name, backend=backend, threads=threads, size=size)
+    output = subprocess.run([sys.executable, "-c", script], check=True, capture_output=True, text=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--denoisers", nargs="+", default=["cbdnet", "cycleisp"],
+                        help="Torch denoisers to benchmark (default: cbdnet cycleisp)")
+    parser.add_argument("--dataset", default=datasets.list_datasets()[0],
+                        help="Dataset the images are taken from")
+    parser.add_argument("--images", type=int, default=2,
+                        help="Number of images processed in each batch (default: 2)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[128, 256, 512],
+                        help="Sizes of the square crops to benchmark (default: 128 256 512)")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="Intra-op threads of onnxruntime (default: 0, let onnxruntime decide)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of timed runs per configuration (default: 3)")
+    parser.add_argument("--output", help="Save the results to the given CSV file")
+    options = parser.parse_args()
+
+    psnr = metrics.create("psnr")
+    images = load_images(options.dataset, options.images)
+
+    rows = []
+    for name in options.denoisers:
+        denoiser = denoisers.create(name)
+        denoiser.set_params(threads=options.threads)
+        for size in options.sizes:
+            crops = [center_crop(noisy, size) for _, _, noisy in images]
+            crops = [crop for crop in crops if crop.shape[:2] == (size, size)]
+            if not crops:
+                print("WARNING: no image is big enough for {0}x{0} crops".format(size))
+                continue
+
+            outputs = {}
+            for backend, optimize in (("torch", False), ("torch", True), ("onnx", False)):
+                denoiser.set_params(backend=backend, optimize=optimize)
+                duration, outputs[(backend, optimize)] = time_call(lambda: denoiser.denoise_batch(crops),
+                                                                   options.repeat, warmup=2)
+                rows.append({
+                    "denoiser": name,
+                    "size": size,
+                    "backend": "torchscript" if optimize else backend,
+                    "latency (s/image)": duration / len(crops),
+                    "psnr vs torch": np.mean([psnr.compare(a, b) for a, b in
+                                              zip(outputs[("torch", False)], outputs[(backend, optimize)])]),
+                })
+
+        for backend in ("torch", "onnx"):
+            rows.append({
+                "denoiser": name,
+                "size": options.sizes[0],
+                "backend": backend,
+                "startup (s)": startup_time(name, backend, options.threads, options.sizes[0]),
+            })
+
+    results = pd.DataFrame(rows)
+    print(results.to_string(index=False))
+    if options.output:
+        results.to_csv(options.output, index=False)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Wall-clock time and quality of the parameter search strategies of param_search.py on the same
+train/test split, scoring the best parameters found by each of them on the test images
+"""
+
+from argparse import ArgumentParser
+import time
+import pandas as pd
+import datasets
+import denoisers
+import noisers
+from param_search import SEARCHES, create_search, load_split
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--denoisers", nargs="+", default=["gaussianblur", "bilateral"],
+                        help="Denoisers to search (default: gaussianblur bilateral)")
+    parser.add_argument("--searches", nargs="+", default=SEARCHES,
+                        help="Search strategies to compare (default: {})".format(" ".join(SEARCHES)))
+    parser.add_argument("--dataset", default=datasets.list_datasets()[0],
+                        help="Dataset the images are taken from")
+    parser.add_argument("--noiser", help="Generate synthetic noise using the given noiser")
+    parser.add_argument("--iterations", type=int, default=81,
+                        help="Number of candidates of each search (default: 81)")
+    parser.add_argument("--cv-folds", type=int, default=3,
+                        help="Number of cross validation folds (default: 3)")
+    parser.add_argument("--n-jobs", type=int, default=-1,
+                        help="Number of parallel jobs (default: one per core)")
+    parser.add_argument("--output", help="Save the results to the given CSV file")
+    options = parser.parse_args()
+
+    dataset = datasets.create(options.dataset)
+    if options.noiser:
+        dataset.set_noiser(noisers.create(options.noiser))
+    X_train, y_train, X_test, y_test = load_split(dataset)
+
+    rows = []
+    for name in options.denoisers:
+        for search in options.searches:
+            denoiser = denoisers.create(name)
+            grid = create_search(search, denoiser, options.iterations, options.cv_folds, n_jobs=options.n_jobs)
+
+            start = time.perf_counter()
+            grid.fit(X_train, y_train)
+            duration = time.perf_counter() - start
+
+            denoiser.set_params(**grid.best_params_)
+            rows.append({
+                "denoiser": name,
+                "search": search,
+                "time (s)": duration,
+                "evaluations": len(grid.cv_results_["params"]),
+                "best train score": grid.best_score_,
+                "test score": denoiser.score(X_test, y_test),
+            })
+
+    results = pd.DataFrame(rows)
+    baseline = results[results.search == "random"].set_index("denoiser")
+    if not baseline.empty:
+        results["speedup"] = results.denoiser.map(baseline["time (s)"]) / results["time (s)"]
+
+    print(results.to_string(index=False))
+    if options.output:
+        results.to_csv(options.output, index=False)
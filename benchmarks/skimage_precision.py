@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Time, peak memory and quality of the scikit-image denoisers in float64 and float32. The quality
+check fails (non-zero exit status) when the PSNR of any denoiser changes more than the tolerance.
+"""
+
+from argparse import ArgumentParser
+import sys
+import tracemalloc
+import numpy as np
+import pandas as pd
+import datasets
+import denoisers
+import metrics
+from benchmarks import load_images, center_crop, time_call
+
+SKIMAGE_DENOISERS = ["bilateral", "nlmeans", "tvchambolle", "wavelet"]
+
+def peak_memory(function):
+    """ Return the peak memory (in bytes) allocated by numpy and python while calling the function """
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--denoisers", nargs="+", default=SKIMAGE_DENOISERS,
+                        help="scikit-image denoisers to compare (default: {})".format(" ".join(SKIMAGE_DENOISERS)))
+    parser.add_argument("--dataset", default=datasets.list_datasets()[0],
+                        help="Dataset the images are taken from")
+    parser.add_argument("--images", type=int, default=4,
+                        help="Number of images evaluated (default: 4)")
+    parser.add_argument("--size", type=int, default=512,
+                        help="Size of the square crop taken from the center of each image (default: 512)")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Number of timed runs per configuration (default: 1)")
+    parser.add_argument("--tolerance", type=float, default=0.05,
+                        help="Maximum PSNR difference (dB) between both precisions (default: 0.05)")
+    parser.add_argument("--output", help="Save the results to the given CSV file")
+    options = parser.parse_args()
+
+    psnr = metrics.create("psnr")
+    images = load_images(options.dataset, options.images)
+    images = [(name, center_crop(ref, options.size), center_crop(noisy, options.size))
+              for name, ref, noisy in images]
+
+    rows = []
+    for name in options.denoisers:
+        denoiser = denoisers.create(name)
+        outputs = {}
+        for dtype in ("float64", "float32"):
+            denoiser.set_params(working_dtype=dtype)
+            duration, outputs[dtype] = time_call(lambda: [denoiser.denoise(noisy) for _, _, noisy in images],
+                                                 options.repeat)
+            rows.append({
+                "denoiser": name,
+                "dtype": dtype,
+                "time (s/image)": duration / len(images),
+                "peak memory (MB)": peak_memory(lambda: denoiser.denoise(images[0][2])) / (1 << 20),
+                "psnr": np.mean([psnr.compare(ref, out) for (_, ref, _), out in zip(images, outputs[dtype])]),
+            })
+
+        # how far the float32 outputs are from the float64 ones
+        rows[-1]["max pixel delta"] = max(int(np.abs(a.astype(int) - b).max())
+                                          for a, b in zip(outputs["float64"], outputs["float32"]))
+
+    results = pd.DataFrame(rows)
+    baseline = results[results.dtype == "float64"].set_index("denoiser")
+    results["speedup"] = results.denoiser.map(baseline["time (s/image)"]) / results["time (s/image)"]
+    results["psnr delta"] = results.psnr - results.denoiser.map(baseline.psnr)
+    results["ok"] = results["psnr delta"].abs() <= options.tolerance
+
+    print(results.to_string(index=False))
+    if options.output:
+        results.to_csv(options.output, index=False)
+
+    if not results.ok.all():
+        print("PSNR changed more than {} dB for: {}".format(
+            options.tolerance, ", ".join(results[~results.ok].denoiser)))
+        sys.exit(1)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Latency and throughput of the torch denoisers in eager mode and optimized with TorchScript, plus
+the PSNR between the outputs of both modes (which should be identical or very close to it)
+"""
+
+from argparse import ArgumentParser
+import numpy as np
+import pandas as pd
+import datasets
+import denoisers
+import metrics
+from benchmarks import load_images, center_crop, time_call
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--denoisers", nargs="+", default=["cbdnet", "cycleisp"],
+                        help="Torch denoisers to benchmark (default: cbdnet cycleisp)")
+    parser.add_argument("--dataset", default=datasets.list_datasets()[0],
+                        help="Dataset the images are taken from")
+    parser.add_argument("--images", type=int, default=2,
+                        help="Number of images processed in each batch (default: 2)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[128, 256, 512],
+                        help="Sizes of the square crops to benchmark (default: 128 256 512)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of timed runs per configuration (default: 3)")
+    parser.add_argument("--output", help="Save the results to the given CSV file")
+    options = parser.parse_args()
+
+    psnr = metrics.create("psnr")
+    images = load_images(options.dataset, options.images)
+
+    rows = []
+    for name in options.denoisers:
+        denoiser = denoisers.create(name)
+        for size in options.sizes:
+            crops = [center_crop(noisy, size) for _, _, noisy in images]
+            crops = [crop for crop in crops if crop.shape[:2] == (size, size)]
+            if not crops:
+                print("WARNING: no image is big enough for {0}x{0} crops".format(size))
+                continue
+
+            megapixels = len(crops) * size * size / 1e6
+            outputs = {}
+            for optimize in (False, True):
+                denoiser.set_params(optimize=optimize)
+                # TorchScript profiles the first runs before optimizing the graph, so warm up twice
+                duration, outputs[optimize] = time_call(lambda: denoiser.denoise_batch(crops),
+                                                        options.repeat, warmup=2)
+                rows.append({
+                    "denoiser": name,
+                    "size": size,
+                    "mode": "torchscript" if optimize else "eager",
+                    "latency (s/image)": duration / len(crops),
+                    "throughput (MP/s)": megapixels / duration,
+                })
+
+            # both modes should produce the same images
+            rows[-1]["psnr vs eager"] = np.mean([psnr.compare(eager, optimized)
+                                                 for eager, optimized in zip(outputs[False], outputs[True])])
+
+    results = pd.DataFrame(rows)
+    print(results.to_string(index=False))
+    if options.output:
+        results.to_csv(options.output, index=False)
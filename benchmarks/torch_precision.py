@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Speedup and quality cost of running the torch denoisers with reduced precision. The images used to
+calibrate the int8 models are not part of the evaluated ones.
+"""
+
+from argparse import ArgumentParser
+import numpy as np
+import pandas as pd
+import datasets
+import denoisers
+import metrics
+from benchmarks import load_images, center_crop, time_call
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--denoisers", nargs="+", default=["cbdnet", "cycleisp"],
+                        help="Torch denoisers to benchmark (default: cbdnet cycleisp)")
+    parser.add_argument("--precisions", nargs="+", default=["fp32", "bf16", "int8"],
+                        help="Precisions to compare (default: fp32 bf16 int8)")
+    parser.add_argument("--dataset", default=datasets.list_datasets()[0],
+                        help="Dataset the images are taken from")
+    parser.add_argument("--calibration-images", type=int, default=4,
+                        help="Number of images used to calibrate the int8 models (default: 4)")
+    parser.add_argument("--images", type=int, default=8,
+                        help="Number of images evaluated (default: 8)")
+    parser.add_argument("--size", type=int, default=512,
+                        help="Size of the square crop taken from the center of each image (default: 512)")
+    parser.add_argument("--optimize", action="store_true",
+                        help="Also trace the models with TorchScript (not applied to bf16)")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Number of timed runs per configuration (default: 1)")
+    parser.add_argument("--output", help="Save the results to the given CSV file")
+    options = parser.parse_args()
+
+    psnr = metrics.create("psnr")
+    ssim = metrics.create("ssim")
+
+    images = load_images(options.dataset, options.calibration_images + options.images)
+    images = [(name, center_crop(ref, options.size), center_crop(noisy, options.size))
+              for name, ref, noisy in images]
+    calibration = [noisy for _, _, noisy in images[:options.calibration_images]]
+    evaluation = images[options.calibration_images:]
+
+    rows = []
+    for name in options.denoisers:
+        denoiser = denoisers.create(name)
+        denoiser.set_params(optimize=options.optimize)
+        if "int8" in options.precisions:
+            denoiser.calibrate(calibration)
+
+        for precision in options.precisions:
+            denoiser.set_params(precision=precision)
+            duration, outputs = time_call(lambda: [denoiser.denoise(noisy) for _, _, noisy in evaluation],
+                                          options.repeat)
+            rows.append({
+                "denoiser": name,
+                "precision": precision,
+                "time (s/image)": duration / len(evaluation),
+                "psnr": np.mean([psnr.compare(ref, out) for (_, ref, _), out in zip(evaluation, outputs)]),
+                "ssim": np.mean([ssim.compare(ref, out) for (_, ref, _), out in zip(evaluation, outputs)]),
+            })
+
+    results = pd.DataFrame(rows)
+
+    # compare everything to the full precision run of the same denoiser
+    baseline = results[results.precision == "fp32"].set_index("denoiser")
+    if not baseline.empty:
+        results["speedup"] = results.denoiser.map(baseline["time (s/image)"]) / results["time (s/image)"]
+        results["psnr delta"] = results.psnr - results.denoiser.map(baseline.psnr)
+        results["ssim delta"] = results.ssim - results.denoiser.map(baseline.ssim)
+
+    print(results.to_string(index=False))
+    if options.output:
+        results.to_csv(options.output, index=False)
@@ -0,0 +1,363 @@
+"""
+Persistent caches used to avoid recomputing results that are already known from previous runs
+"""
+
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import time
+import cv2
+import numpy as np
+from metrics import Metric
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+def image_hash(image):
+    """
+    Compute a cheap content hash of the given image. xxhash is used when available, falling back
+    to blake2b otherwise. The shape and dtype are part of the hash, so buffers with the same bytes
+    but a different layout don't collide.
+    :param image: the image (ndarray) to be hashed
+    :return: the hex digest of the image
+    """
+    image = np.ascontiguousarray(image)
+    hasher = xxhash.xxh3_128() if xxhash else hashlib.blake2b(digest_size=16)
+    hasher.update("{}{}".format(image.shape, image.dtype.str).encode())
+    hasher.update(image.data)
+    return hasher.hexdigest()
+
+
+class SQLiteCache(object):
+    """
+    Base class for the caches backed by a SQLite database
+
+    Sub-classes need to define the @ref table and the @ref columns stored in the table. Every
+    table gets a "key" primary key plus "size" and "accessed" columns used for the eviction of
+    the least recently used entries once the total size goes above @ref max_size.
+
+    The database is opened lazily and in WAL mode, so the same cache file can be shared by
+    worker processes writing concurrently.
+    """
+
+    table = None
+    columns = ()
+
+    # summing up the entry sizes is a full scan, so only check the size every few writes
+    evict_interval = 100
+
+    # how many image hashes are remembered by @ref _hash()
+    hash_memo_size = 4
+
+    def __init__(self, path, max_size=None, timeout=60.):
+        """
+        :param path: the SQLite file backing the cache
+        :param max_size: the maximum total size of the entries (None for unbounded)
+        :param timeout: how long (in seconds) to wait for a lock held by another writer
+        """
+        self.path = str(path)
+        self.max_size = max_size
+        self.timeout = timeout
+        self._connection = None
+        self._pid = None
+        self._writes = 0
+        self._hashes = []
+
+    def __getstate__(self):
+        # connections can't be shared between processes, the workers open their own
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        state["_pid"] = None
+        state["_hashes"] = []
+        return state
+
+    def _hash(self, image):
+        # the same image is usually looked up several times in a row (e.g. the reference is
+        # compared against every denoiser result), so remember the last few hashes. The array
+        # itself is kept to guarantee the identity check is valid
+        for cached, digest in self._hashes:
+            if cached is image:
+                return digest
+
+        digest = image_hash(image)
+        self._hashes = [(image, digest)] + self._hashes[:self.hash_memo_size - 1]
+        return digest
+
+    @property
+    def connection(self):
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+
+            self._connection = sqlite3.connect(self.path, timeout=self.timeout)
+            self._pid = os.getpid()
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._create_tables()
+
+        return self._connection
+
+    def _create_tables(self):
+        columns = "".join(", {} {}".format(name, kind) for name, kind in self.columns)
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS {} (key TEXT PRIMARY KEY{}, "
+                                     "size INTEGER, accessed REAL)".format(self.table, columns))
+            self._connection.execute("CREATE INDEX IF NOT EXISTS {0}_accessed ON {0} (accessed)"
+                                     .format(self.table))
+
+    def _get(self, key):
+        """
+        Fetch the stored columns for the given key, updating its access time
+        :return: a tuple with the values of @ref columns or None if the key is not cached
+        """
+        names = ", ".join(name for name, _ in self.columns)
+        connection = self.connection
+        row = connection.execute("SELECT {} FROM {} WHERE key = ?".format(names, self.table),
+                                 (key,)).fetchone()
+        if row is not None:
+            with connection:
+                connection.execute("UPDATE {} SET accessed = ? WHERE key = ?".format(self.table),
+                                   (time.time(), key))
+        return row
+
+    def _put(self, key, values, size=1):
+        names = "".join(", {}".format(name) for name, _ in self.columns)
+        placeholders = ", ?" * len(self.columns)
+        connection = self.connection
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO {} (key{}, size, accessed) VALUES (?{}, ?, ?)"
+                               .format(self.table, names, placeholders),
+                               (key,) + tuple(values) + (size, time.time()))
+
+        self._writes += 1
+        if self._writes % self.evict_interval == 0:
+            self.evict()
+
+    def _on_evict(self, keys):
+        """ Hook for sub-classes that need to release resources of the evicted entries """
+        pass
+
+    def evict(self):
+        """ Remove the least recently used entries until the cache fits in @ref max_size """
+        if self.max_size is None:
+            return
+
+        connection = self.connection
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM {}".format(self.table)).fetchone()[0]
+        if total <= self.max_size:
+            return
+
+        evicted = []
+        for key, size in connection.execute("SELECT key, size FROM {} ORDER BY accessed"
+                                            .format(self.table)):
+            if total <= self.max_size:
+                break
+            evicted.append(key)
+            total -= size
+
+        with connection:
+            connection.executemany("DELETE FROM {} WHERE key = ?".format(self.table),
+                                   [(key,) for key in evicted])
+        self._on_evict(evicted)
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM {}".format(self.table)).fetchone()[0]
+
+    def close(self):
+        if self._connection is not None:
+            self.evict()
+            self._connection.close()
+            self._connection = None
+
+
+class MetricCache(SQLiteCache):
+    """
+    Cache of metric values keyed by the metric (name and version) and the content of both the
+    reference and the test images
+    """
+
+    table = "metrics"
+    columns = (("value", "REAL"),)
+
+    def __init__(self, path, max_entries=1000000, timeout=60.):
+        super().__init__(path, max_size=max_entries, timeout=timeout)
+
+    def key(self, metric, imgref, imgtest):
+        return "{}:{}:{}:{}".format(metric.name, metric.version, self._hash(imgref), self._hash(imgtest))
+
+    def compare(self, metric, imgref, imgtest):
+        """
+        Return the value of the given @ref metric for the images, only calling the metric
+        compare() when the value is not cached yet
+        """
+        key = self.key(metric, imgref, imgtest)
+        row = self._get(key)
+        if row is not None:
+            return row[0]
+
+        value = metric.compare(imgref, imgtest)
+        self._put(key, (float(value),))
+        return value
+
+    def wrap(self, metric):
+        """ Return a metric object that looks up the values of @ref metric in this cache """
+        return CachedMetric(metric, self)
+
+
+class CachedMetric(Metric):
+    """ Metric proxy that stores and retrieves the results of another metric from a cache """
+
+    def __init__(self, metric, cache):
+        self.metric = metric
+        self.cache = cache
+        self.name = metric.name
+        self.description = metric.description
+        self.version = metric.version
+        self.higher_is_better = metric.higher_is_better
+        self.input_format = metric.input_format
+
+    def compare(self, imgref, imgtest):
+        return self.cache.compare(self.metric, imgref, imgtest)
+
+
+class DenoiseCache(SQLiteCache):
+    """
+    Cache of denoised images keyed by the denoiser (name, version, parameters and the runtime options
+    which change the output) and the content of the input image
+
+    The images are stored as files in the cache directory (PNG for 8 bit images, compressed .npz
+    otherwise) along with the time the denoiser took and the information it reported, and the
+    SQLite index next to them keeps track of their size in bytes for the eviction.
+
+    The hits and misses are counted per denoiser, both for the current process (@ref hits,
+    @ref misses) and accumulated in the database (@ref total_statistics()), so the counts of
+    worker processes are not lost.
+    """
+
+    table = "outputs"
+    columns = (("file", "TEXT"), ("time", "REAL"), ("info", "TEXT"))
+
+    # each batch of images is looked up once per denoiser
+    hash_memo_size = 16
+
+    def __init__(self, directory, max_bytes=10 << 30, timeout=60.):
+        """
+        :param directory: the directory for the images and the index
+        :param max_bytes: the maximum total size of the stored images
+        """
+        self.directory = str(directory)
+        super().__init__(os.path.join(self.directory, "index.sqlite"), max_size=max_bytes, timeout=timeout)
+        self.hits = {}
+        self.misses = {}
+
+    def _create_tables(self):
+        super()._create_tables()
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS stats (denoiser TEXT PRIMARY KEY, "
+                                     "hits INTEGER, misses INTEGER)")
+
+    @staticmethod
+    def denoiser_params(denoiser):
+        """ Return the attributes of the denoiser which can change its output: the parameters and
+            the output options (e.g. the precision of the torch denoisers, but not their number of
+            threads, so changing the parallelism still hits the cache) """
+        params = {p: getattr(denoiser, p, None) for p in denoiser.param_grid}
+        params.update(denoiser.get_output_options())
+        return params
+
+    def key(self, denoiser, image):
+        description = json.dumps({
+            "version": denoiser.version,
+            "params": self.denoiser_params(denoiser),
+        }, sort_keys=True, default=lambda value: value.item() if hasattr(value, "item") else str(value))
+        params_hash = hashlib.blake2b(description.encode(), digest_size=8).hexdigest()
+        return "{}:{}:{}".format(denoiser.name, params_hash, self._hash(image))
+
+    def _file(self, key):
+        """ Return the path of the files for the given key, without extension """
+        name, params_hash, digest = key.split(":")
+        return os.path.join(self.directory, name, "{}_{}".format(params_hash, digest))
+
+    def _record(self, denoiser, hit):
+        counts = self.hits if hit else self.misses
+        counts[denoiser.name] = counts.get(denoiser.name, 0) + 1
+
+        connection = self.connection
+        with connection:
+            connection.execute("INSERT OR IGNORE INTO stats (denoiser, hits, misses) VALUES (?, 0, 0)",
+                               (denoiser.name,))
+            connection.execute("UPDATE stats SET {0} = {0} + 1 WHERE denoiser = ?".format("hits" if hit else "misses"),
+                               (denoiser.name,))
+
+    def get(self, denoiser, image):
+        """
+        Look up the output of the denoiser for the given image
+        :return: a (output, time, info) tuple or None if the output is not cached
+        """
+        key = self.key(denoiser, image)
+        row = self._get(key)
+
+        output = None
+        if row is not None:
+            filename, duration, info = row
+            try:
+                if filename.endswith(".png"):
+                    output = cv2.imread(filename, cv2.IMREAD_UNCHANGED)
+                else:
+                    with np.load(filename) as data:
+                        output = data["image"]
+            except (OSError, ValueError):
+                output = None
+
+        self._record(denoiser, output is not None)
+        if output is None:
+            return None
+        return output, duration, json.loads(info) if info else {}
+
+    def put(self, denoiser, image, output, duration, info=None):
+        """ Store the @ref output of the denoiser for the given input @ref image, along with the
+            time it took and the information it reported """
+        key = self.key(denoiser, image)
+        filename = self._file(key)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        if output.dtype == np.uint8:
+            filename += ".png"
+            data = cv2.imencode(".png", output)[1].tobytes()
+        else:
+            filename += ".npz"
+            buffer = io.BytesIO()
+            np.savez_compressed(buffer, image=output)
+            data = buffer.getvalue()
+
+        # write under a temporary name, so other processes never read a partial file
+        temp_file = "{}.{}.tmp".format(filename, os.getpid())
+        with open(temp_file, "wb") as f:
+            f.write(data)
+        os.replace(temp_file, filename)
+
+        self._put(key, (filename, float(duration), json.dumps(info or {}, default=str)), len(data))
+
+    def _on_evict(self, keys):
+        for key in keys:
+            for extension in (".png", ".npz"):
+                try:
+                    os.remove(self._file(key) + extension)
+                except FileNotFoundError:
+                    pass
+
+    def statistics(self):
+        """ Return the hits and misses of this process per denoiser """
+        return {name: {"hits": self.hits.get(name, 0), "misses": self.misses.get(name, 0)}
+                for name in sorted(set(self.hits) | set(self.misses))}
+
+    def total_statistics(self):
+        """ Return the hits and misses accumulated in the database per denoiser """
+        return {name: {"hits": hits, "misses": misses} for name, hits, misses in
+                self.connection.execute("SELECT denoiser, hits, misses FROM stats ORDER BY denoiser")}
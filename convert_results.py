@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Convert the CSV results of denoise_comparator.py to indexed result stores (resultstore.ResultStore),
+saved next to them with the .sqlite extension
+"""
+
+from argparse import ArgumentParser
+from resultstore import ResultStore
+import glob
+import os
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("csv_files", nargs="*",
+                        help="The CSV files with the results (default: the ones in results/)")
+    parser.add_argument("--force", action="store_true",
+                        help="Convert the files even if their .sqlite file is up to date")
+    parser.add_argument("--wide", action="store_true",
+                        help="Also save the results with a column per metric, as <name>_wide.csv")
+    options = parser.parse_args()
+
+    csv_files = options.csv_files or sorted(f for f in glob.glob(os.path.join("results", "*.csv"))
+                                            if not f.endswith("_wide.csv"))
+    for csv_file in csv_files:
+        base = os.path.splitext(csv_file)[0]
+        path = base + ".sqlite"
+        if not options.force and os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(csv_file):
+            print("{} is up to date".format(path))
+            store = ResultStore(path)
+        else:
+            ResultStore.remove(path)
+            store = ResultStore.from_csv(csv_file, path)
+            print("{} -> {} ({} images, {} denoisers, {} metrics)".format(
+                csv_file, path, len(store.images()), len(store.denoisers()), len(store.metrics())))
+
+        if options.wide:
+            store.wide().to_csv(base + "_wide.csv")
+        store.close()
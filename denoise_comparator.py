@@ -8,7 +8,13 @@ import cv2
 import time
 import pathlib
 import json
+import os
+import random
 from results import Results
+from caching import MetricCache, DenoiseCache
+from imagebuffer import ImageBuffer
+from scheduler import MemoryProfile, MemoryScheduler
+import imagebuffer
 from argparse import ArgumentParser
 from tqdm import tqdm
 from joblib import Parallel, delayed
@@ -40,37 +46,138 @@ def check_invalid(what, informed, available, allow_all=False):
 
 def prepare_output_dir(csv_file):
     csv_path = pathlib.Path(csv_file)
-    output_dir = csv_path.parent / csv_path.name.replace(".csv", "")
+    output_dir = csv_path.parent / csv_path.stem
 
     if not output_dir.exists():
         output_dir.mkdir(parents=True)
 
     return output_dir
 
-def save_metadata(meta_file, dataset, noiser, denoisers, metrics, crop):
+def save_metadata(meta_file, dataset, noiser, denoisers, metrics, crop, calibration=None):
     meta = {}
     meta["dataset"] = dataset.name
     meta["noiser"] = noiser if noiser else "none"
     meta["denoisers"] = {}
     for denoiser in denoisers:
         meta[denoiser.name] = {p: getattr(denoiser, p, None) for p in denoiser.param_grid}
+    meta["runtime_options"] = {d.name: d.get_runtime_options() for d in denoisers if d.runtime_options}
     meta["metrics"] = [m.name for m in metrics]
     meta["crop"] = {"width": crop[0], "height": crop[1]} if crop else None
+    meta["calibration_images"] = calibration if calibration else None
 
     with open(meta_file, "w") as f:
         json.dump(meta, f, indent=4)
 
+def update_metadata(meta_file, **entries):
+    """ Add (or replace) the given entries of the metadata saved by @ref save_metadata() """
+    meta = {}
+    if os.path.exists(meta_file):
+        with open(meta_file) as f:
+            meta = json.load(f)
+    meta.update(entries)
+
+    # write to a temporary file first, so an interrupted run doesn't leave the metadata half written
+    temp_file = meta_file + ".tmp"
+    with open(temp_file, "w") as f:
+        json.dump(meta, f, indent=4)
+    os.replace(temp_file, meta_file)
+
+def apply_denoiser_options(denoisers, options):
+    """
+    Set the given runtime options on the denoisers supporting them
+    :param denoisers: the list of denoisers
+    :param options: list of strings in the [DENOISER.]OPTION=VALUE format. The value is parsed as
+                    JSON when possible. Without the denoiser name, the option is set on all
+                    denoisers supporting it.
+    """
+    for option in options:
+        key, _, value = option.partition("=")
+        target, _, key = key.rpartition(".")
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass
+
+        applied = False
+        for denoiser in denoisers:
+            if target in ("", denoiser.name) and key in denoiser.runtime_options:
+                denoiser.set_params(**{key: value})
+                applied = True
+
+        if not applied:
+            print("WARNING: no selected denoiser supports the option {}".format(option))
+
+def calibrate_denoisers(denoisers, dataset, count, size=512):
+    """
+    Calibrate the denoisers running with int8 precision using random images of the dataset
+    :param count: the number of images used for calibration
+    :param size: the size of the (square) crop taken from the center of each image
+    :return: the names of the images used
+    """
+    to_calibrate = [d for d in denoisers if getattr(d, "precision", None) == "int8"]
+    if not to_calibrate:
+        return []
+
+    names = []
+    images = []
+    for index in random.sample(range(len(dataset)), min(count, len(dataset))):
+        name, _, noisy = dataset[index]
+        height, width = noisy.shape[:2]
+        y = max(0, (height - size) // 2)
+        x = max(0, (width - size) // 2)
+        names.append(name)
+        images.append(noisy[y:y + size, x:x + size])
+
+    for denoiser in to_calibrate:
+        print("Calibrating {} with {} images".format(denoiser.name, len(images)))
+        denoiser.calibrate(images)
+
+    return names
+
 def generate_batches(ds, size):
     for start in range(0, len(ds), size):
         yield ds[start:start + size]
 
+def default_batch_size(dataset, denoisers, memory_limit, parallel):
+    """
+    Return the number of dataset images loaded at once when --batch-size isn't given: 8 when running
+    in parallel, and otherwise as many as the denoisers processing batches at once (e.g. the torch
+    ones) fit in @ref memory_limit, so they get batches by default
+    """
+    if parallel:
+        return 8
+
+    batched = [d for d in denoisers if d.batched]
+    if not batched or not len(dataset):
+        return 1
+
+    # assume the other images are like the first one, like the crops are
+    _, _, noisy = dataset[0]
+    size = min(memory_limit // d.estimate_memory(noisy.shape) for d in batched)
+    return int(max(1, min(size, len(dataset))))
+
 def run(name, noisy, denoiser):
+    """ Run the denoiser on the noisy image (an ImageBuffer, so its conversions are shared by the
+        denoisers running in this process) """
     tqdm.write("Image: {} denoiser: {}...".format(name, denoiser.name))
     start = time.time()
-    denoisy = denoiser.denoise(noisy)
+    denoiser.run_info = []
+    denoisy = denoiser.denoise_buffer(noisy)
     end = time.time()
     duration = end - start
-    return name, denoiser, denoisy, duration
+    info = denoiser.run_info[0] if denoiser.run_info else {}
+    return name, denoiser, denoisy, duration, info
+
+def run_batch(names, images, denoiser):
+    tqdm.write("Images: {} denoiser: {}...".format(", ".join(names), denoiser.name))
+    start = time.time()
+    denoiser.run_info = []
+    denoised = denoiser.denoise_batch(images)
+    end = time.time()
+    # there is no way to tell how long each image took, so split the time evenly
+    duration = (end - start) / len(images)
+    infos = denoiser.run_info if len(denoiser.run_info) == len(images) else [{}] * len(images)
+    return [(name, denoiser, denoisy, duration, info) for name, denoisy, info in zip(names, denoised, infos)]
 
 if __name__ == "__main__":
 
@@ -89,13 +196,42 @@ if __name__ == "__main__":
     parser.add_argument("--metrics", action="store", nargs="+", metavar=("METRIC1", "METRIC2"),
                         help="Metrics to be used to compare results (default: all)", default="all")
     parser.add_argument("--output", action="store", default="output.csv",
-                        help="Output CSV file to store the results (default: output.csv)")
+                        help="Output CSV file to store the results, or a .sqlite file for an indexed "
+                             "result store (default: output.csv)")
     parser.add_argument("--crop", nargs=2, metavar=("WIDTH", "HEIGHT"), type=int)
     parser.add_argument("--discard-images", action="store_true",
                         help="By default image results are saved to same folder/name as the output CSV file."
                              " Skip saving.")
     parser.add_argument("--parallel", action="store_true", default=False,
                         help="Run jobs in parallel. This might affect the runtime of the algorithms")
+    parser.add_argument("--memory-budget", action="store", type=int,
+                        help="Memory budget in MB for the denoisers running in parallel, jobs only start "
+                             "while their estimated memory fits (default: 80%% of the available memory)")
+    parser.add_argument("--memory-profile", action="store", default="memory_profile.json",
+                        help="JSON file where the memory measured for each denoiser is learned, to "
+                             "estimate the memory of the next jobs (default: memory_profile.json)")
+    parser.add_argument("--batch-size", action="store", type=int,
+                        help="Number of images processed at once (default: 8 when running in parallel, "
+                             "otherwise as many as the denoisers processing batches fit in --batch-memory)")
+    parser.add_argument("--batch-memory", action="store", type=int, default=1024,
+                        help="Memory budget in MB for the images a denoiser processes in one batch (default: 1024)")
+    parser.add_argument("--metric-cache", action="store", nargs="?", const="metric_cache.sqlite",
+                        help="Cache metric values in the given SQLite file (default: metric_cache.sqlite)")
+    parser.add_argument("--metric-cache-size", action="store", type=int, default=1000000,
+                        help="Maximum number of entries kept in the metric cache (default: 1000000)")
+    parser.add_argument("--denoise-cache", action="store", nargs="?", const="denoise_cache",
+                        help="Cache the denoised images in the given directory, so denoisers are only run "
+                             "on images (or with parameters) they haven't seen before (default: denoise_cache)")
+    parser.add_argument("--denoise-cache-size", action="store", type=int, default=10240,
+                        help="Maximum size in MB of the denoised images kept in the cache (default: 10240)")
+    parser.add_argument("--denoiser-option", action="append", default=[], metavar="[DENOISER.]OPTION=VALUE",
+                        help="Set a runtime option (e.g. optimize=true to use TorchScript on the torch "
+                             "denoisers). Can be passed multiple times")
+    parser.add_argument("--calibration-images", action="store", type=int, default=4,
+                        help="Number of random dataset images used to calibrate int8 denoisers (default: 4)")
+    parser.add_argument("--summary-interval", action="store", type=float, default=30.,
+                        help="Interval in seconds between refreshes of the leaderboard and the summary "
+                             "JSON file (default: 30)")
     options = parser.parse_args()
 
     if options.list:
@@ -126,7 +262,13 @@ if __name__ == "__main__":
             exit(1)
 
     the_denoisers = [denoisers.create(d) for d in options.denoisers]
+    apply_denoiser_options(the_denoisers, options.denoiser_option)
     the_metrics = [metrics.create(m) for m in options.metrics]
+    if options.metric_cache:
+        metric_cache = MetricCache(options.metric_cache, options.metric_cache_size)
+        the_metrics = [metric_cache.wrap(m) for m in the_metrics]
+    denoise_cache = DenoiseCache(options.denoise_cache, options.denoise_cache_size << 20) \
+        if options.denoise_cache else None
     the_dataset = datasets.create(the_datasets[0])
     if options.crop:
         # crop at center by default
@@ -136,28 +278,44 @@ if __name__ == "__main__":
         the_dataset.set_noiser(noisers.create(options.noiser))
 
     # just in case the user didn't provide the extension, add it
-    if not options.output.endswith(".csv"):
+    if not options.output.endswith((".csv", ".sqlite")):
         options.output = options.output + ".csv"
+    output_base = os.path.splitext(options.output)[0]
 
     print("Results are being saved to {}".format(options.output))
     output_dir = pathlib.Path(".")
 
-    meta_file = options.output.replace(".csv", "_meta.json")
+    meta_file = output_base + "_meta.json"
     print("Metadata will be saved to {}".format(meta_file))
 
-    save_metadata(meta_file, the_dataset, options.noiser, the_denoisers, the_metrics, options.crop)
+    summary_file = output_base + "_summary.json"
+    print("Summary statistics will be saved to {}".format(summary_file))
+
+    calibration = calibrate_denoisers(the_denoisers, the_dataset, options.calibration_images)
+    save_metadata(meta_file, the_dataset, options.noiser, the_denoisers, the_metrics, options.crop, calibration)
     if not options.discard_images:
         output_dir = prepare_output_dir(options.output)
         print("Images are being saved to {}".format(output_dir))
 
-    results = Results(options.output)
+    results = Results(options.output, summary_file=summary_file)
+    last_summary = time.time()
 
-    batch_size = 8 if options.parallel else 1
+    batch_size = options.batch_size or default_batch_size(the_dataset, the_denoisers, options.batch_memory << 20,
+                                                          options.parallel)
     n_jobs = -1 if options.parallel else 1
 
+    memory_scheduler = None
+    if options.parallel:
+        memory_scheduler = MemoryScheduler(options.memory_budget << 20 if options.memory_budget else None,
+                                           n_jobs, MemoryProfile(options.memory_profile))
+
+    sequential_denoisers = [d for d in the_denoisers if not d.parallel]
+    parallel_denoisers = [d for d in the_denoisers if d.parallel]
+
     pbar = tqdm(total=len(the_dataset) * len(the_denoisers))
     for batch in generate_batches(the_dataset, batch_size):
         result_images = {}
+        buffers = {}
         batch_results = []
         jobs = []
         for name, reference, noisy in batch:
@@ -166,31 +324,59 @@ if __name__ == "__main__":
                 "noisy": noisy,
             }
 
+            buffers[name] = {
+                "reference": ImageBuffer(reference),
+                "noisy": ImageBuffer(noisy),
+            }
+
             # store the metric values for the noisy images
             for metric in the_metrics:
-                value = metric.compare(reference, noisy)
+                value = metric.compare_buffers(buffers[name]["reference"], buffers[name]["noisy"])
                 results.append(name, None, metric, value, 0)
 
-
-            sequential_denoisers = [d for d in the_denoisers if not d.parallel]
-            parallel_denoisers = [d for d in the_denoisers if d.parallel]
-
-            # for the non-parallel denoisers, just run them
-            for denoiser in sequential_denoisers:
-                batch_results.append(run(name, noisy, denoiser))
-                pbar.update(1)
-
             for denoiser in parallel_denoisers:
-                jobs.append((name, noisy, denoiser))
+                cached = denoise_cache.get(denoiser, noisy) if denoise_cache is not None else None
+                if cached:
+                    batch_results.append((name, denoiser) + cached)
+                else:
+                    jobs.append((name, buffers[name]["noisy"], denoiser))
+
+        # for the non-parallel denoisers, just run them, with the same sized images in batches
+        computed = []
+        for denoiser in sequential_denoisers:
+            names = []
+            images = []
+            for name, _, noisy in batch:
+                cached = denoise_cache.get(denoiser, noisy) if denoise_cache is not None else None
+                if cached:
+                    batch_results.append((name, denoiser) + cached)
+                    pbar.update(1)
+                else:
+                    names.append(name)
+                    images.append(noisy)
+
+            for indices in denoiser.batch_indices(images, options.batch_memory << 20):
+                computed += run_batch([names[i] for i in indices], [images[i] for i in indices], denoiser)
+                pbar.update(len(indices))
+
+        if memory_scheduler:
+            computed += memory_scheduler.run(run, [((name, noisy, denoiser), denoiser, noisy.shape)
+                                                   for name, noisy, denoiser in jobs])
+        else:
+            computed += Parallel(n_jobs=n_jobs)(delayed(run)(name, noisy, denoiser) for name, noisy, denoiser in jobs)
 
-        batch_results += Parallel(n_jobs=n_jobs)(delayed(run)(name, noisy, denoiser) for name, noisy, denoiser in jobs)
+        if denoise_cache is not None:
+            for name, denoiser, denoisy, duration, info in computed:
+                denoise_cache.put(denoiser, result_images[name]["noisy"], denoisy, duration, info)
+        batch_results += computed
 
-        for name, denoiser, denoisy, duration in batch_results:
+        for name, denoiser, denoisy, duration, info in batch_results:
             result_images[name][denoiser.name] = denoisy
+            denoisy = ImageBuffer(denoisy)
 
             for metric in the_metrics:
-                value = metric.compare(result_images[name]["reference"], denoisy)
-                results.append(name, denoiser, metric, value, duration)
+                value = metric.compare_buffers(buffers[name]["reference"], denoisy)
+                results.append(name, denoiser, metric, value, duration, info)
 
         if not options.discard_images:
             for image_name, data in result_images.items():
@@ -198,4 +384,37 @@ if __name__ == "__main__":
                     cv2.imwrite(str(output_dir / "{}_{}.png".format(image_name, key)), img)
 
         # the non-parallel denoisers have been accounted for already
-        pbar.update(len(batch) * len(parallel_denoisers))
\ No newline at end of file
+        pbar.update(len(batch) * len(parallel_denoisers))
+
+        if time.time() - last_summary >= options.summary_interval:
+            last_summary = time.time()
+            results.save_summary()
+            pbar.write(results.leaderboard())
+
+    pbar.close()
+    results.save_summary()
+    print(results.leaderboard())
+
+    if options.metric_cache:
+        metric_cache.close()
+
+    if memory_scheduler:
+        memory_scheduler.profile.save()
+        update_metadata(meta_file, memory={
+            "budget": memory_scheduler.budget,
+            "peak_estimated": memory_scheduler.peak_in_flight,
+        })
+
+    # the conversions done in the worker processes are not counted
+    update_metadata(meta_file, image_conversions=imagebuffer.statistics.to_dict())
+    print("Image conversions: {conversions} ({copied_bytes} bytes), reused: {reused} ({saved_bytes} bytes)"
+          .format(**imagebuffer.statistics.to_dict()))
+
+    if denoise_cache is not None:
+        update_metadata(meta_file, denoise_cache={
+            "directory": options.denoise_cache,
+            "denoisers": denoise_cache.statistics(),
+            "hits": sum(denoise_cache.hits.values()),
+            "misses": sum(denoise_cache.misses.values()),
+        })
+        denoise_cache.close()
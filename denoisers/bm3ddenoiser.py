@@ -1,5 +1,6 @@
 from . import Denoiser
 from scipy.stats import uniform
+from joblib import Parallel, delayed
 import bm3d
 import numpy as np
 
@@ -12,6 +13,11 @@ class BM3DDenoiser(Denoiser):
     Y. Mäkinen, L. Azzari, A. Foi, 2019.
     Exact Transform-Domain Noise Variance for Collaborative Filtering of Stationary Correlated Noise.
     In IEEE International Conference on Image Processing (ICIP), pp. 185-189
+
+    With @ref tile_size set, the image is split in overlapping tiles which are denoised in parallel
+    (@ref n_jobs processes) and blended back together. The tiles overlap by half the block matching
+    search window plus a block, so the blocks near the border of a tile still find their matches. The
+    color transform is done on the whole image, so all the tiles use the same normalization.
     """
 
     name = "bm3d"
@@ -22,12 +28,108 @@ class BM3DDenoiser(Denoiser):
 
     sigma_psd = 30.0
 
+    # one of the profiles in @ref profiles
+    profile = "np"
+
+    # all: hard thresholding followed by Wiener filtering, hard: only hard thresholding (faster)
+    stage = "all"
+
+    profiles = {
+        "np": bm3d.BM3DProfile,
+        "refilter": bm3d.BM3DProfileRefilter,
+        "vn": bm3d.BM3DProfileVN,
+        "high": bm3d.BM3DProfileHigh,
+    }
+    stages = {
+        "all": bm3d.BM3DStages.ALL_STAGES,
+        "hard": bm3d.BM3DStages.HARD_THRESHOLDING,
+    }
+
     param_grid = {
-        "sigma_psd": uniform(loc=0., scale=255.)
+        "sigma_psd": uniform(loc=0., scale=255.),
+        # "refilter" fails on bm3d 4.0.3 ("operands could not be broadcast together", even with
+        # bm3d_rgb() itself), so it isn't searched
+        "profile": [profile for profile in profiles if profile != "refilter"],
+        "stage": list(stages.keys()),
     }
 
+    # size of the tiles (including the overlap), 0 denoises the whole image at once
+    tile_size = 0
+
+    # number of processes for the tiles (-1 uses all the cores)
+    n_jobs = -1
+
+    runtime_options = ("tile_size", "n_jobs")
+    # the blending of the tiles changes the output a little
+    output_options = ("tile_size",)
+
+    # measured around 1KB per pixel on the whole image
+    memory_per_pixel = 1024
+
+    @property
+    def parallel(self):
+        # the tiled mode already uses all the cores, so it shouldn't be run in parallel with others
+        return not self.tile_size
+
+    def overlap(self):
+        """ Return the overlap between the tiles for the current profile """
+        profile = self.profiles[self.profile]()
+        return max(profile.search_window_ht, profile.search_window_wiener) // 2 + \
+            max(profile.bs_ht, profile.bs_wiener)
+
+    @staticmethod
+    def _tile_starts(length, tile, overlap):
+        """ Return the start of the tiles along an axis of the given length """
+        if length <= tile:
+            return [0]
+        starts = list(range(0, length - tile, tile - overlap))
+        return starts + [length - tile]
+
+    @staticmethod
+    def _tile_weights(height, width, overlap):
+        """ Return the blending weights of a tile: linear ramps over the overlap on each side """
+        def ramp(length):
+            position = np.arange(length) + 0.5
+            return np.minimum(1., np.minimum(position, length - position) / overlap)
+        return np.outer(ramp(height), ramp(width))[:, :, None]
+
+    def _denoise_tiles(self, image, sigma, stage):
+        """ Denoise the (color transformed) image in overlapping tiles """
+        height, width = image.shape[:2]
+        overlap = self.overlap()
+        tile = max(self.tile_size, 4 * overlap)
+
+        boxes = [(y, x, min(tile, height), min(tile, width))
+                 for y in self._tile_starts(height, tile, overlap)
+                 for x in self._tile_starts(width, tile, overlap)]
+        tiles = Parallel(n_jobs=self.n_jobs)(
+            delayed(bm3d.bm3d)(image[y:y + h, x:x + w], sigma, self.profile, stage) for y, x, h, w in boxes)
+
+        result = np.zeros(image.shape, dtype=np.float64)
+        total = np.zeros((height, width, 1), dtype=np.float64)
+        for (y, x, h, w), denoised in zip(boxes, tiles):
+            weights = self._tile_weights(h, w, overlap)
+            result[y:y + h, x:x + w] += denoised * weights
+            total[y:y + h, x:x + w] += weights
+        return result / total
+
     def denoise(self, image):
-        # BM3d works on  RGB, so swap the input BGR into RGB and then back
+        if self.profile not in self.profiles:
+            raise ValueError("Invalid profile {}, use one of {}".format(self.profile, ", ".join(self.profiles)))
+        if self.stage not in self.stages:
+            raise ValueError("Invalid stage {}, use one of {}".format(self.stage, ", ".join(self.stages)))
+        stage = self.stages[self.stage]
+
+        # BM3d works on  RGB, so swap the input BGR into RGB and then back. The color transform is
+        # the same bm3d.bm3d_rgb() does, but done here so the stage can be chosen and the image tiled
         img = self.swap_bgr_rgb(image)
-        result = self.swap_bgr_rgb(bm3d.bm3d_rgb(img, sigma_psd=self.sigma_psd))
+        transformed, o_max, o_min, scale, _ = bm3d.rgb_to(img, "opp")
+        sigma = self.sigma_psd * np.transpose(np.atleast_3d(np.sqrt(scale)), (0, 2, 1))
+
+        if self.tile_size:
+            denoised = self._denoise_tiles(transformed, sigma, stage)
+        else:
+            denoised = bm3d.bm3d(transformed, sigma, self.profile, stage)
+
+        result = self.swap_bgr_rgb(bm3d.rgb_to(denoised, "opp", True, o_max, o_min)[0])
         return np.clip(result, 0, 255).astype("uint8")
@@ -1 +1 @@
-from .cbdnet import CBDNet
\ No newline at end of file
+from .cbdnet import CBDNet
@@ -17,6 +17,18 @@ class CBDNet(nn.Module):
         return noise_level, out
 
 
+class RestoredOutput(nn.Module):
+    """ Wraps the network so that it returns only the restored images and not the estimated
+        noise level """
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x):
+        _, out = self.model(x)
+        return out
+
+
 class FCN(nn.Module):
     def __init__(self):
         super(FCN, self).__init__()
@@ -7,7 +7,10 @@ from keras.layers.normalization import BatchNormalization
 from keras.models import Model
 from keras.optimizers import Adam
 from . import Denoiser
+from collections import OrderedDict
+from skimage import img_as_float, restoration
 import numpy as np
+import time
 from tqdm import tqdm
 
 #import cv2
@@ -96,7 +99,14 @@ def define_model(num_u, num_d, kernel_u, kernel_d, num_s, kernel_s, height, widt
 def squared_error(y_true, y_pred):
     return K.sum(K.square(y_pred - y_true))
 
-def define_denoising_model(height, width):
+def define_denoising_model(height, width, count=1):
+    """
+    Define and compile a model made of @p count independent networks, one per image. The networks
+    are trained together (the total loss is the sum of the loss of each one, and they don't share
+    any weight), so their results are the same as training each network on its own, but the
+    framework gets larger graphs to spread over the cores.
+    :return: the compiled model and the list of networks
+    """
     num_u = [128, 128, 128, 128, 128]
     num_d = [128, 128, 128, 128, 128]
     kernel_u = [3, 3, 3, 3, 3]
@@ -106,10 +116,46 @@ def define_denoising_model(height, width):
     lr = 0.01
     inter = "bilinear"
 
-    model = define_model(num_u, num_d, kernel_u, kernel_d, num_s, kernel_s, height, width, inter, lr)
+    networks = [define_model(num_u, num_d, kernel_u, kernel_d, num_s, kernel_s, height, width, inter, lr)
+                for _ in range(count)]
+    if count == 1:
+        model = networks[0]
+    else:
+        model = Model([network.input for network in networks], [network.output for network in networks])
     model.compile(loss=squared_error, optimizer=Adam(lr=lr))
 
-    return model
+    return model, networks
+
+class EarlyStopping(object):
+    """ Tracks the loss of the fitting of one image and tells when to stop it """
+    def __init__(self, criterion, patience, min_delta, variance=None):
+        """
+        :param criterion: plateau, variance or none (see @ref DeepImagePrior)
+        :param variance: the variance of the noise, needed for the variance criterion
+        """
+        self.criterion = criterion
+        self.patience = patience
+        self.min_delta = min_delta
+        self.variance = variance
+        self.smoothed = None
+        self.best = np.inf
+        self.best_iteration = 0
+
+    def update(self, iteration, loss, size):
+        """ Return whether to stop after the given iteration with the given (summed) loss over
+            @p size values """
+        if self.criterion == "variance":
+            return loss / size <= self.variance
+
+        if self.criterion == "plateau":
+            # the loss is noisy because of the perturbation of the input, smooth it out
+            self.smoothed = loss if self.smoothed is None else 0.9 * self.smoothed + 0.1 * loss
+            if self.smoothed < self.best * (1 - self.min_delta):
+                self.best = self.smoothed
+                self.best_iteration = iteration
+            return iteration - self.best_iteration >= self.patience
+
+        return False
 
 class DeepImagePrior(Denoiser):
     """ Deep Image Prior denoiser
@@ -118,21 +164,167 @@ class DeepImagePrior(Denoiser):
         https://github.com/satoshi-kosugi/DeepImagePrior.git
 
         Paper:
-        https://arxiv.org/abs/1711.10925 """
+        https://arxiv.org/abs/1711.10925
+
+        The fitting stops after @ref max_iterations or earlier, depending on @ref stop_criterion:
+        * plateau: the (smoothed) loss didn't improve more than @ref min_delta (relative) in the
+          last @ref patience iterations
+        * variance: the residual between the output and the noisy image is down to the variance
+          of the noise estimated from the image, so the network would start fitting the noise
+        * none: always run @ref max_iterations
+
+        Compiled models are cached per input shape and get their weights re-initialized between
+        images.
+
+        @ref denoise_batch() fits up to @ref group_size images together, as independent networks
+        in a single graph. Every network starts from the same seeded weights and noise as in
+        @ref denoise(), so the results are the same as processing the images one by one. """
 
     name = "deep_image_prior"
     description = "Deep image prior denoiser"
     parallel = False
 
+    max_iterations = 1800
+    stop_criterion = "plateau"
+    patience = 100
+    min_delta = 1e-3
+
+    # the weights and the input noise are drawn from a generator seeded with this
+    seed = 0
+
+    # how many images denoise_batch() fits together (1 fits them one after the other)
+    group_size = 4
+
+    # per image: the activations kept for the backward pass, the inputs and outputs of the convolutions
+    # and batch normalizations (about 12 tensors of 128 channels in float32 at full resolution, 6KB per
+    # pixel) plus a third for the lower levels. Counting every intermediate tensor instead (16KB) left
+    # no room for a second 256x256 crop in the default --batch-memory, so nothing was ever grouped.
+    memory_per_pixel = 8192
+
+    runtime_options = ("max_iterations", "stop_criterion", "patience", "min_delta", "seed", "group_size")
+    # the grouped networks give the same results as the sequential ones, the rest changes the output
+    output_options = ("max_iterations", "stop_criterion", "patience", "min_delta", "seed")
+
+    # how many compiled models (one per input shape and group size) are kept around
+    max_cached_models = 2
+
+    def _model(self, height, width, count=1):
+        """ Return a compiled model for the given size and number of images, reusing the cached
+            ones """
+        if not hasattr(self, "_models"):
+            self._models = OrderedDict()
+
+        key = (height, width, count)
+        if key in self._models:
+            self._models.move_to_end(key)
+        else:
+            self._models[key] = define_denoising_model(height, width, count)
+            if len(self._models) > self.max_cached_models:
+                self._models.popitem(last=False)
+
+        return self._models[key]
+
+    @staticmethod
+    def _reset(model, networks, rngs):
+        """ Re-initialize the weights of each network (using the keras default initializers) with
+            its own generator, and the state of the optimizer """
+        values = []
+        for network, rng in zip(networks, rngs):
+            for weight in network.weights:
+                shape = K.int_shape(weight)
+                name = weight.name.split("/")[-1]
+                if name.startswith("kernel"):
+                    # glorot uniform
+                    receptive_field = np.prod(shape[:-2])
+                    limit = np.sqrt(6. / (receptive_field * (shape[-2] + shape[-1])))
+                    values.append((weight, rng.uniform(-limit, limit, shape).astype(np.float32)))
+                elif name.startswith("gamma") or name.startswith("moving_variance"):
+                    values.append((weight, np.ones(shape, dtype=np.float32)))
+                else:
+                    values.append((weight, np.zeros(shape, dtype=np.float32)))
+
+        values += [(weight, np.zeros(K.int_shape(weight), dtype=K.dtype(weight)))
+                   for weight in model.optimizer.weights]
+        K.batch_set_value(values)
+
+    def _noise_variance(self, image):
+        """ Estimate the variance of the noise of the image (in the 0-255 range) """
+        sigma = restoration.estimate_sigma(img_as_float(image), average_sigmas=True, multichannel=True)
+        return (sigma * 255) ** 2
+
+    def _fit(self, images):
+        """ Fit one network per image (all of the same size) at the same time and return the
+            denoised images. Each network gets its own generator seeded with @ref seed, so the
+            result for each image doesn't depend on the others. """
+        start = time.time()
+        height, width = images[0].shape[:2]
+        count = len(images)
+
+        model, networks = self._model(height, width, count)
+        rngs = [np.random.default_rng(self.seed) for _ in images]
+        self._reset(model, networks, rngs)
+
+        # all the buffers are allocated once and in float32, as that's what the model uses
+        input_noise = [rng.uniform(0, 0.1, (1, height, width, 32)).astype(np.float32) for rng in rngs]
+        perturbed = [np.empty_like(noise) for noise in input_noise]
+        targets = [image[None, :, :, :].astype(np.float32) for image in images]
+
+        stopping = [EarlyStopping(self.stop_criterion, self.patience, self.min_delta,
+                                  self._noise_variance(image) if self.stop_criterion == "variance" else None)
+                    for image in images]
+
+        outputs = [None] * count
+        self.run_info = [None] * count
+        running = list(range(count))
+
+        def snapshot(indices, iteration):
+            # the networks which are done keep training along the others, so keep their output
+            # from the iteration they stopped at
+            predictions = model.predict(input_noise)
+            if count == 1:
+                predictions = [predictions]
+            for index in indices:
+                outputs[index] = np.clip(predictions[index][0], 0, 255).astype(np.uint8)
+                self.run_info[index] = {
+                    "iterations": iteration,
+                    "converge_time": time.time() - start,
+                    "stopped_early": iteration < self.max_iterations,
+                }
+
+        iteration = 0
+        for iteration in tqdm(range(1, self.max_iterations + 1)):
+            for rng, buffer, noise in zip(rngs, perturbed, input_noise):
+                rng.standard_normal(dtype=np.float32, out=buffer)
+                buffer *= np.float32(1 / 30.0)
+                buffer += noise
+
+            # with several outputs keras returns the total loss followed by the loss of each one
+            losses = np.atleast_1d(model.train_on_batch(perturbed, targets))
+            if count > 1:
+                losses = losses[1:]
+
+            stopped = [i for i in running if stopping[i].update(iteration, float(losses[i]), targets[i].size)]
+            if stopped:
+                snapshot(stopped, iteration)
+                running = [i for i in running if i not in stopped]
+            if not running:
+                break
+
+        if running:
+            snapshot(running, iteration)
+
+        return outputs
+
     def denoise(self, image):
-        height, width = image.shape[:2]
-        model = define_denoising_model(height, width)
-        input_noise = np.random.uniform(0, 0.1, (1, height, width, 32))
+        return self._fit([image])[0]
 
-        for i in tqdm(range(1800)):
-            model.train_on_batch(input_noise + np.random.normal(0, 1/30.0, (height, width, 32)), image[None, :, :, :])
-            #if (i % 10) == 0:
-            #    cv2.imshow("preview", np.clip(model.predict(input_noise)[0], 0, 255).astype(np.uint8))
-            #    cv2.waitKey(1)
+    def denoise_batch(self, images):
+        results = []
+        info = []
+        size = max(1, self.group_size)
+        for start in range(0, len(images), size):
+            results += self._fit(images[start:start + size])
+            info += self.run_info
 
-        return np.clip(model.predict(input_noise)[0], 0, 255).astype(np.uint8)
+        self.run_info = info
+        return results
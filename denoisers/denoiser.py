@@ -1,7 +1,9 @@
 # Denoiser: base class for image denoisers
 
 from abc import ABC, abstractmethod
+import time
 import numpy as np
+from imagebuffer import OPENCV
 from metrics import default_metric
 
 class Denoiser(ABC):
@@ -16,11 +18,44 @@ class Denoiser(ABC):
 
     param_grid = {}
 
+    # bump whenever the implementation changes the output, so cached results get invalidated
+    version = 1
+
+    # a caching.DenoiseCache looked up by @ref predict() (e.g. during the parameter search)
+    output_cache = None
+
+    # a search.EvaluationStore looked up by @ref score() for the scores of single images
+    evaluation_store = None
+
+    # the imagebuffer.ImageFormat the denoiser works with internally
+    input_format = OPENCV
+
+    # attributes that change how the denoiser runs (not what it computes), recorded in the metadata
+    runtime_options = ()
+
+    # the runtime options which do change the output a bit (e.g. a lower precision), so the cached
+    # outputs and scores depend on them, unlike on the others (e.g. the number of threads)
+    output_options = ()
+
     parallel = True
 
+    # whether the denoiser spends its time in native code releasing the GIL, so it can run on
+    # threads in parallel instead of processes
+    releases_gil = False
+
+    # rough estimate of the memory (in bytes) needed per input pixel, used to size batches
+    memory_per_pixel = 64
+
+    # default memory budget for a batch of images given to @ref denoise_batch()
+    batch_memory = 1 << 30
+
     def __init__(self, **kwargs):
         # if used from sklearn (via score) use a default metric
         self._metric = None
+
+        # extra information about each image of the last denoise()/denoise_batch() call (like the
+        # number of iterations), which gets stored along the results
+        self.run_info = []
         self.set_params(**kwargs)
 
     @abstractmethod
@@ -30,6 +65,66 @@ class Denoiser(ABC):
             :type image: ndarray"""
         pass
 
+    def denoise_converted(self, image):
+        """ Process an image already converted to @ref input_format. Sub-classes with an input
+            format other than opencv's need to override it, so @ref denoise_buffer() can skip the
+            conversion when another consumer did it already.
+            :type image: ndarray"""
+        return self.denoise(image)
+
+    def denoise_buffer(self, buffer):
+        """ Process the image of the given imagebuffer.ImageBuffer, reusing its conversion to
+            @ref input_format if there's one """
+        return self.denoise_converted(buffer.get(self.input_format))
+
+    def denoise_batch(self, images):
+        """ Process a list of images of the same size and return the list of processed images.
+            The default implementation just calls @ref denoise() for each of them, sub-classes
+            that can process multiple images at once should override it.
+            :type images: list of ndarray"""
+        results = []
+        info = []
+        for image in images:
+            self.run_info = []
+            results.append(self.denoise(image))
+            info += self.run_info
+
+        self.run_info = info
+        return results
+
+    @property
+    def batched(self):
+        """ Whether the denoiser processes the images of a batch at once (overrides @ref denoise_batch()) """
+        return type(self).denoise_batch is not Denoiser.denoise_batch
+
+    def estimate_memory(self, shape):
+        """
+        Estimate the peak memory needed to denoise one image of the given shape
+        :param shape: the shape of the input image
+        :return: the estimated memory in bytes
+        """
+        height, width = shape[:2]
+        return height * width * self.memory_per_pixel
+
+    def batch_indices(self, images, memory_limit=None):
+        """
+        Group the given images in batches of same shaped images fitting in the given memory limit
+        :param images: the list of images to be grouped
+        :param memory_limit: the memory budget for each batch (default: @ref batch_memory)
+        :return: a generator of lists of indices of the images in each batch
+        """
+        if memory_limit is None:
+            memory_limit = self.batch_memory
+
+        groups = {}
+        for index, image in enumerate(images):
+            groups.setdefault(image.shape, []).append(index)
+
+        for shape, indices in groups.items():
+            size = max(1, int(memory_limit // self.estimate_memory(shape)))
+            for start in range(0, len(indices), size):
+                yield indices[start:start + size]
+
     @classmethod
     def swap_bgr_rgb(cls, image):
         """
@@ -41,7 +136,19 @@ class Denoiser(ABC):
 
     # implement Scikit-learn estimator interface to make it easier to do grid search on denoisers
     def get_params(self, deep=False):
-        return {p: getattr(self, p) for p in self.param_grid.keys()}
+        params = {p: getattr(self, p) for p in self.param_grid.keys()}
+        # sklearn creates the estimators from these, so the cache needs to be passed along too
+        if self.output_cache is not None:
+            params["output_cache"] = self.output_cache
+        if self.evaluation_store is not None:
+            params["evaluation_store"] = self.evaluation_store
+        return params
+
+    def get_runtime_options(self):
+        return {o: getattr(self, o) for o in self.runtime_options}
+
+    def get_output_options(self):
+        return {o: getattr(self, o) for o in self.output_options}
 
     def set_params(self, **kwargs):
         for key, value in kwargs.items():
@@ -52,13 +159,95 @@ class Denoiser(ABC):
         return self
 
     def predict(self, noisy_images):
-        return np.array([self.denoise(noisy) for noisy in noisy_images])
-
-    def score(self, noisy_images, ref_images):
-        results = self.predict(noisy_images)
-
+        # stacked inputs (e.g. the memory mapped crops of param_search.py) get a preallocated stacked
+        # output, filled as the batches finish instead of copying all the results at the end
+        stacked = isinstance(noisy_images, np.ndarray) and len(noisy_images) > 0
+        results = None if stacked else [None] * len(noisy_images)
+
+        def store(index, result):
+            nonlocal results
+            if results is None:
+                results = np.empty((len(noisy_images),) + result.shape, dtype=result.dtype)
+            results[index] = result
+
+        # only denoise the images whose output is not cached
+        missing = list(range(len(noisy_images)))
+        if self.output_cache is not None:
+            missing = []
+            for index, image in enumerate(noisy_images):
+                cached = self.output_cache.get(self, image)
+                if cached is None:
+                    missing.append(index)
+                else:
+                    store(index, cached[0])
+
+        images = [noisy_images[i] for i in missing]
+        for indices in self.batch_indices(images):
+            start = time.time()
+            self.run_info = []
+            denoised = self.denoise_batch([images[i] for i in indices])
+            duration = (time.time() - start) / len(indices)
+            infos = self.run_info if len(self.run_info) == len(indices) else [{}] * len(indices)
+
+            for index, result, info in zip(indices, denoised, infos):
+                store(missing[index], result)
+                if self.output_cache is not None:
+                    self.output_cache.put(self, images[index], result, duration, info)
+
+        if stacked:
+            return results
+        return np.array(results)
+
+    def score_images(self, noisy_images, ref_images):
+        """
+        Score the denoised images one batch at a time, so the caller can stop early (e.g. to prune
+        bad parameters during the search)
+        :return: a generator of (index, value) tuples in the order of the images (the pruning
+                 compares the running means of the candidates image by image), the stored scores
+                 merged with the computed ones
+        """
         if not self._metric:
             self._metric = default_metric()
 
+        # only denoise the images whose score is not stored yet
+        values = {}
+        missing = []
+        for index, (noisy, ref) in enumerate(zip(noisy_images, ref_images)):
+            value = None
+            if self.evaluation_store is not None:
+                value = self.evaluation_store.get(self, self._metric, noisy, ref)
+            if value is None:
+                missing.append(index)
+            else:
+                values[index] = value
+
+        # the denoisers which don't process batches at once are scored image by image, so the caller
+        # can stop right after any of them
+        if not self.batched:
+            batches = [[index] for index in missing]
+        else:
+            batches = [[missing[i] for i in indices]
+                       for indices in self.batch_indices([noisy_images[i] for i in missing])]
+        batch_of = {index: batch for batch in batches for index in batch}
+
+        for index in range(len(noisy_images)):
+            if index not in values:
+                # the batch of the next image (with later images, if they have the same shape)
+                batch = batch_of[index]
+                if isinstance(noisy_images, np.ndarray) and batch == list(range(batch[0], batch[-1] + 1)):
+                    # a view keeps the input stacked, so predict() doesn't copy the results
+                    results = self.predict(noisy_images[batch[0]:batch[-1] + 1])
+                else:
+                    results = self.predict([noisy_images[i] for i in batch])
+
+                for i, result in zip(batch, results):
+                    values[i] = self._metric.compare(ref_images[i], result)
+                    if self.evaluation_store is not None:
+                        self.evaluation_store.put(self, self._metric, noisy_images[i], ref_images[i], values[i])
+            yield index, values.pop(index)
+
+    def score(self, noisy_images, ref_images):
+        values = [value for _, value in self.score_images(noisy_images, ref_images)]
+
         # return the average value of the default metric for the denoised images
-        return np.array([self._metric.compare(ref, res) for ref, res in zip(ref_images, results)]).mean()
+        return np.array(values).mean()
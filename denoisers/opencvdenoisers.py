@@ -3,7 +3,12 @@ import cv2
 from scipy.stats import uniform
 
 
-class FastNLMeansDenoiser(Denoiser):
+class OpenCVDenoiser(Denoiser):
+    """ Base class for the denoisers implemented in OpenCV, which release the GIL while running """
+    releases_gil = True
+
+
+class FastNLMeansDenoiser(OpenCVDenoiser):
     """ Non-Linear Means denoiser
 
     This denoiser is implemented in opencv and is based on the following reference:
@@ -17,6 +22,9 @@ class FastNLMeansDenoiser(Denoiser):
     template_window_size = 3
     search_window_size = 23
 
+    # the window sizes were ignored before
+    version = 2
+
     param_grid = {
         "h": range(3, 15),
         "h_color": range(9,30),
@@ -24,9 +32,11 @@ class FastNLMeansDenoiser(Denoiser):
         "search_window_size": range(7, 26, 2),
     }
     def denoise(self, image):
-        return cv2.fastNlMeansDenoisingColored(image, h=self.h, hColor=self.h_color)
+        return cv2.fastNlMeansDenoisingColored(image, h=self.h, hColor=self.h_color,
+                                               templateWindowSize=self.template_window_size,
+                                               searchWindowSize=self.search_window_size)
 
-class BlurDenoiser(Denoiser):
+class BlurDenoiser(OpenCVDenoiser):
     """ Regular blur filter
 
     This denoiser is implemented in opencv
@@ -43,7 +53,7 @@ class BlurDenoiser(Denoiser):
     def denoise(self, image):
         return cv2.blur(image, ksize=(self.kernel_size,self.kernel_size))
 
-class GaussianBlurDenoiser(Denoiser):
+class GaussianBlurDenoiser(OpenCVDenoiser):
     """ Gaussian blur filter
 
     This denoiser is implemented in opencv
@@ -66,7 +76,7 @@ class GaussianBlurDenoiser(Denoiser):
         return cv2.GaussianBlur(image, ksize=(self.kernel_size, self.kernel_size),
                                 sigmaX=self.sigma_x, sigmaY=self.sigma_y)
 
-class MedianBlurDenoiser(Denoiser):
+class MedianBlurDenoiser(OpenCVDenoiser):
     """Median blur filter
 
     This denoiser is implemented in opencv
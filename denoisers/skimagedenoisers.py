@@ -2,34 +2,59 @@ from . import Denoiser
 from abc import abstractmethod
 from scipy.stats import uniform
 from skimage import restoration
-from skimage import img_as_float, img_as_ubyte
+from imagebuffer import ImageBuffer, ImageFormat
 import numpy as np
 import pywt
 
 class SKImageDenoiser(Denoiser):
     """  In order to run SKImage denoisers we need to tweak the image
         format. This class wraps the @ref denoise() call to do the image conversion
-        accordingly """
+        accordingly
+
+        The images are processed in @ref working_dtype: float32 halves the memory (and often the
+        time) compared to the float64 img_as_float() gives, for a negligible difference in the
+        results (see benchmarks/skimage_precision.py). """
+
+    # float32 or float64
+    working_dtype = "float32"
+
+    runtime_options = ("working_dtype",)
+    output_options = ("working_dtype",)
+
+    # a few float copies of the image (measured up to ~130 bytes per pixel in float64)
+    memory_per_pixel = 128
+
+    @property
+    def input_format(self):
+        # openCV images are BGR and skimage uses RGB in floats
+        return ImageFormat("rgb", self.working_dtype, "hwc")
 
     @abstractmethod
     def _denoise(self, image):
         pass
 
     def denoise(self, image):
-        # openCV images are BGR and skimage uses RGB, so invert the last and convert to float
-        img = img_as_float(self.swap_bgr_rgb(image), force_copy=True)
+        return self.denoise_converted(ImageBuffer(image).get(self.input_format))
 
-        # and invert back to BGR for comparing
-        result = self.swap_bgr_rgb(self._denoise(img))
+    def denoise_converted(self, image):
+        # invert back to BGR for comparing
+        result = self.swap_bgr_rgb(self._denoise(image))
+        if np.may_share_memory(result, image):
+            # the input is shared with other consumers, so don't convert it in place below
+            result = result.copy()
 
         # not sure why but on some images there are values outside the range -1 and 1
-        if result.min() < -1. or result.max() > 1:
+        low, high = result.min(), result.max()
+        if low < -1. or high > 1:
             print("WARNING: image has values outside of range -1, 1, clipping:")
-            print("         min: {} max: {}".format(result.min(), result.max()))
-            result = np.clip(result, -1, 1)
+            print("         min: {} max: {}".format(low, high))
 
-        # convert back to ubyte for comparing
-        return img_as_ubyte(result)
+        # convert back to ubyte for comparing (same as img_as_ubyte() after clipping to 0-1, but
+        # in place instead of allocating temporaries)
+        np.clip(result, 0, 1, out=result)
+        np.multiply(result, 255, out=result)
+        np.rint(result, out=result)
+        return result.astype(np.uint8)
 
 class BilateralDenoiser(SKImageDenoiser):
     """ Bilateral denoiser
@@ -79,6 +104,9 @@ class NLMeansDenoiser(SKImageDenoiser):
         "h": uniform(),
     }
 
+    # measured slower in float32 than in float64, so it keeps the precision img_as_float() gives
+    working_dtype = "float64"
+
     def _denoise(self, image):
         sigma = restoration.estimate_sigma(image, average_sigmas=True, multichannel=True)
         return restoration.denoise_nl_means(image, sigma=sigma, fast_mode=False, multichannel=True)
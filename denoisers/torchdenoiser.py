@@ -0,0 +1,274 @@
+from abc import abstractmethod
+from collections import OrderedDict
+import copy
+import inspect
+import os
+import numpy as np
+from . import Denoiser
+
+# torch is only imported when the torch backend is used: the onnx backend doesn't need it and
+# importing it takes seconds on every worker process
+
+class TorchDenoiser(Denoiser):
+    """
+    Base class for denoisers based on pytorch networks
+
+    This class converts between the opencv images (BGR, HWC, uint8) and the NCHW float tensors
+    expected by the networks, stacking same sized images in a single batch. Sub-classes need to
+    create the model in @ref _create_model() and tell where its ONNX export goes in @ref onnx_file().
+    The model is only created when first used.
+
+    The images are converted straight into a NHWC float buffer, which torch sees as a NCHW tensor
+    in channels_last memory format, so no other copies are made on the way in or out of the network.
+    When @ref optimize is set the model is traced and frozen with TorchScript for each input shape.
+
+    The @ref precision can be reduced to trade quality for speed:
+    * fp32: the pre-trained model as is
+    * bf16: run the model under bfloat16 autocast
+    * int8: static int8 quantization (FX graph mode), calibrated with the images given to
+      @ref calibrate(). Dynamic quantization is not offered as it only covers linear and recurrent
+      layers, which these convolutional networks don't have.
+
+    With the "onnx" @ref backend the network exported by @ref export_onnx() runs on onnxruntime
+    (CPU only, fp32) and neither torch nor the weights are loaded.
+    """
+
+    parallel = False
+
+    # the intermediate feature maps (64+ channels of float32 at full resolution) dominate
+    memory_per_pixel = 2048
+
+    # trace and freeze the model with TorchScript
+    optimize = False
+
+    # one of fp32, bf16 or int8
+    precision = "fp32"
+    precisions = ("fp32", "bf16", "int8")
+
+    # one of torch or onnx
+    backend = "torch"
+    backends = ("torch", "onnx")
+
+    # number of threads used by onnxruntime inside each operator (0 lets onnxruntime decide)
+    threads = 0
+
+    runtime_options = ("optimize", "precision", "backend", "threads")
+    output_options = ("precision",)
+
+    # how many traced models (one per input shape) are kept around
+    max_traced_models = 4
+
+    def __init__(self, use_gpu=False):
+        super().__init__()
+        self._use_gpu = use_gpu
+        self._gpu_available = False
+        self._device = None
+        self._model = None
+        self._traced = OrderedDict()
+        self._quantized = None
+        self._session = None
+
+    @abstractmethod
+    def _create_model(self):
+        """ Create the network and load its pre-trained weights. The returned module needs to take
+            a NCHW batch (RGB, range 0-1) and return only the restored batch """
+        pass
+
+    @abstractmethod
+    def onnx_file(self):
+        """ Return the path of the ONNX export of the model """
+        pass
+
+    @property
+    def device(self):
+        """ The torch device the model runs on """
+        if self._device is None:
+            import torch
+            self._gpu_available = self._use_gpu and torch.cuda.is_available()
+            self._device = torch.device("cuda" if self._gpu_available else "cpu")
+            print("Using {}!".format("GPU" if self._gpu_available else "CPU"))
+        return self._device
+
+    @property
+    def model(self):
+        """ The torch model, created on first use """
+        if self._model is None:
+            import torch
+            device = self.device
+            model = self._create_model()
+            model.to(device, memory_format=torch.channels_last)
+            model.eval()
+            self._model = model
+
+        return self._model
+
+    def calibrate(self, images):
+        """
+        Quantize the model to int8, using the given images to calibrate the range of the activations
+        :param images: list of opencv images representative of the ones to be denoised
+        """
+        import torch
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+        model = self.model
+        if self._gpu_available:
+            raise ValueError("int8 quantization is only supported on CPU")
+
+        with torch.no_grad():
+            example = self._to_batch(images[:1])
+            prepared = prepare_fx(copy.deepcopy(model), get_default_qconfig_mapping("x86"), (example,))
+            for image in images:
+                prepared(self._to_batch([image]))
+            self._quantized = convert_fx(prepared)
+
+        # drop the traced versions of the previous quantized model
+        for key in [k for k in self._traced if k[0] == "int8"]:
+            del self._traced[key]
+
+    def export_onnx(self, path=None, opset=13):
+        """
+        Export the fp32 model to ONNX. The exported graph takes and returns NHWC batches, so that
+        the image buffers can be given to onnxruntime without copying, and has dynamic batch and
+        spatial dimensions.
+        :param path: the target file (default: @ref onnx_file())
+        :param opset: the ONNX opset version
+        :return: the path of the exported file
+        """
+        import torch
+
+        class NHWCModel(torch.nn.Module):
+            def __init__(self, model):
+                super().__init__()
+                self.model = model
+
+            def forward(self, x):
+                return self.model(x.permute(0, 3, 1, 2)).permute(0, 2, 3, 1)
+
+        path = path or self.onnx_file()
+        wrapper = NHWCModel(self.model).to("cpu").eval()
+        example = torch.rand(1, 64, 64, 3)
+        axes = {0: "batch", 1: "height", 2: "width"}
+        kwargs = {}
+        if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+            # the dynamo based exporter doesn't take dynamic_axes
+            kwargs["dynamo"] = False
+
+        with torch.no_grad():
+            torch.onnx.export(wrapper, (example,), path, input_names=["input"], output_names=["output"],
+                              dynamic_axes={"input": axes, "output": axes}, opset_version=opset, **kwargs)
+
+        self.model.to(self.device)
+        return path
+
+    def _onnx_session(self):
+        """ Return the onnxruntime session, exporting the model first if needed """
+        if self._session is None:
+            import onnxruntime
+
+            path = self.onnx_file()
+            if not os.path.exists(path):
+                print("{} has not been exported to ONNX yet, exporting to {}".format(self.name, path))
+                self.export_onnx(path)
+
+            session_options = onnxruntime.SessionOptions()
+            session_options.intra_op_num_threads = self.threads
+            session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            self._session = onnxruntime.InferenceSession(path, session_options,
+                                                         providers=["CPUExecutionProvider"])
+        return self._session
+
+    def set_params(self, **kwargs):
+        # a different thread count needs a new session
+        if "threads" in kwargs and kwargs["threads"] != self.threads:
+            self._session = None
+        return super().set_params(**kwargs)
+
+    def _precision_model(self):
+        """ Return the model for the selected @ref precision """
+        if self.precision not in self.precisions:
+            raise ValueError("Invalid precision {}, use one of {}".format(self.precision, ", ".join(self.precisions)))
+
+        return self._quantized if self.precision == "int8" else self.model
+
+    def _traced_model(self, model, batch):
+        """ Return the TorchScript version of the model for the shape of the given batch """
+        import torch
+
+        key = (self.precision, tuple(batch.shape))
+        if key in self._traced:
+            self._traced.move_to_end(key)
+            return self._traced[key]
+
+        # tracing doesn't work with inference tensors, so use a regular one as example
+        with torch.no_grad():
+            example = torch.zeros_like(batch, device=self.device, memory_format=torch.channels_last)
+            # optimize_for_inference() is left out on purpose: it converts the channels_last
+            # tensors to mkldnn layouts and back, which ends up slower on CPU
+            traced = torch.jit.freeze(torch.jit.trace(model, example).eval())
+
+        self._traced[key] = traced
+        if len(self._traced) > self.max_traced_models:
+            self._traced.popitem(last=False)
+        return traced
+
+    def _to_array(self, images):
+        """ Convert the images into a single NHWC float32 RGB buffer in the 0-1 range """
+        height, width, channels = images[0].shape
+        batch = np.empty((len(images), height, width, channels), dtype=np.float32)
+        for target, image in zip(batch, images):
+            np.multiply(self.swap_bgr_rgb(image), np.float32(1. / 255), out=target)
+        return batch
+
+    def _from_array(self, output):
+        """ Convert a NHWC float RGB buffer back to a list of opencv images, reusing the buffer """
+        np.clip(output, 0, 1, out=output)
+        np.multiply(output, 255, out=output)
+        np.rint(output, out=output)
+        return [self.swap_bgr_rgb(image).astype(np.uint8) for image in output]
+
+    def _to_batch(self, images):
+        """ Convert the images into a NCHW float tensor in channels_last memory format """
+        import torch
+        return torch.from_numpy(self._to_array(images)).to(self.device).permute(0, 3, 1, 2)
+
+    def _from_batch(self, output):
+        """ Convert the NCHW output of the network back to a list of opencv images """
+        return self._from_array(output.permute(0, 2, 3, 1).cpu().numpy())
+
+    def _run(self, batch):
+        """ Run the model (or its optimized version) on the given batch """
+        import torch
+        model = self._precision_model()
+
+        if self.precision == "bf16":
+            # autocast can't be frozen in a TorchScript graph, so bf16 always runs in eager mode
+            with torch.autocast(self.device.type, dtype=torch.bfloat16):
+                return model(batch).float()
+
+        if self.optimize:
+            model = self._traced_model(model, batch)
+        return model(batch)
+
+    def denoise(self, image):
+        return self.denoise_batch([image])[0]
+
+    def denoise_batch(self, images):
+        if self.backend not in self.backends:
+            raise ValueError("Invalid backend {}, use one of {}".format(self.backend, ", ".join(self.backends)))
+
+        if self.backend == "onnx":
+            if self.precision != "fp32":
+                raise ValueError("The onnx backend only supports the fp32 precision")
+            session = self._onnx_session()
+            return self._from_array(session.run(None, {"input": self._to_array(images)})[0])
+
+        import torch
+
+        if self.precision == "int8" and self._quantized is None:
+            print("WARNING: {} was not calibrated for int8, calibrating with the current images".format(self.name))
+            self.calibrate(images)
+
+        # torch.inference_mode is only available on recent versions of pytorch
+        with getattr(torch, "inference_mode", torch.no_grad)():
+            return self._from_batch(self._run(self._to_batch(images)))
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+
+from argparse import ArgumentParser
+from denoise_comparator import check_invalid
+import denoisers
+
+# the denoisers that can run on onnxruntime
+onnx_denoisers = ["cbdnet", "cycleisp"]
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--denoisers", action="store", nargs="+", metavar=("DENOISER1", "DENOISER2"),
+                        help="Denoisers to export (default: all)", default="all")
+    parser.add_argument("--opset", action="store", type=int, default=13,
+                        help="ONNX opset version (default: 13)")
+    options = parser.parse_args()
+
+    options.denoisers = check_invalid("denoisers", options.denoisers, onnx_denoisers, True)
+    if not options.denoisers:
+        exit(1)
+
+    for name in options.denoisers:
+        denoiser = denoisers.create(name)
+        print("Exporting {} to {}".format(name, denoiser.onnx_file()))
+        denoiser.export_onnx(opset=options.opset)
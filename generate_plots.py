@@ -1,10 +1,18 @@
 #!/usr/bin/env python3
 
-import pandas as pd
+import matplotlib
+# the figures are only saved to files, and rendered in worker processes
+matplotlib.use("Agg")
+
+import hashlib
+import json
 import os
+import pandas as pd
 import seaborn as sbn
 from matplotlib import pyplot as plt
 from argparse import ArgumentParser
+from joblib import Parallel, delayed
+from resultstore import open_results
 
 class Figure:
     def __init__(self, basedir, name, formats):
@@ -20,18 +28,73 @@ class Figure:
             self.fig.savefig(os.path.join(self.basedir, "{}.{}".format(self.name, fmt)))
         plt.close(self.fig)
 
+def draw_hist(data, xlabel, bins=20):
+    data.hist(bins=bins)
+    plt.xlabel(xlabel)
+
+def draw_scatter(data, x, y, xlabel, ylabel):
+    sbn.scatterplot(data=data, x=x, y=y)
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+
+def draw_barplot(data, xlabel):
+    ax = sbn.barplot(x=data, y=data.index)
+    ax.set(xlabel=xlabel, ylabel="")
+    plt.tight_layout()
+
+def draw_hists(data):
+    """ One histogram per column, e.g. the runtimes of each denoiser """
+    for column in data.columns:
+        plt.hist(data[column].dropna())
+    plt.legend(list(data.columns), ncol=2)
+
+def draw_heatmap(data):
+    sbn.heatmap(data, annot=True)
+
+def render(basedir, name, formats, draw, data, spec):
+    with Figure(basedir, name, formats):
+        draw(data, **spec)
+
+def digest(draw, data, spec, formats):
+    """ Hash of everything a figure is drawn from, to know whether it changed since it was saved """
+    hasher = hashlib.sha1(json.dumps([draw.__name__, spec, formats], sort_keys=True, default=str).encode())
+    hasher.update(pd.util.hash_pandas_object(data, index=True).values.tobytes())
+    if isinstance(data, pd.DataFrame):
+        hasher.update(json.dumps([str(c) for c in data.columns]).encode())
+    return hasher.hexdigest()
+
 class ResultPlotter:
-    def __init__(self, csv_file, formats):
-        self.csv_file = csv_file
+    """
+    Plots of the results of denoise_comparator.py
+
+    Each figure is a job drawn from a slice of the data (e.g. the values of one metric for one
+    denoiser and the noisy images), computed once from the pivots shared by all the figures, and the
+    jobs are rendered in parallel. The hash of the slice and of the plot specification of each saved
+    figure is kept in the manifest.json of the plots directory, so only the figures whose data changed
+    are rendered again.
+    """
+
+    def __init__(self, results_file, formats, n_jobs=-1, force=False):
+        """
+        :param n_jobs: the number of processes rendering the figures (-1 for all the cores)
+        :param force: render all the figures, even the ones that didn't change
+        """
+        self.results_file = results_file
         self.formats = formats
-        # get the data
-        self.data = pd.read_csv(options.csv_file, index_col=0)
+        self.n_jobs = n_jobs
+        self.force = force
+        self.jobs = []
+        # get the data, each metric is pivoted once for all the figures
+        self.store = open_results(results_file)
+        self.pivots = {metric: self.store.pivot(metric) for metric in self.store.metrics()}
 
         # prepare the target directory to store the plots
         self.target_path = self.prepare_target_dir()
+        self.manifest_file = os.path.join(self.target_path, "manifest.json")
 
-    def figure(self, name):
-        return Figure(self.target_path, name, self.formats)
+    def figure(self, name, draw, data, **spec):
+        """ Add the job of a figure, drawn by calling @ref draw with the data and the spec """
+        self.jobs.append((name, draw, data, spec))
 
     def plot_all(self):
         # histogram of metrics between noisy and ref
@@ -49,79 +112,85 @@ class ResultPlotter:
         # correlation between coeficients
         self.plot_correlation_metrics()
 
-    def plot_dataset_noise_shape(self):
-        data = self.data # for short
-        noisy_metrics = data[data.denoiser == "none"]
+        self.render()
+
+        # the statistics of each metric, printed once by the main process
+        self.describe()
+
+    def describe(self):
+        for metric, pivot in self.pivots.items():
+            print(metric)
+            print(pivot.rename(columns={"none": "Imagem com ruído"}).describe())
+
+    def render(self):
+        manifest = {}
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file) as f:
+                manifest = json.load(f)
+
+        pending = []
+        for name, draw, data, spec in self.jobs:
+            key = digest(draw, data, spec, self.formats)
+            saved = all(os.path.exists(os.path.join(self.target_path, "{}.{}".format(name, fmt)))
+                        for fmt in self.formats)
+            if self.force or not saved or manifest.get(name) != key:
+                pending.append((name, draw, data, spec, key))
+
+        print("Rendering {} of {} figures".format(len(pending), len(self.jobs)))
+        Parallel(n_jobs=self.n_jobs)(delayed(render)(self.target_path, name, self.formats, draw, data, spec)
+                                     for name, draw, data, spec, _ in pending)
+
+        for name, _, _, _, key in pending:
+            manifest[name] = key
+        temp_file = self.manifest_file + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump(manifest, f, indent=4, sort_keys=True)
+        os.replace(temp_file, self.manifest_file)
+        self.jobs = []
 
-        for metric, metric_data in noisy_metrics.groupby("metric"):
-            with self.figure("dataset_noise_{}".format(metric)):
-                metric_data.value.hist(bins=20)
-                plt.xlabel(metric.upper())
+    def plot_dataset_noise_shape(self):
+        for metric, pivot in self.pivots.items():
+            if "none" not in pivot:
+                continue
+            self.figure("dataset_noise_{}".format(metric), draw_hist, pivot["none"], xlabel=metric.upper())
 
     def scatter_denoisers_vs_noisy(self):
-        data = self.data
-        for metric, metric_data in data.groupby("metric"):
+        for metric, pivot in self.pivots.items():
+            if "none" not in pivot:
+                continue
             # get the denoiser names
-            denoisers = [d for d in metric_data.denoiser.unique() if d != "none"]
-            pivot = metric_data.pivot_table(index="image", columns="denoiser", values="value")
+            denoisers = [d for d in pivot.columns if d != "none"]
             for denoiser in denoisers:
-                with self.figure("scatter_{}_noisy_vs_{}".format(metric, denoiser)):
-                    sbn.scatterplot(data = pivot, x=denoiser, y="none")
-                    plt.xlabel(denoiser)
-                    plt.ylabel("Imagem com ruído")
+                # only the two columns, so adding a denoiser doesn't redraw the others
+                self.figure("scatter_{}_noisy_vs_{}".format(metric, denoiser), draw_scatter,
+                            pivot[[denoiser, "none"]], x=denoiser, y="none", xlabel=denoiser,
+                            ylabel="Imagem com ruído")
 
     def plot_average_per_metric(self):
-        data = self.data
-        for metric, metric_data in data.groupby("metric"):
-            metric_data = metric_data.copy()
-            metric_data.denoiser = metric_data.denoiser.str.replace("none", "Imagem com ruído")
-            pivot = metric_data.pivot_table(index="image", columns="denoiser", values="value")
-
-            print(pivot.describe())
-            mean = pivot.mean()
-            with self.figure("barplot_mean_{}".format(metric)):
-                ax = sbn.barplot(x=mean, y=mean.index)
-                ax.set(xlabel=metric.upper(), ylabel="")
-                plt.tight_layout()
+        for metric, pivot in self.pivots.items():
+            pivot = pivot.rename(columns={"none": "Imagem com ruído"})
+            self.figure("barplot_mean_{}".format(metric), draw_barplot, pivot.mean(), xlabel=metric.upper())
 
     def plot_runtime(self):
-        data = self.data
-        # grab the runtime from one of the metrics
-        metric = data.metric.unique()[0]
-        denoiser_data = data[(data.denoiser != "none") & (data.metric == metric)]
+        # the runtime is stored once per image and denoiser
+        runtimes = self.store.runtimes()
+        runtimes = runtimes[runtimes.denoiser != "none"]
 
         # now pivot the table to get the average runtime
-        pivot = denoiser_data.pivot_table(index=["image", "metric"], columns="denoiser", values="time")
-        mean = pivot.mean()
-
-        with self.figure("runtime_average"):
-            ax = sbn.barplot(x=mean, y=mean.index)
-            ax.set(xlabel="Tempo médio (s)", ylabel="")
-            plt.tight_layout()
+        pivot = runtimes.pivot_table(index="image", columns="denoiser", values="time", observed=True)
+        self.figure("runtime_average", draw_barplot, pivot.mean(), xlabel="Tempo médio (s)")
 
         # and the total time
-        acc = pivot.sum()
-        with self.figure("runtime_total"):
-            ax = sbn.barplot(x=acc, y=acc.index)
-            ax.set(xlabel="Tempo total (s)", ylabel="")
-            plt.tight_layout()
-
-        with self.figure("runtime_hist"):
-            legend = []
-            for denoiser, den_data in data[data.denoiser != "none"].groupby("denoiser"):
-                legend.append(denoiser)
-                plt.hist(den_data[den_data.metric == "psnr"].time)
-            plt.legend(legend, ncol=2)
+        self.figure("runtime_total", draw_barplot, pivot.sum(), xlabel="Tempo total (s)")
 
-    def plot_correlation_metrics(self):
-        data = self.data
-        pivot = data.pivot_table(index=["image", "denoiser"], columns="metric", values="value")
+        self.figure("runtime_hist", draw_hists, pivot)
 
-        with self.figure("heatmap_metric_corr"):
-            sbn.heatmap(pivot.corr(), annot=True)
+    def plot_correlation_metrics(self):
+        wide = self.store.wide()
+        self.figure("heatmap_metric_corr", draw_heatmap, wide[self.store.metrics()].corr())
 
     def prepare_target_dir(self):
-        dirname = self.csv_file.replace(".csv", "") + "_plots"
+        dirname = os.path.splitext(self.results_file)[0] + "_plots"
         if not os.path.exists(dirname):
             os.mkdir(dirname)
         return dirname
@@ -129,7 +198,11 @@ class ResultPlotter:
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("--format", "-f", action="append")
-    parser.add_argument("csv_file", help="The CSV file with the results that should be plotted")
+    parser.add_argument("--jobs", "-j", type=int, default=-1,
+                        help="Number of processes rendering the figures (default: all the cores)")
+    parser.add_argument("--force", action="store_true",
+                        help="Render all the figures, even the ones whose data didn't change")
+    parser.add_argument("results_file", help="The CSV (or .sqlite) file with the results that should be plotted")
     options = parser.parse_args()
 
     global formats
@@ -138,5 +211,5 @@ if __name__ == "__main__":
     if not formats:
         formats = ["eps"]
 
-    plotter = ResultPlotter(options.csv_file, formats)
-    plotter.plot_all()
\ No newline at end of file
+    plotter = ResultPlotter(options.results_file, formats, options.jobs, options.force)
+    plotter.plot_all()
@@ -0,0 +1,113 @@
+"""
+Image container that converts between the formats used by the different libraries lazily, doing
+each conversion at most once per image
+"""
+
+from collections import namedtuple
+import numpy as np
+
+# the value range is implied by the dtype: 0-255 for uint8 and 0-1 for floats
+ImageFormat = namedtuple("ImageFormat", ["order", "dtype", "layout"])
+
+# the format of the images read by opencv, used everywhere else in the code
+OPENCV = ImageFormat("bgr", "uint8", "hwc")
+
+# what img_as_float() gives to the skimage functions
+SKIMAGE = ImageFormat("rgb", "float64", "hwc")
+
+# the NCHW float tensors of the torch networks (without the batch dimension)
+TORCH = ImageFormat("rgb", "float32", "chw")
+
+
+class ConversionStatistics(object):
+    """ Counters of the conversions done by the image buffers of the current process """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.conversions = 0
+        self.copied_bytes = 0
+        self.reused = 0
+        self.saved_bytes = 0
+
+    def to_dict(self):
+        return {
+            "conversions": self.conversions,
+            "copied_bytes": self.copied_bytes,
+            "reused": self.reused,
+            "saved_bytes": self.saved_bytes,
+        }
+
+statistics = ConversionStatistics()
+
+
+def convert(image, source, target):
+    """
+    Convert an image between two formats. Changes of color order and layout are views, only the
+    dtype changes copy the data.
+    :param image: the image (ndarray) in the @ref source format
+    :return: the image in the @ref target format and whether it's a copy
+    """
+    if source.layout == "chw":
+        image = image.transpose(1, 2, 0)
+    if source.order != target.order:
+        image = image[:, :, ::-1]
+
+    copied = source.dtype != target.dtype
+    if copied:
+        if source.dtype == "uint8":
+            image = np.multiply(image, 1. / 255, dtype=target.dtype)
+        elif target.dtype == "uint8":
+            image = np.clip(image, 0, 1)
+            np.multiply(image, 255, out=image)
+            np.rint(image, out=image)
+            image = image.astype(np.uint8)
+        else:
+            image = image.astype(target.dtype)
+
+    if target.layout == "chw":
+        image = image.transpose(2, 0, 1)
+    return image, copied
+
+
+class ImageBuffer(object):
+    """
+    An image along with the conversions to other formats already requested by its consumers
+
+    Every consumer (denoiser, metric, noiser) asks for the image in the format it works with
+    through @ref get(), and each format is only computed the first time it's requested. The
+    converted arrays are shared by all the consumers, so they must not be modified in place (they
+    are not flagged read-only as some Cython code of skimage refuses read-only buffers).
+    """
+
+    def __init__(self, image, format=OPENCV):
+        self.image = image
+        self.format = format
+        self._converted = {format: image}
+        self._copies = set()
+
+    def __getstate__(self):
+        # only the original image is sent to other processes, converting there is cheaper
+        return {"image": self.image, "format": self.format, "_converted": {self.format: self.image},
+                "_copies": set()}
+
+    @property
+    def shape(self):
+        return self.image.shape
+
+    def get(self, format=OPENCV):
+        """ Return the image in the given format, converting it only if it wasn't before """
+        if format in self._converted:
+            converted = self._converted[format]
+            if format in self._copies:
+                statistics.reused += 1
+                statistics.saved_bytes += converted.nbytes
+            return converted
+
+        converted, copied = convert(self.image, self.format, format)
+        if copied:
+            self._copies.add(format)
+            statistics.conversions += 1
+            statistics.copied_bytes += converted.nbytes
+        self._converted[format] = converted
+        return converted
@@ -4,6 +4,7 @@ from argparse import ArgumentParser
 from matplotlib import pyplot as plt
 from tqdm import tqdm
 from denoise_comparator import check_invalid, print_available
+from caching import MetricCache
 import pandas as pd
 import datasets
 import metrics
@@ -83,6 +84,8 @@ if __name__ == "__main__":
                         help="Skip the calculation of the metrics (expensive)")
     parser.add_argument("--noiser", action="store",
                         help="Generate synthetic noise using the given noiser")
+    parser.add_argument("--metric-cache", action="store", nargs="?", const="metric_cache.sqlite",
+                        help="Cache metric values in the given SQLite file (default: metric_cache.sqlite)")
     options = parser.parse_args()
 
     if options.list:
@@ -107,6 +110,9 @@ if __name__ == "__main__":
             exit(1)
 
     the_metrics = [metrics.create(m) for m in options.metrics]
+    if options.metric_cache:
+        metric_cache = MetricCache(options.metric_cache)
+        the_metrics = [metric_cache.wrap(m) for m in the_metrics]
     the_dataset = datasets.create(the_datasets[0])
     if options.noiser:
         the_dataset.set_noiser(noisers.create(options.noiser))
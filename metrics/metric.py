@@ -2,6 +2,7 @@
 # TODO: add copyright
 
 from abc import ABC, abstractmethod
+from imagebuffer import OPENCV
 
 class Metric(ABC):
     """ Base class for all metric objects
@@ -11,9 +12,22 @@ class Metric(ABC):
     name = "Metric"
     description = "Base class for metrics"
 
+    # bump whenever the implementation changes the values, so cached results get invalidated
+    version = 1
+
+    # whether bigger values mean the images are more similar
+    higher_is_better = True
+
+    # the imagebuffer.ImageFormat the images are compared in
+    input_format = OPENCV
+
     @abstractmethod
     def compare(self, imgref, imgtest):
         """ Compare @ref image1 and @ref image2 and returns a summarized metric (a value)
             :type image1: ndarray
             :type image2: ndarray """
-        pass
\ No newline at end of file
+        pass
+
+    def compare_buffers(self, bufref, buftest):
+        """ Compare the images of two imagebuffer.ImageBuffer, converted to @ref input_format """
+        return self.compare(bufref.get(self.input_format), buftest.get(self.input_format))
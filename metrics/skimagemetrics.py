@@ -11,6 +11,7 @@ class MeanSquaredError(Metric):
     """
     name = "msqe"
     description = "Mean Squared Error Metric"
+    higher_is_better = False
 
     def compare(self, imgref, imgtest):
         return metrics.mean_squared_error(imgref, imgtest)
@@ -22,6 +23,7 @@ class NormalizedRootMSE(Metric):
     """
     name = "nrmse"
     description = "Normalized Root Mean Squared Error Metric"
+    higher_is_better = False
 
     def compare(self, imgref, imgtest):
         return metrics.normalized_root_mse(imgref, imgtest)
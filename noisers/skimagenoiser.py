@@ -1,6 +1,7 @@
 from . import Noiser
 from skimage.util import random_noise
-from skimage import img_as_float, img_as_ubyte
+from skimage import img_as_ubyte
+from imagebuffer import ImageBuffer, SKIMAGE
 import numpy as np
 
 class SKImageNoiser(Noiser):
@@ -20,7 +21,7 @@ class SKImageNoiser(Noiser):
 
     def noise(self, image):
         # openCV images are BGR and skimage uses RGB, so invert the last and convert to float
-        img = img_as_float(image[:, :, ::-1], force_copy=True)
+        img = ImageBuffer(image).get(SKIMAGE)
 
         # and invert back to BGR for comparing
         result = random_noise(img, mode=self._noise, clip=True)[:, :, ::-1]
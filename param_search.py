@@ -1,13 +1,91 @@
 #!/usr/bin/env python3
 
 from argparse import ArgumentParser
-from sklearn.model_selection import GridSearchCV, RandomizedSearchCV, train_test_split
+from sklearn.model_selection import train_test_split
 from tqdm import tqdm
 import denoisers
 import datasets
 import noisers
+from caching import DenoiseCache
+from search.pareto import best_under, pareto_table, plot_front
+from search import EvaluationStore, PercentilePruner, RandomizedSearch, ResultStream, SearchRunner, SuccessiveHalvingSearch, \
+    TPESearch, pack_crops
+from metrics import default_metric
 from denoise_comparator import check_invalid, print_available
+import numpy as np
+import os
 import pandas as pd
+import random
+import tempfile
+
+SEARCHES = ["random", "halving", "tpe"]
+
+def load_split(dataset, size=400, train_size=0.7, random_state=None):
+    """
+    Split the dataset between train and test and extract one random patch from each image
+    :param random_state: the seed of the split (the crops use the global random module)
+    :return: the X_train, y_train, X_test and y_test lists (noisy images as X, references as y)
+    """
+    dataset.crop(size, size, datasets.CropWindow.CROP_RANDOM)
+    train, test = train_test_split(list(tqdm(dataset, "Loading data")), train_size=train_size,
+                                   random_state=random_state)
+
+    print("Size of train: {} test: {}".format(len(train), len(test)))
+    X_train = [noisy for _, _, noisy in train]
+    y_train = [ref for _, ref, _ in train]
+    X_test = [noisy for _, _, noisy in test]
+    y_test = [ref for _, ref, _ in test]
+    return X_train, y_train, X_test, y_test
+
+def pack_split(split, directory):
+    """
+    Pack the X_train, y_train, X_test and y_test crops in memory mapped .npy files of the directory,
+    which the search workers map instead of receiving copies
+    :return: the packed arrays (the list itself for crops which can't be stacked)
+    """
+    packed = []
+    for name, images in zip(("X_train", "y_train", "X_test", "y_test"), split):
+        array = pack_crops(images, os.path.join(directory, name + ".npy"))
+        if array is None:
+            print("WARNING: the {} crops have different shapes, they can't be shared between the workers".format(name))
+            array = images
+        packed.append(array)
+    return packed
+
+def create_search(search, denoiser, iterations, cv_folds, factor=3, min_crop=64, n_jobs=-1, checkpoint=None,
+                  warm_start=None, random_state=None):
+    """
+    Create the search (a search.ParameterSearch, with a sklearn-like fit()) of the given kind
+    :param checkpoint: the file the tpe search state is saved to and resumed from
+    :param warm_start: list of (params, score) tuples the tpe search starts from
+    """
+    if search == "halving":
+        # the iterations are the candidates of the first (cheapest) rung
+        return SuccessiveHalvingSearch(denoiser, denoiser.param_grid, n_candidates=iterations,
+                                       factor=factor, min_crop=min_crop, cv=cv_folds, n_jobs=n_jobs,
+                                       random_state=random_state)
+    if search == "tpe":
+        return TPESearch(denoiser, denoiser.param_grid, n_iter=iterations, cv=cv_folds, n_jobs=n_jobs,
+                         checkpoint=checkpoint, warm_start=warm_start, random_state=random_state)
+
+    return RandomizedSearch(denoiser, denoiser.param_grid, n_iter=iterations, cv=cv_folds, n_jobs=n_jobs,
+                            random_state=random_state)
+
+def parse_budgets(values, names):
+    """
+    Parse the --time-budget values
+    :param values: list of [DENOISER=]SECONDS strings, the ones without denoiser apply to all
+    :param names: the names of the denoisers being searched
+    :return: dict of denoiser name -> seconds
+    """
+    budgets = {}
+    for value in values or []:
+        name, _, seconds = value.rpartition("=")
+        if name and name not in names:
+            print("WARNING: no search for denoiser {}, ignoring its time budget".format(name))
+            continue
+        budgets.update({n: float(seconds) for n in ([name] if name else names)})
+    return budgets
 
 if __name__ == "__main__":
     parser = ArgumentParser()
@@ -27,6 +105,50 @@ if __name__ == "__main__":
                         help="Number of cross validation folds (default: 3)")
     parser.add_argument("--iterations", action="store", type=int, default=200,
                         help="Number of random iterations (default: 200)")
+    parser.add_argument("--search", action="store", choices=SEARCHES, default="random",
+                        help="Search strategy: random (like RandomizedSearchCV) or halving (successive halving "
+                             "over the crop size and number of images, with --iterations candidates in "
+                             "the first rung) or tpe (Tree-structured Parzen Estimator, which proposes "
+                             "each candidate from the scores of the previous ones) (default: random)")
+    parser.add_argument("--halving-factor", action="store", type=int, default=3,
+                        help="Only the best 1/FACTOR candidates advance to the next, FACTOR times more "
+                             "expensive, rung of the halving search (default: 3)")
+    parser.add_argument("--min-crop", action="store", type=int, default=64,
+                        help="Size of the smallest crops used by the halving search (default: 64)")
+    parser.add_argument("--time-budget", action="store", nargs="+", metavar="[DENOISER=]SECONDS",
+                        help="Stop the search of a denoiser (or all of them, without DENOISER) once its "
+                             "evaluations took the given seconds, summed over the workers")
+    parser.add_argument("--prune", action="store", nargs="?", type=float, const=50., metavar="PERCENTILE",
+                        help="Stop evaluating a candidate once its mean score over the first images is below "
+                             "the given percentile of the complete candidates over the same images (default: "
+                             "50, the median)")
+    parser.add_argument("--pareto", action="store_true",
+                        help="Also find the parameters with the best trade-off between the score and the time "
+                             "per megapixel, saved to pareto_<denoiser>.csv and plotted to pareto_<denoiser>.png")
+    parser.add_argument("--pareto-memory", action="store_true",
+                        help="Measure the peak memory of every candidate too, and add it to the trade-off "
+                             "(implies --pareto)")
+    parser.add_argument("--max-ms-per-mp", action="store", type=float,
+                        help="Choose the parameters with the best score among the ones of the Pareto front "
+                             "taking at most the given milliseconds per megapixel (implies --pareto)")
+    parser.add_argument("--checkpoint", action="store_true",
+                        help="Save the state of the tpe search of each denoiser to tpe_<denoiser>.json after "
+                             "every evaluation, and resume from it if it already exists")
+    parser.add_argument("--evaluation-store", action="store", nargs="?", const="evaluations.sqlite",
+                        help="Store the score of every denoiser, parameters and crop in the given SQLite file "
+                             "and reuse them instead of denoising again. The tpe search also starts from the "
+                             "stored scores of the same crops (default: evaluations.sqlite)")
+    parser.add_argument("--seed", action="store", type=int,
+                        help="Seed for the crops, the train/test split and the sampled parameters, so a "
+                             "search can be repeated or resumed on the same crops")
+    parser.add_argument("--crop-dir", action="store",
+                        help="Directory where the crops are packed for the workers (default: a temporary "
+                             "directory removed at the end)")
+    parser.add_argument("--denoise-cache", action="store", nargs="?", const="denoise_cache",
+                        help="Cache the denoised images in the given directory, so parameters that were "
+                             "already evaluated on the same crops are not run again (default: denoise_cache)")
+    parser.add_argument("--denoise-cache-size", action="store", type=int, default=10240,
+                        help="Maximum size in MB of the denoised images kept in the cache (default: 10240)")
     options = parser.parse_args()
 
     if options.list:
@@ -51,48 +173,91 @@ if __name__ == "__main__":
         if not the_noisers:
             exit(1)
 
+    options.pareto = options.pareto or options.pareto_memory or options.max_ms_per_mp is not None
+    if options.pareto and (options.evaluation_store or options.denoise_cache):
+        print("WARNING: the time of the cached evaluations is not measured, disabling the caches for --pareto")
+        options.evaluation_store = options.denoise_cache = None
+
+    if options.seed is not None:
+        random.seed(options.seed)
+        np.random.seed(options.seed)
+
     the_denoisers = [denoisers.create(d) for d in options.denoisers]
+    evaluation_store = None
+    if options.evaluation_store:
+        evaluation_store = EvaluationStore(options.evaluation_store)
+        initial_evaluations = len(evaluation_store)
+        for denoiser in the_denoisers:
+            denoiser.set_params(evaluation_store=evaluation_store)
+    denoise_cache = None
+    if options.denoise_cache:
+        denoise_cache = DenoiseCache(options.denoise_cache, options.denoise_cache_size << 20)
+        initial_statistics = denoise_cache.total_statistics()
+        for denoiser in the_denoisers:
+            denoiser.set_params(output_cache=denoise_cache)
     the_dataset = datasets.create(the_datasets[0])
     if options.noiser:
         the_dataset.set_noiser(noisers.create(options.noiser))
 
-    X_train = []
-    y_train = []
-    X_test = []
-    y_test = []
-
-    # split the dataset between train and test and extract one random patch from each image
-    the_dataset.crop(400, 400, datasets.CropWindow.CROP_RANDOM)
-    train, test = train_test_split(list(tqdm(the_dataset, "Loading data")), train_size=0.7)
+    split = load_split(the_dataset, random_state=options.seed)
+    temp_dir = None
+    if options.crop_dir:
+        os.makedirs(options.crop_dir, exist_ok=True)
+    else:
+        temp_dir = tempfile.TemporaryDirectory(prefix="crops_")
+    X_train, y_train, X_test, y_test = pack_split(split, options.crop_dir or temp_dir.name)
+    del split
 
-    print("Size of train: {} test: {}".format(len(train), len(test)))
-    for name, ref, noisy in train:
-        X_train.append(noisy)
-        y_train.append(ref)
-
-    for name, ref, noisy in test:
-        X_test.append(noisy)
-        y_test.append(ref)
-
-    results = {}
+    # the searches of all the denoisers run at once, sharing the workers
+    searches = {}
     for denoiser in the_denoisers:
         if not denoiser.param_grid:
             print("WARNING: Denoiser {} has no parameter values to search".format(denoiser.name))
             continue
 
-        print("Grid searching {} denoiser...".format(denoiser.name))
-        grid = RandomizedSearchCV(estimator=denoiser, param_distributions=denoiser.param_grid,
-                                n_jobs=-1, cv=options.cv_folds, verbose=1, n_iter=options.iterations)
+        warm_start = None
+        if evaluation_store is not None and options.search == "tpe":
+            warm_start = evaluation_store.evaluations(denoiser, default_metric(), X_train, y_train)
+        searches[denoiser.name] = create_search(
+            options.search, denoiser, options.iterations, options.cv_folds, options.halving_factor,
+            options.min_crop, checkpoint="tpe_{}.json".format(denoiser.name) if options.checkpoint else None,
+            warm_start=warm_start, random_state=options.seed)
+        if options.prune is not None:
+            searches[denoiser.name].pruner = PercentilePruner(options.prune)
+        searches[denoiser.name].measure_memory = options.pareto_memory
 
-        grid.fit(X_train, y_train)
+    print("Searching the parameters of {}...".format(", ".join(searches)))
+    # the evaluations are appended to the CSV files as they complete, which are rewritten with the
+    # ranks at the end
+    streams = {name: ResultStream("params_{}.csv".format(name)) for name in searches}
+    SearchRunner().run(searches, X_train, y_train, parse_budgets(options.time_budget, list(searches)),
+                       lambda name, task, evaluation: streams[name].write(task, evaluation))
 
+    results = {}
+    for name, grid in searches.items():
         df = pd.DataFrame(grid.cv_results_)
-        df.to_csv("params_{}.csv".format(denoiser.name))
+        df.to_csv("params_{}.csv".format(name))
+        if not grid.evaluations_:
+            continue
+
+        best_params = grid.best_params_
+        if options.pareto:
+            front = pareto_table(grid.cv_results_, options.pareto_memory)
+            front.to_csv("pareto_{}.csv".format(name))
+            plot_front(grid.cv_results_, front, "pareto_{}.png".format(name), name)
+            if options.max_ms_per_mp is not None:
+                best = best_under(front, options.max_ms_per_mp)
+                if best is None:
+                    print("WARNING: no parameters of {} take less than {} ms per megapixel, using the best "
+                          "scoring ones".format(name, options.max_ms_per_mp))
+                else:
+                    best_params = best.params
 
         # evaluate the best params both on train and on test data
-        denoiser.set_params(**grid.best_params_)
+        denoiser = grid.estimator
+        denoiser.set_params(**best_params)
         results[denoiser.name] = {
-            "params": grid.best_params_,
+            "params": best_params,
             "train_score": denoiser.score(X_train, y_train),
             "test_score": denoiser.score(X_test, y_test),
         }
@@ -109,4 +274,34 @@ if __name__ == "__main__":
         print("  Train score: {}".format(data["train_score"]))
         print("  Test score: {}".format(data["test_score"]))
 
+        if options.pareto:
+            front = pareto_table(searches[denoiser].cv_results_, options.pareto_memory)
+            print("  Pareto front ({} of {} candidates):".format(len(front), len(searches[denoiser].evaluations_)))
+            for _, row in front.iterrows():
+                print("    {:10.1f} ms/MP  {:8.4f}{}  {}".format(
+                    row.ms_per_mp, row.mean_test_score,
+                    "  {:8.1f} MB".format(row.peak_memory / 2**20) if "peak_memory" in row else "", row.params))
+
+        pruner = searches[denoiser].pruner
+        if pruner:
+            print("  Pruned {} of {} candidates, saving about {:.1f}s".format(
+                pruner.pruned, len(searches[denoiser].evaluations_), pruner.saved_time))
+
+    if evaluation_store is not None:
+        print("-----------------------------------------------------------------------------------")
+        print("Evaluation store: {} new scores stored, {} in total".format(
+            len(evaluation_store) - initial_evaluations, len(evaluation_store)))
+        evaluation_store.close()
+
+    if denoise_cache is not None:
+        # the lookups happen in the worker processes, so use the counts stored in the cache
+        print("-----------------------------------------------------------------------------------")
+        print("Denoise cache:")
+        for name, counts in denoise_cache.total_statistics().items():
+            initial = initial_statistics.get(name, {"hits": 0, "misses": 0})
+            print("  * {}: {} hits, {} misses".format(name, counts["hits"] - initial["hits"],
+                                                      counts["misses"] - initial["misses"]))
+        denoise_cache.close()
 
+    if temp_dir:
+        temp_dir.cleanup()
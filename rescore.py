@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Compute metrics for the results of a previous denoise_comparator.py run, using the images saved in
+its output directory instead of running the denoisers again
+"""
+
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+from denoise_comparator import check_invalid, print_available
+from caching import MetricCache
+import cv2
+import json
+import os
+import pathlib
+import pandas as pd
+import metrics
+from resultstore import ResultStore, open_results
+
+def load_group(output_dir, image, keys):
+    """
+    Load the saved images of one dataset image
+    :param keys: the names of the images to load (reference, noisy and denoiser names)
+    :return: a dict of key -> image, without the images that couldn't be read
+    """
+    images = {}
+    for key in keys:
+        img = cv2.imread(str(output_dir / "{}_{}.png".format(image, key)), cv2.IMREAD_UNCHANGED)
+        if img is not None:
+            images[key] = img
+    return images
+
+def prefetch(function, items, jobs, depth):
+    """
+    Call @ref function for each item in a thread pool, keeping up to @ref depth calls running ahead
+    of the consumer, and yield the (item, result) pairs in order
+    """
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        items = iter(items)
+        for item in items:
+            pending.append((item, executor.submit(function, item)))
+            if len(pending) >= depth:
+                break
+
+        while pending:
+            item, future = pending.popleft()
+            for next_item in items:
+                pending.append((next_item, executor.submit(function, next_item)))
+                break
+            yield item, future.result()
+
+def rescore(output_dir, data, the_metrics, jobs=4, depth=16):
+    """
+    Compute the metrics for every (image, denoiser) pair in the results
+    :param output_dir: the directory with the images saved by denoise_comparator.py
+    :param data: the dataframe of the previous results
+    :return: a dataframe with the new results, in the same format
+    """
+    # the time (and any extra column) only depends on the image and the denoiser
+    extra = [c for c in data.columns if c not in ("image", "denoiser", "metric", "value")]
+    runs = data.drop_duplicates(["image", "denoiser"]).set_index(["image", "denoiser"])[extra]
+    denoisers = {image: list(group) for image, group in runs.reset_index().groupby("image", sort=False).denoiser}
+
+    def load(image):
+        keys = ["reference"] + ["noisy" if d == "none" else d for d in denoisers[image]]
+        return load_group(output_dir, image, keys)
+
+    rows = []
+    for image, images in tqdm(prefetch(load, list(denoisers), jobs, depth), total=len(denoisers)):
+        if "reference" not in images:
+            print("WARNING: missing reference image for {}, skipping it".format(image))
+            continue
+
+        for denoiser in denoisers[image]:
+            key = "noisy" if denoiser == "none" else denoiser
+            if key not in images:
+                print("WARNING: missing image {}_{}.png, skipping it".format(image, key))
+                continue
+
+            run = runs.loc[(image, denoiser)]
+            for metric in the_metrics:
+                row = {
+                    "image": image,
+                    "denoiser": denoiser,
+                    "metric": metric.name,
+                    "value": metric.compare(images["reference"], images[key]),
+                }
+                row.update({column: run[column] for column in extra})
+                rows.append(row)
+
+    return pd.DataFrame(rows, columns=["image", "denoiser", "metric", "value"] + extra)
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("results", nargs="?",
+                        help="CSV (or .sqlite) file of a denoise_comparator.py run, whose images were saved")
+    parser.add_argument("--list", action="store_true",
+                        help="List available metrics")
+    parser.add_argument("--metrics", action="store", nargs="+", metavar=("METRIC1", "METRIC2"),
+                        help="Metrics to be computed (default: all)", default="all")
+    parser.add_argument("--output", action="store",
+                        help="Output CSV (or .sqlite) file to store the results (default: the results "
+                             "file with a _rescored suffix)")
+    parser.add_argument("--merge", action="store_true",
+                        help="Also keep the values of the metrics that are not computed again")
+    parser.add_argument("--jobs", action="store", type=int, default=4,
+                        help="Number of threads loading the images (default: 4)")
+    parser.add_argument("--prefetch", action="store", type=int, default=16,
+                        help="Number of dataset images loaded ahead of the metric computation (default: 16)")
+    parser.add_argument("--metric-cache", action="store", nargs="?", const="metric_cache.sqlite",
+                        help="Cache metric values in the given SQLite file (default: metric_cache.sqlite)")
+    options = parser.parse_args()
+
+    if options.list:
+        print_available("Available metrics:", metrics.list_metrics(with_description=True) \
+                        + [("all", "Use all metrics")])
+        exit(0)
+
+    if not options.results:
+        parser.error("the results file is required")
+
+    options.metrics = check_invalid("metrics", options.metrics, metrics.list_metrics(), True)
+    if not options.metrics:
+        exit(1)
+
+    the_metrics = [metrics.create(m) for m in options.metrics]
+    if options.metric_cache:
+        metric_cache = MetricCache(options.metric_cache)
+        the_metrics = [metric_cache.wrap(m) for m in the_metrics]
+
+    base, extension = os.path.splitext(options.results)
+    output_dir = pathlib.Path(base)
+    if not output_dir.is_dir():
+        print("The images of {} were not saved to {}".format(options.results, output_dir))
+        exit(1)
+
+    output = options.output or base + "_rescored" + extension
+    print("Results are being saved to {}".format(output))
+
+    store = open_results(options.results)
+    data = store.long()
+    higher_is_better = {metric: store.higher_is_better(metric) for metric in store.metrics()}
+    store.close()
+    for column in ("image", "denoiser", "metric"):
+        data[column] = data[column].astype(str)
+    results = rescore(output_dir, data, the_metrics, options.jobs, options.prefetch)
+
+    if options.merge:
+        kept = data[~data.metric.isin([m.name for m in the_metrics])]
+        results = pd.concat([kept, results], ignore_index=True)
+        results = results.sort_values(["image", "denoiser", "metric"], kind="stable").reset_index(drop=True)
+
+    if output.endswith(".sqlite"):
+        higher_is_better.update({m.name: getattr(m, "higher_is_better", True) for m in the_metrics})
+        ResultStore.remove(output)
+        ResultStore.from_frame(results, output, higher_is_better).close()
+    else:
+        results.to_csv(output)
+
+    # keep the metadata along the new results, with the metrics they actually have
+    meta_file = base + "_meta.json"
+    if os.path.exists(meta_file):
+        with open(meta_file) as f:
+            meta = json.load(f)
+        meta["metrics"] = sorted(results.metric.unique())
+        meta["rescored_from"] = options.results
+        with open(os.path.splitext(output)[0] + "_meta.json", "w") as f:
+            json.dump(meta, f, indent=4)
+
+    if options.metric_cache:
+        metric_cache.close()
@@ -2,16 +2,22 @@
 
 from argparse import ArgumentParser
 from viewer.viewer import Viewer
-import pandas as pd
+from resultstore import open_results
 import sys
 import os
 
 if __name__ == "__main__":
     parser = ArgumentParser()
-    parser.add_argument("csv_file", action="store", help="Path to the CSV file with results")
+    parser.add_argument("results_file", action="store",
+                        help="Path to the CSV (or .sqlite) file with results")
+    parser.add_argument("--tile-cache-size", action="store", type=int, default=512,
+                        help="MB of image tiles kept in memory (default: 512)")
+    parser.add_argument("--tile-jobs", action="store", type=int, default=2,
+                        help="Number of threads building the image tiles in the background (default: 2)")
 
     options = parser.parse_args()
-    data = pd.read_csv(options.csv_file, index_col=0)
-    viewer = Viewer(sys.argv, os.path.abspath(options.csv_file).replace(".csv", ""), data)
+    store = open_results(options.results_file)
+    viewer = Viewer(sys.argv, os.path.splitext(os.path.abspath(options.results_file))[0], store,
+                    options.tile_cache_size, options.tile_jobs)
     viewer.run()
 
@@ -1,12 +1,65 @@
+import json
+import math
+import os
 import pandas as pd
+from resultstore import ResultStore
+
+class RunningStats(object):
+    """ Online statistics of a stream of values, updated in O(1) using Welford's algorithm """
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.
+        self.min = math.inf
+        self.max = -math.inf
+        self.time = 0.
+        self._m2 = 0.
+
+    def update(self, value, time=0.):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.time += time
+
+    @property
+    def variance(self):
+        return self._m2 / (self.count - 1) if self.count > 1 else 0.
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "variance": self.variance,
+            "min": self.min,
+            "max": self.max,
+            "time_total": self.time,
+            "time_mean": self.time / self.count if self.count else 0.,
+        }
 
 class Results(object):
-    """ Helper class for storing result entries """
-    def __init__(self, filename, print=False):
+    """
+    Helper class for storing result entries
+
+    A .sqlite filename stores them in a resultstore.ResultStore, where each entry is inserted as it
+    comes instead of rewriting the whole CSV file.
+    """
+    def __init__(self, filename, print=False, summary_file=None):
         super().__init__()
 
         self.filename = filename
         self.print = print
+        self.summary_file = summary_file
+        self.store = None
+        if filename.endswith(".sqlite"):
+            # a new run, like the CSV file is written from scratch
+            ResultStore.remove(filename)
+            self.store = ResultStore(filename)
 
         # each result will be added to this
         self.results = {
@@ -17,20 +70,98 @@ class Results(object):
             "time": [],
         }
 
-    def append(self, image, denoiser, metric, value, time):
+        # extra columns, with information given by the denoisers
+        self.extra_columns = []
+
+        # online aggregates per (denoiser, metric), so the standings are known during the run
+        self.aggregates = {}
+        self._higher_is_better = {}
+
+    def append(self, image, denoiser, metric, value, time, info=None):
+        info = info or {}
+        for column in info:
+            if column not in self.results:
+                self.extra_columns.append(column)
+                self.results[column] = [None] * len(self.results["image"])
+
+        denoiser_name = denoiser.name if denoiser else "none"
         self.results["image"].append(image)
-        self.results["denoiser"].append(denoiser.name if denoiser else "none")
+        self.results["denoiser"].append(denoiser_name)
         self.results["metric"].append(metric.name)
         self.results["value"].append(value)
         self.results["time"].append(time)
+        for column in self.extra_columns:
+            self.results[column].append(info.get(column))
+
+        key = (denoiser_name, metric.name)
+        if key not in self.aggregates:
+            self.aggregates[key] = RunningStats()
+            self._higher_is_better[metric.name] = getattr(metric, "higher_is_better", True)
+        self.aggregates[key].update(value, time)
 
         if self.print:
             print("{} {} {}: {} ({})".format(image, denoiser.name if denoiser else "none",
                                         metric.name, value, time))
 
-        self.save()
+        if self.store:
+            self.store.append(image, denoiser_name, metric.name, value, time, info,
+                              getattr(metric, "higher_is_better", True))
+        else:
+            self.save()
 
     def save(self):
+        if self.store:
+            self.store.commit()
+            return
+
         # save partial results, just in case
         dataframe = pd.DataFrame(self.results)
-        dataframe.to_csv(self.filename)
\ No newline at end of file
+        dataframe.to_csv(self.filename)
+
+    def summary(self):
+        """ Return the aggregates as a dict of denoiser -> metric -> statistics """
+        summary = {}
+        for (denoiser, metric), stats in self.aggregates.items():
+            summary.setdefault(denoiser, {})[metric] = stats.to_dict()
+        return summary
+
+    def save_summary(self):
+        if not self.summary_file:
+            return
+
+        # write to a temporary file first, so whoever polls the summary never sees it half written
+        temp_file = self.summary_file + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump(self.summary(), f, indent=4)
+        os.replace(temp_file, self.summary_file)
+
+    def leaderboard(self, metrics=None):
+        """
+        Format the current standings as a text table, one line per denoiser with the mean (and
+        standard deviation) of each metric plus the accumulated runtime. Denoisers are sorted by
+        the first metric.
+        :param metrics: the metric names to show (default: all of them)
+        """
+        if metrics is None:
+            metrics = list(self._higher_is_better.keys())
+        if not metrics:
+            return ""
+
+        denoisers = sorted({denoiser for denoiser, _ in self.aggregates})
+        sort_metric = metrics[0]
+        sign = -1 if self._higher_is_better.get(sort_metric, True) else 1
+        denoisers.sort(key=lambda d: sign * self.aggregates[(d, sort_metric)].mean
+                                     if (d, sort_metric) in self.aggregates else math.inf)
+
+        lines = ["{:20}{:>6}".format("denoiser", "n") +
+                 "".join("{:>22}".format(m) for m in metrics) + "{:>12}".format("time (s)")]
+        for denoiser in denoisers:
+            stats = [self.aggregates.get((denoiser, m)) for m in metrics]
+            count = max(s.count for s in stats if s)
+            time = max(s.time for s in stats if s)
+            line = "{:20}{:>6}".format(denoiser, count)
+            for s in stats:
+                line += "{:>22}".format("{:.4f} ± {:.4f}".format(s.mean, s.std) if s else "-")
+            lines.append(line + "{:>12.2f}".format(time))
+
+        return "\n".join(lines)
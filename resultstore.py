@@ -0,0 +1,238 @@
+"""
+Indexed SQLite storage of the results of denoise_comparator.py, an alternative to the long format
+CSV files which doesn't need to be parsed and filtered as a whole on every access
+"""
+
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+
+class ResultStore(object):
+    """
+    Results stored in a SQLite file with typed columns
+
+    The image, denoiser and metric names are stored once in their own tables and referenced by
+    integer ids (like a categorical encoding). The time and the extra information reported by the
+    denoisers are stored once per (image, denoiser) run in the "runs" table, instead of being
+    repeated for every metric, and the metric values in the "scores" table, whose primary key
+    starts with the image (for the lookups of a single image) and which is also indexed by metric
+    (for the pivots of a single metric). The "wide" view has one row per run with a column per
+    metric.
+
+    The loader methods (@ref pivot(), @ref image_scores(), @ref runtimes(), @ref wide() and
+    @ref long()) return pandas objects with the image, denoiser and metric as categoricals.
+    """
+
+    def __init__(self, path, timeout=60.):
+        self.path = str(path)
+        self.connection = sqlite3.connect(self.path, timeout=timeout)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self._create_tables()
+
+        self._ids = {}
+        for table in ("images", "denoisers", "metrics"):
+            self._ids[table] = {name: id for id, name in
+                                self.connection.execute("SELECT id, name FROM {}".format(table))}
+        self._columns = [row[1] for row in self.connection.execute("PRAGMA table_info(runs)")][3:]
+        self._last_image = None
+
+    def _create_tables(self):
+        with self.connection:
+            for table in ("images", "denoisers"):
+                self.connection.execute("CREATE TABLE IF NOT EXISTS {} (id INTEGER PRIMARY KEY, "
+                                        "name TEXT UNIQUE NOT NULL)".format(table))
+            self.connection.execute("CREATE TABLE IF NOT EXISTS metrics (id INTEGER PRIMARY KEY, "
+                                    "name TEXT UNIQUE NOT NULL, higher_is_better INTEGER)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS runs (image INTEGER NOT NULL, "
+                                    "denoiser INTEGER NOT NULL, time REAL, PRIMARY KEY (image, denoiser)) "
+                                    "WITHOUT ROWID")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS scores (image INTEGER NOT NULL, "
+                                    "denoiser INTEGER NOT NULL, metric INTEGER NOT NULL, value REAL, "
+                                    "PRIMARY KEY (image, denoiser, metric)) WITHOUT ROWID")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS scores_metric ON scores (metric, denoiser)")
+
+    @staticmethod
+    def remove(path):
+        """ Remove a store file (and the files of its journal), to start a new one from scratch """
+        for name in (path, path + "-wal", path + "-shm"):
+            if os.path.exists(name):
+                os.remove(name)
+
+    @classmethod
+    def from_frame(cls, data, path=":memory:", higher_is_better=None):
+        """
+        Create a store from results in the long format of the CSV files of denoise_comparator.py
+        (":memory:" keeps it in memory, e.g. to read old results with the loader methods)
+        :param higher_is_better: dict of metric -> whether higher values are better (default: True)
+        """
+        store = cls(path)
+        higher_is_better = higher_is_better or {}
+        extra = [c for c in data.columns if c not in ("image", "denoiser", "metric", "value", "time")]
+        for row in data.itertuples(index=False):
+            row = row._asdict()
+            info = {column: row[column] for column in extra if pd.notna(row[column])}
+            store.append(row["image"], row["denoiser"], row["metric"], row["value"], row.get("time"), info,
+                         higher_is_better.get(row["metric"], True), commit=False)
+        store.commit()
+        return store
+
+    @classmethod
+    def from_csv(cls, csv_file, path=":memory:"):
+        """ Create a store from a long format CSV file of denoise_comparator.py """
+        return cls.from_frame(pd.read_csv(csv_file, index_col=0), path)
+
+    def _id(self, table, name, **columns):
+        ids = self._ids[table]
+        if name not in ids:
+            names = "".join(", " + column for column in columns)
+            cursor = self.connection.execute("INSERT INTO {} (name{}) VALUES (?{})".format(
+                table, names, ", ?" * len(columns)), (name,) + tuple(columns.values()))
+            ids[name] = cursor.lastrowid
+            if table == "metrics":
+                self._create_wide_view()
+        return ids[name]
+
+    def _add_column(self, name, value):
+        if isinstance(value, (bool, int)):
+            kind = "INTEGER"
+        elif isinstance(value, float):
+            kind = "REAL"
+        else:
+            kind = "TEXT"
+        self.connection.execute('ALTER TABLE runs ADD COLUMN "{}" {}'.format(name, kind))
+        self._columns.append(name)
+        self._create_wide_view()
+
+    def _create_wide_view(self):
+        metrics = "".join(', MAX(CASE WHEN s.metric = {} THEN s.value END) AS "{}"'.format(id, name)
+                          for name, id in self._ids["metrics"].items())
+        extra = "".join(', r."{}"'.format(column) for column in self._columns)
+        self.connection.execute("DROP VIEW IF EXISTS wide")
+        self.connection.execute(
+            "CREATE VIEW wide AS SELECT i.name AS image, d.name AS denoiser, r.time AS time{}{} "
+            "FROM runs r JOIN images i ON i.id = r.image JOIN denoisers d ON d.id = r.denoiser "
+            "LEFT JOIN scores s ON s.image = r.image AND s.denoiser = r.denoiser "
+            "GROUP BY r.image, r.denoiser ORDER BY r.image, r.denoiser".format(extra, metrics))
+
+    def append(self, image, denoiser, metric, value, time, info=None, higher_is_better=True, commit=True):
+        """
+        Store the value of a metric for the output of a denoiser ("none" for the noisy image)
+        :param info: extra information about the run (e.g. the iterations), stored in columns of
+                     their own
+        """
+        # numpy scalars (e.g. from a dataframe) can't be stored as they are
+        info = {column: value.item() if isinstance(value, np.generic) else value
+                for column, value in (info or {}).items()}
+        for column, column_value in info.items():
+            if column not in self._columns:
+                self._add_column(column, column_value)
+
+        image_id = self._id("images", image)
+        denoiser_id = self._id("denoisers", denoiser)
+        metric_id = self._id("metrics", metric, higher_is_better=int(bool(higher_is_better)))
+
+        columns = ["time"] + list(info)
+        self.connection.execute(
+            'INSERT INTO runs (image, denoiser, {0}) VALUES (?, ?{1}) ON CONFLICT (image, denoiser) DO UPDATE '
+            'SET {2}'.format(", ".join('"{}"'.format(c) for c in columns), ", ?" * len(columns),
+                             ", ".join('"{0}" = excluded."{0}"'.format(c) for c in columns)),
+            (image_id, denoiser_id, None if time is None else float(time)) + tuple(info.values()))
+        self.connection.execute("INSERT OR REPLACE INTO scores (image, denoiser, metric, value) VALUES (?, ?, ?, ?)",
+                                (image_id, denoiser_id, metric_id, float(value)))
+        if image == self._last_image:
+            self._last_image = None
+        if commit:
+            self.commit()
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def images(self):
+        return list(self._ids["images"])
+
+    def denoisers(self):
+        return list(self._ids["denoisers"])
+
+    def metrics(self):
+        return list(self._ids["metrics"])
+
+    def higher_is_better(self, metric):
+        return bool(self.connection.execute("SELECT higher_is_better FROM metrics WHERE name = ?",
+                                            (metric,)).fetchone()[0])
+
+    def _categorical(self, data, columns=("image", "denoiser", "metric")):
+        tables = {"image": "images", "denoiser": "denoisers", "metric": "metrics"}
+        for column in columns:
+            if column in data:
+                data[column] = pd.Categorical(data[column], categories=list(self._ids[tables[column]]))
+        return data
+
+    def pivot(self, metric, index="image", columns="denoiser"):
+        """ Return the values of a metric as an image x denoiser dataframe (or with the given @ref
+            index and @ref columns), reading only the rows of that metric """
+        data = pd.read_sql_query("SELECT i.name AS image, d.name AS denoiser, s.value AS value FROM scores s "
+                                 "JOIN images i ON i.id = s.image JOIN denoisers d ON d.id = s.denoiser "
+                                 "WHERE s.metric = ? ORDER BY s.image, s.denoiser", self.connection,
+                                 params=(self._ids["metrics"].get(metric, -1),))
+        pivot = data.pivot(index=index, columns=columns, values="value")
+        # keep the order the denoisers were run in, instead of the alphabetical one
+        return pivot.reindex(columns=[c for c in self._ids[columns + "s"] if c in pivot.columns])
+
+    def image_scores(self, image):
+        """ Return the values of every metric for an image, as a dict of denoiser -> metric -> value """
+        # the viewer asks for the same image once per denoiser
+        if self._last_image == image:
+            return self._last_scores
+
+        scores = {}
+        for denoiser, metric, value in self.connection.execute(
+                "SELECT d.name, m.name, s.value FROM scores s JOIN denoisers d ON d.id = s.denoiser "
+                "JOIN metrics m ON m.id = s.metric WHERE s.image = ?", (self._ids["images"].get(image, -1),)):
+            scores.setdefault(denoiser, {})[metric] = value
+
+        self._last_image = image
+        self._last_scores = scores
+        return scores
+
+    def runtimes(self):
+        """ Return one row per run with the image, denoiser, time and the extra information """
+        extra = "".join(', r."{}"'.format(column) for column in self._columns)
+        return self._categorical(pd.read_sql_query(
+            "SELECT i.name AS image, d.name AS denoiser, r.time AS time{} FROM runs r "
+            "JOIN images i ON i.id = r.image JOIN denoisers d ON d.id = r.denoiser "
+            "ORDER BY r.image, r.denoiser".format(extra), self.connection))
+
+    def wide(self):
+        """ Return one row per run with a column per metric, along the time and the extra information """
+        self._create_wide_view()
+        return self._categorical(pd.read_sql_query("SELECT * FROM wide", self.connection))
+
+    def long(self):
+        """ Return all the results in the long format of the CSV files (one row per image, denoiser
+            and metric) """
+        extra = "".join(', r."{}"'.format(column) for column in self._columns)
+        return self._categorical(pd.read_sql_query(
+            "SELECT i.name AS image, d.name AS denoiser, m.name AS metric, s.value AS value, r.time AS time{} "
+            "FROM scores s JOIN images i ON i.id = s.image JOIN denoisers d ON d.id = s.denoiser "
+            "JOIN metrics m ON m.id = s.metric LEFT JOIN runs r ON r.image = s.image AND r.denoiser = s.denoiser "
+            "ORDER BY s.image, s.denoiser, s.metric".format(extra), self.connection))
+
+
+def open_results(path):
+    """
+    Open the results of denoise_comparator.py for reading: a .sqlite file directly, or a CSV file
+    through the .sqlite file converted from it (if it's up to date) or loaded in memory
+    """
+    path = str(path)
+    if path.endswith(".sqlite"):
+        return ResultStore(path)
+
+    converted = os.path.splitext(path)[0] + ".sqlite"
+    if os.path.exists(converted) and os.path.getmtime(converted) >= os.path.getmtime(path):
+        return ResultStore(converted)
+    return ResultStore.from_csv(path)
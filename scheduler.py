@@ -0,0 +1,208 @@
+"""
+Scheduling of the denoising jobs on worker processes (or threads), admitting new jobs only while
+the memory they are estimated to need fits in a budget
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from joblib import cpu_count
+from joblib.externals.loky import get_reusable_executor
+import json
+import os
+import resource
+
+
+def _status(field):
+    """ Return a field of /proc/self/status in bytes, or None if not available """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def _reset_peak():
+    """ Reset the peak RSS of the current process, returning whether it was possible """
+    try:
+        # writing 5 resets the VmHWM counter (linux >= 4.0)
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def _max_rss():
+    # ru_maxrss is in KB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def measure(function, *args):
+    """
+    Call the function and measure how much the peak RSS of the process grew meanwhile. This is
+    what runs on the worker processes.
+    :return: a tuple with the result and the measured memory in bytes (None if unknown)
+    """
+    before = _status("VmRSS")
+    if before is not None and _reset_peak():
+        result = function(*args)
+        peak = _status("VmHWM")
+        return result, max(0, peak - before) if peak is not None else None
+
+    # without resetting the peak, only growths above the peak of the previous jobs are seen
+    before = _max_rss()
+    result = function(*args)
+    after = _max_rss()
+    return result, after - before if after > before else None
+
+def unmeasured(function, *args):
+    """ Call the function without measuring its memory, for the jobs running on threads (their
+        peak can't be told apart from the other threads of the process) """
+    return function(*args), None
+
+def available_memory():
+    """ Return the memory available to new processes (in bytes) or None if unknown """
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class MemoryProfile(object):
+    """
+    Peak memory per pixel of each denoiser, learned from the jobs measured in previous runs and
+    stored in a JSON file. Denoisers that were not measured yet use their own
+    Denoiser.estimate_memory().
+    """
+
+    # the learned values are scaled up by this factor, as the peak of a job also depends on what
+    # runs at the same time in the worker (e.g. the arrays being received)
+    margin = 1.25
+
+    def __init__(self, path=None):
+        self.path = path
+        self.profile = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.profile = json.load(f)
+
+    def key(self, denoiser):
+        # the runtime options (e.g. the precision) change the memory used too
+        options = denoiser.get_runtime_options()
+        if not options:
+            return denoiser.name
+        return "{}:{}".format(denoiser.name, json.dumps(options, sort_keys=True, default=str))
+
+    def estimate(self, denoiser, shape):
+        """ Return the estimated peak memory (in bytes) to denoise an image of the given shape """
+        entry = self.profile.get(self.key(denoiser))
+        if entry is None:
+            return denoiser.estimate_memory(shape)
+        return int(entry["bytes_per_pixel"] * shape[0] * shape[1] * self.margin)
+
+    def update(self, denoiser, shape, peak):
+        """ Learn from a measured @ref peak memory (in bytes) of the denoiser for the given shape """
+        if peak is None:
+            return
+
+        entry = self.profile.setdefault(self.key(denoiser), {"bytes_per_pixel": 0., "samples": 0})
+        entry["bytes_per_pixel"] = max(entry["bytes_per_pixel"], peak / (shape[0] * shape[1]))
+        entry["samples"] += 1
+
+    def save(self):
+        if not self.path:
+            return
+
+        temp_file = self.path + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump(self.profile, f, indent=4, sort_keys=True)
+        os.replace(temp_file, self.path)
+
+
+class MemoryScheduler(object):
+    """
+    Runs jobs on a pool of worker processes, admitting a job only while the sum of the estimated
+    memory of the jobs in flight fits in the budget. Jobs that don't fit wait for others to finish,
+    while smaller jobs behind them may still be admitted. A job bigger than the whole budget runs
+    alone.
+
+    The jobs of denoisers that release the GIL (Denoiser.releases_gil) run on a thread pool of the
+    main process instead, which shares the arrays with them instead of pickling them. The other
+    jobs (mostly CPU bound python code) go to the processes.
+    """
+
+    def __init__(self, budget=None, n_jobs=-1, profile=None, use_threads=True):
+        """
+        :param budget: the memory budget in bytes (default: 80% of the available memory)
+        :param n_jobs: the number of worker processes and threads (-1 for one per core)
+        :param profile: the @ref MemoryProfile used for the estimates
+        :param use_threads: run the denoisers releasing the GIL on threads
+        """
+        if budget is None:
+            available = available_memory()
+            budget = int(available * 0.8) if available else None
+        self.budget = budget
+        self.n_jobs = cpu_count() if n_jobs is None or n_jobs < 0 else n_jobs
+        self.profile = profile or MemoryProfile()
+        self.use_threads = use_threads
+        self.peak_in_flight = 0
+        self._threads = None
+
+    def _thread_pool(self):
+        # shared by all the calls of run(), like the reusable process executor
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(max_workers=self.n_jobs)
+        return self._threads
+
+    def shutdown(self):
+        if self._threads is not None:
+            self._threads.shutdown()
+            self._threads = None
+
+    def run(self, function, jobs):
+        """
+        Run the function for each job
+        :param jobs: list of (args, denoiser, shape) tuples, the function is called with args and
+                     the denoiser and shape are used to estimate its memory
+        :return: the list of results, in the order the jobs finished
+        """
+        processes = get_reusable_executor(max_workers=self.n_jobs)
+        pending = list(jobs)
+        running = {}
+        in_flight = 0
+        results = []
+
+        while pending or running:
+            # admit every pending job that fits, in order
+            for job in list(pending):
+                if len(running) >= self.n_jobs:
+                    break
+
+                args, denoiser, shape = job
+                threaded = self.use_threads and denoiser.releases_gil
+
+                estimate = self.profile.estimate(denoiser, shape)
+                if running and self.budget is not None and in_flight + estimate > self.budget:
+                    continue
+
+                if threaded:
+                    future = self._thread_pool().submit(unmeasured, function, *args)
+                else:
+                    future = processes.submit(measure, function, *args)
+                running[future] = (job, estimate, threaded)
+                in_flight += estimate
+                pending.remove(job)
+            self.peak_in_flight = max(self.peak_in_flight, in_flight)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                (_, denoiser, shape), estimate, _ = running.pop(future)
+                in_flight -= estimate
+                result, peak = future.result()
+                self.profile.update(denoiser, shape, peak)
+                results.append(result)
+
+        return results
@@ -0,0 +1,13 @@
+"""
+Parameter search strategies for the denoisers, which can share their workers through a SearchRunner
+"""
+
+from .base import ParameterSearch
+from .pruning import PercentilePruner
+from .halving import SuccessiveHalvingSearch
+from .randomized import RandomizedSearch
+from .runner import SearchRunner
+from .tpe import TPEOptimizer, TPESearch
+from .store import EvaluationStore
+from .crops import pack_crops
+from .evaluation import ResultStream
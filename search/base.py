@@ -0,0 +1,85 @@
+"""
+Base class of the parameter searches, which propose their candidates through ask()/tell() so a
+search.SearchRunner can evaluate the candidates of several searches on the same workers
+"""
+
+from abc import ABC, abstractmethod
+import numpy as np
+from .evaluation import results_table, rank
+from .runner import SearchRunner
+
+
+class ParameterSearch(ABC):
+    """
+    Base class for the searches
+
+    Sub-classes implement @ref ask(), returning the next task to evaluate: a dict with the "params",
+    optionally a "subset" (number of images, crop size) to evaluate them on and the "extra" columns
+    of the results. It returns None when there's nothing to evaluate right now, either because the
+    search waits for the pending evaluations or because it's over. Each completed evaluation is
+    reported with @ref tell().
+
+    The interface follows the sklearn searches: @ref fit() and then best_params_, best_score_ and
+    cv_results_.
+
+    With a @ref pruner (search.PercentilePruner), the candidates that score clearly worse than the
+    others on their first images are stopped early, and rank after the complete ones.
+    """
+
+    pruner = None
+
+    # measure the peak memory of every evaluation, for the Pareto front of search.pareto
+    measure_memory = False
+
+    def __init__(self, estimator, param_distributions, cv=3, n_jobs=-1, random_state=None, verbose=1):
+        self.estimator = estimator
+        self.param_distributions = param_distributions
+        self.cv = cv
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.verbose = verbose
+
+    def start(self, X, y):
+        """ Reset the search for the given images, before the first @ref ask() """
+        self.evaluations_ = []
+        self.extra_ = {}
+        self.stopped_ = False
+
+    @abstractmethod
+    def ask(self):
+        """ Return the next task to evaluate, or None if there's nothing to evaluate right now """
+        pass
+
+    def tell(self, task, evaluation):
+        """ Report the evaluation of a task returned by @ref ask() """
+        self.evaluations_.append(evaluation)
+        for column, value in task.get("extra", {}).items():
+            self.extra_.setdefault(column, []).append(value)
+
+    def stop(self):
+        """ Stop asking for new candidates (e.g. the time budget of the search ran out) """
+        self.stopped_ = True
+
+    def _rank_keys(self):
+        """ Return the key of each evaluation to rank them, higher is better """
+        # the failed evaluations (NaN scores) rank last
+        return [(not e.get("pruned", False), score if np.isfinite(score) else -np.inf)
+                for e, score in zip(self.evaluations_, self.cv_results_["mean_test_score"])]
+
+    def finish(self):
+        """ Build the results once there's nothing more to evaluate """
+        self.cv_results_ = results_table(self.evaluations_, self.extra_)
+        keys = self._rank_keys()
+        self.cv_results_["rank_test_score"] = rank(keys)
+
+        if keys:
+            best = max(range(len(keys)), key=keys.__getitem__)
+            self.best_params_ = self.evaluations_[best]["params"]
+            self.best_score_ = float(self.cv_results_["mean_test_score"][best])
+        else:
+            self.best_params_ = {}
+            self.best_score_ = np.nan
+
+    def fit(self, X, y):
+        SearchRunner(self.n_jobs, self.verbose).run({getattr(self.estimator, "name", "search"): self}, X, y)
+        return self
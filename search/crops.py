@@ -0,0 +1,44 @@
+"""
+Crops of the parameter search packed in memory mapped .npy files, so the worker processes map the
+same pages instead of receiving a copy of every crop with each candidate
+"""
+
+import numpy as np
+
+
+def pack_crops(images, path):
+    """
+    Write same shaped images into a single (N, H, W[, C]) .npy file and map it read-only
+    :return: the memory mapped array, or None if the images don't have the same shape and dtype
+    """
+    if not images or any(image.shape != images[0].shape or image.dtype != images[0].dtype for image in images):
+        return None
+
+    packed = np.lib.format.open_memmap(path, mode="w+", dtype=images[0].dtype,
+                                       shape=(len(images),) + images[0].shape)
+    for index, image in enumerate(images):
+        packed[index] = image
+    packed.flush()
+    del packed
+
+    return np.load(path, mmap_mode="r")
+
+
+def shareable(images):
+    """
+    Return what to send to a worker process for the images: the path of their .npy file if they
+    are a whole memory mapped file (the worker maps it again), otherwise the images themselves
+    """
+    filename = getattr(images, "filename", None)
+    if isinstance(images, np.memmap) and filename and filename.endswith(".npy"):
+        whole = np.load(filename, mmap_mode="r")
+        if whole.shape == images.shape and whole.offset == images.offset:
+            return filename
+    return images
+
+
+def unshare(images):
+    """ The inverse of @ref shareable(), to be called in the worker """
+    if isinstance(images, str):
+        return np.load(images, mmap_mode="r")
+    return images
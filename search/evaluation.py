@@ -0,0 +1,173 @@
+"""
+Evaluation of parameter candidates, shared by the search strategies
+"""
+
+import time
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from scheduler import measure
+from .crops import unshare
+
+def center_crops(images, size):
+    """ Crop a size x size window from the center of each image (a view of them if they are a
+        stacked array) """
+    if isinstance(images, np.ndarray):
+        height, width = images.shape[1:3]
+        y = max(0, (height - size) // 2)
+        x = max(0, (width - size) // 2)
+        return images[:, y:y + size, x:x + size]
+
+    crops = []
+    for image in images:
+        height, width = image.shape[:2]
+        y = max(0, (height - size) // 2)
+        x = max(0, (width - size) // 2)
+        crops.append(image[y:y + size, x:x + size])
+    return crops
+
+def evaluate(estimator, params, X, y, cv=3, subset=None, thresholds=None, measure_memory=False):
+    """
+    Score a copy of the estimator with the given parameters on the images, split in @ref cv folds
+    like a cross validation would (the denoisers have nothing to fit). The folds are contiguous, so
+    they are views when the images are a stacked array.
+    :param X: the noisy images, a list, a stacked array or the path given by crops.shareable()
+    :param y: the reference images, like @ref X
+    :param subset: an optional (count, size) tuple, to evaluate on center crops of the given size of
+                   the first count images only
+    :param thresholds: the minimum mean score after each image (NaN for none) given by a
+                       search.PercentilePruner, the evaluation stops (is pruned) below them
+    :param measure_memory: also measure the peak memory of the evaluation (see scheduler.measure())
+    :return: a dict with the parameters, the score and the time of each fold (only the ones started
+             if it was pruned), the score of each image, whether it was pruned, the estimated time
+             that saved, the time per megapixel and the peak memory in bytes (None if not measured).
+             If the denoiser raises, the scores are NaN.
+    """
+    denoiser = clone(estimator).set_params(**params)
+    X = unshare(X)
+    y = unshare(y)
+    if subset is not None:
+        count, size = subset
+        X = center_crops(X[:count], size)
+        y = center_crops(y[:count], size)
+    if not len(X):
+        # np.array_split() can't make folds out of nothing
+        raise ValueError("No images to evaluate {} on, the split or the crops are empty".format(
+            getattr(estimator, "name", "the denoiser")))
+
+    def run():
+        scores = []
+        score_times = []
+        image_scores = []
+        for indices in np.array_split(np.arange(len(X)), min(cv, len(X))):
+            start = time.time()
+            fold = slice(indices[0], indices[-1] + 1)
+            fold_scores = []
+            for _, value in denoiser.score_images(X[fold], y[fold]):
+                fold_scores.append(value)
+                image_scores.append(value)
+                step = len(image_scores) - 1
+                if thresholds is not None and step < len(thresholds) and np.mean(image_scores) < thresholds[step]:
+                    scores.append(np.mean(fold_scores))
+                    score_times.append(time.time() - start)
+                    return scores, score_times, image_scores, True
+            scores.append(np.mean(fold_scores))
+            score_times.append(time.time() - start)
+        return scores, score_times, image_scores, False
+
+    start = time.time()
+    try:
+        if measure_memory:
+            (scores, score_times, image_scores, pruned), peak_memory = measure(run)
+        else:
+            (scores, score_times, image_scores, pruned), peak_memory = run(), None
+    except Exception as e:
+        # like the error_score=nan of the sklearn searches: a failing candidate scores NaN (which
+        # ranks last) instead of stopping all the searches of the runner
+        print("WARNING: evaluation of {} with {} failed: {!r}".format(getattr(estimator, "name", "denoiser"),
+                                                                      params, e))
+        scores, score_times = [np.nan] * min(cv, len(X)), [time.time() - start]
+        image_scores, pruned, peak_memory = [], False, None
+
+    saved_time = 0.
+    if pruned and image_scores:
+        saved_time = (len(X) - len(image_scores)) * sum(score_times) / len(image_scores)
+    megapixels = sum(image.shape[0] * image.shape[1] for image in X[:len(image_scores)]) / 1e6
+    if not np.all(np.isfinite(scores)):
+        # the time of a failure says nothing about the speed of the parameters
+        megapixels = 0
+
+    return {
+        "params": params,
+        "scores": scores,
+        "score_times": score_times,
+        "image_scores": image_scores,
+        "pruned": pruned,
+        "saved_time": saved_time,
+        "ms_per_mp": 1000 * sum(score_times) / megapixels if megapixels else np.nan,
+        "peak_memory": peak_memory,
+    }
+
+def results_table(evaluations, extra=None):
+    """
+    Build a dict in the format of the cv_results_ of the sklearn searches (so it can be saved to the
+    same params_<denoiser>.csv files) from a list of evaluations
+    :param extra: dict of additional columns, with one value per evaluation
+    """
+    results = {
+        "mean_fit_time": [0.] * len(evaluations),
+        "std_fit_time": [0.] * len(evaluations),
+        "mean_score_time": [np.mean(e["score_times"]) for e in evaluations],
+        "std_score_time": [np.std(e["score_times"]) for e in evaluations],
+    }
+
+    names = sorted({name for e in evaluations for name in e["params"]})
+    for name in names:
+        results["param_" + name] = [e["params"].get(name) for e in evaluations]
+    results["params"] = [e["params"] for e in evaluations]
+
+    folds = max((len(e["scores"]) for e in evaluations), default=0)
+    for fold in range(folds):
+        results["split{}_test_score".format(fold)] = [e["scores"][fold] if fold < len(e["scores"]) else np.nan
+                                                      for e in evaluations]
+    results["mean_test_score"] = [np.mean(e["scores"]) for e in evaluations]
+    results["std_test_score"] = [np.std(e["scores"]) for e in evaluations]
+    if any("pruned" in e for e in evaluations):
+        results["pruned"] = [e.get("pruned", False) for e in evaluations]
+    if any("ms_per_mp" in e for e in evaluations):
+        results["ms_per_mp"] = [e.get("ms_per_mp", np.nan) for e in evaluations]
+    if any(e.get("peak_memory") is not None for e in evaluations):
+        results["peak_memory"] = [e.get("peak_memory") for e in evaluations]
+
+    for column, values in (extra or {}).items():
+        results[column] = list(values)
+
+    return results
+
+def rank(keys):
+    """ Return the rank (1 is the best) of each key (values or tuples), higher keys being better """
+    ranks = [0] * len(keys)
+    for position, index in enumerate(sorted(range(len(keys)), key=lambda i: keys[i], reverse=True)):
+        ranks[index] = position + 1
+    return ranks
+
+
+class ResultStream(object):
+    """
+    Appends the evaluations of a search to a CSV file as they complete, with the columns of its
+    final cv_results_ (but the rank, which is only known at the end)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.columns = None
+        self.rows = 0
+        open(path, "w").close()
+
+    def write(self, task, evaluation):
+        table = results_table([evaluation], {column: [value] for column, value in task.get("extra", {}).items()})
+        frame = pd.DataFrame(table, index=[self.rows])
+        if self.columns is None:
+            self.columns = list(frame.columns)
+        frame.reindex(columns=self.columns).to_csv(self.path, mode="a", header=self.rows == 0)
+        self.rows += 1
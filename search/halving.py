@@ -0,0 +1,107 @@
+"""
+Successive halving search, using the crop size and the number of images as the budget
+"""
+
+import math
+import numpy as np
+from sklearn.model_selection import ParameterSampler
+from .base import ParameterSearch
+
+class SuccessiveHalvingSearch(ParameterSearch):
+    """
+    Successive halving over the parameters of a denoiser
+
+    All the candidates are first scored on few small crops, and only the best 1/@ref factor of them
+    advance to the next rung, where the budget (pixels scored) is @ref factor times bigger. Half of
+    the growth goes to the crop size and half to the number of images, so the last rung scores the
+    survivors on all the images at full size, like the randomized search does. Each rung uses the
+    first images, so they should be in random order (train_test_split already shuffles them).
+
+    The cv_results_ have the "iter", "n_resources", "crop_size" and "n_images" of each row.
+    """
+
+    def __init__(self, estimator, param_distributions, n_candidates=None, factor=3, min_crop=64,
+                 cv=3, n_jobs=-1, random_state=None, verbose=1):
+        """
+        :param n_candidates: the number of candidates in the first rung (default: enough for the
+                             last rung to have @ref factor candidates)
+        :param min_crop: the size of the smallest crops
+        """
+        super().__init__(estimator, param_distributions, cv, n_jobs, random_state, verbose)
+        self.n_candidates = n_candidates
+        self.factor = factor
+        self.min_crop = min_crop
+
+    def rungs(self, size, count):
+        """
+        Return the (crop size, number of images) of each rung for images of the given size
+        :param size: the size of the (square) images
+        :param count: the number of images
+        """
+        last = 0
+        while True:
+            fraction = self.factor ** -(last + 1)
+            if size * fraction ** 0.25 < self.min_crop or count * fraction ** 0.5 < self.cv:
+                break
+            last += 1
+
+        rungs = []
+        for i in range(last + 1):
+            fraction = self.factor ** (i - last)
+            rungs.append((int(round(size * fraction ** 0.25)), int(math.ceil(count * fraction ** 0.5))))
+        return rungs
+
+    def start(self, X, y):
+        super().start(X, y)
+        size = min(min(image.shape[:2]) for image in X)
+        self.rungs_ = self.rungs(size, len(X))
+        self.n_candidates_ = self.n_candidates or self.factor ** len(self.rungs_)
+
+        self._pending = list(ParameterSampler(self.param_distributions, self.n_candidates_,
+                                              random_state=self.random_state))
+        self._iteration = 0
+        self._running = 0
+        self._rung = []
+        self._announce()
+
+    def _announce(self):
+        if self.verbose:
+            crop, count = self.rungs_[self._iteration]
+            print("Rung {}: {} candidates on {} crops of {}x{}".format(self._iteration, len(self._pending),
+                                                                     count, crop, crop))
+
+    def ask(self):
+        # the candidates of the next rung are only known once the current one is complete
+        if self.stopped_ or not self._pending:
+            return None
+
+        crop, count = self.rungs_[self._iteration]
+        self._running += 1
+        return {
+            "params": self._pending.pop(0),
+            "subset": (count, crop),
+            "extra": {"iter": self._iteration, "n_resources": count * crop * crop, "crop_size": crop,
+                      "n_images": count},
+        }
+
+    def tell(self, task, evaluation):
+        super().tell(task, evaluation)
+        self._running -= 1
+        self._rung.append(evaluation)
+        if self._pending or self._running or self._iteration == len(self.rungs_) - 1:
+            return
+
+        # the rung is complete, promote the best candidates (the pruned ones only if there are not
+        # enough complete ones)
+        keys = [(not e.get("pruned", False), np.nan_to_num(np.mean(e["scores"]), nan=-np.inf)) for e in self._rung]
+        best = sorted(range(len(keys)), key=keys.__getitem__, reverse=True)
+        survivors = max(1, int(math.ceil(len(self._rung) / self.factor)))
+        self._pending = [self._rung[i]["params"] for i in best[:survivors]]
+        self._iteration += 1
+        self._rung = []
+        if not self.stopped_:
+            self._announce()
+
+    def _rank_keys(self):
+        # the candidates that went further rank better, as in sklearn's HalvingRandomSearchCV
+        return [(iteration,) + key for iteration, key in zip(self.extra_.get("iter", []), super()._rank_keys())]
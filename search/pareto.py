@@ -0,0 +1,75 @@
+"""
+Speed/quality trade-off of the evaluated parameters: the Pareto front of the score, the time per
+megapixel and optionally the peak memory
+"""
+
+import numpy as np
+import pandas as pd
+
+def pareto_front(costs):
+    """
+    Return the indices of the rows of @ref costs which are not dominated by any other row, i.e. no
+    other row is at least as good in every column and better in one (lower is better)
+    :param costs: (N, M) array of N points with M objectives
+    """
+    costs = np.asarray(costs, dtype=float)
+    front = []
+    for index, point in enumerate(costs):
+        dominated = np.all(costs <= point, axis=1) & np.any(costs < point, axis=1)
+        if not dominated.any():
+            front.append(index)
+    return front
+
+def pareto_table(cv_results, memory=False):
+    """
+    Return the Pareto optimal evaluations of a search, sorted by time. Only the complete evaluations
+    on the most resources (e.g. the last rung of the halving search) are compared, as the others are
+    not comparable.
+    :param cv_results: the cv_results_ of the search
+    :param memory: also minimize the peak memory
+    :return: a dataframe with the params, mean_test_score, ms_per_mp (and peak_memory) of the front
+    """
+    data = pd.DataFrame(cv_results)
+    if "pruned" in data:
+        data = data[~data.pruned.astype(bool)]
+    if "n_resources" in data:
+        data = data[data.n_resources == data.n_resources.max()]
+    data = data.dropna(subset=["mean_test_score", "ms_per_mp"])
+
+    columns = ["ms_per_mp", "mean_test_score"]
+    if memory and "peak_memory" in data:
+        data = data.dropna(subset=["peak_memory"])
+        columns.append("peak_memory")
+
+    # the score is maximized
+    costs = data[columns].values * np.array([1, -1] + [1] * (len(columns) - 2))
+    front = data.iloc[pareto_front(costs)] if len(data) else data
+    return front[["params"] + columns].sort_values("ms_per_mp").reset_index(drop=True)
+
+def best_under(front, max_ms_per_mp):
+    """ Return the row of the front with the best score under the given time per megapixel, or None """
+    fast = front[front.ms_per_mp <= max_ms_per_mp]
+    if fast.empty:
+        return None
+    return fast.loc[fast.mean_test_score.idxmax()]
+
+def plot_front(cv_results, front, path, title=None):
+    """ Plot the score against the time per megapixel of all the evaluations, highlighting the front """
+    # without pyplot, so it works without a display and from any thread
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    data = pd.DataFrame(cv_results)
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot(1, 1, 1)
+    axes.scatter(data.ms_per_mp, data.mean_test_score, s=10, alpha=0.4, label="Candidates")
+    axes.step(front.ms_per_mp, front.mean_test_score, where="post", color="C3", marker="o", label="Pareto front")
+    axes.set_xscale("log")
+    axes.set_xlabel("Time (ms per megapixel)")
+    axes.set_ylabel("Score")
+    if title:
+        axes.set_title(title)
+    axes.legend()
+    figure.tight_layout()
+    figure.savefig(path)
@@ -0,0 +1,52 @@
+"""
+Pruning of the candidates that are clearly worse than the others before all their images are scored
+"""
+
+import numpy as np
+
+
+class PercentilePruner(object):
+    """
+    Prunes a candidate once its mean score over the first images is below the given @ref percentile
+    of the mean scores the complete candidates had over the same images (the median by default, a
+    higher percentile prunes more)
+
+    The thresholds are computed separately for each subset of the images (e.g. the rungs of the
+    halving search) from the complete candidates evaluated on it, and are only used after
+    @ref min_candidates of them and @ref min_images images, so the noise of the first scores
+    doesn't prune good candidates.
+    """
+
+    def __init__(self, percentile=50., min_images=2, min_candidates=5):
+        self.percentile = percentile
+        self.min_images = min_images
+        self.min_candidates = min_candidates
+        self.curves = {}
+        self.pruned = 0
+        self.saved_time = 0.
+
+    def thresholds(self, subset=None):
+        """ Return the minimum mean score after each image for a new candidate evaluated on the
+            given subset, or None if there are not enough complete candidates yet """
+        curves = self.curves.get(subset, [])
+        if len(curves) < self.min_candidates:
+            return None
+
+        # pruning after the last image wouldn't save anything
+        length = max(len(curve) for curve in curves) - 1
+        thresholds = [np.nan] * max(0, length)
+        for step in range(self.min_images - 1, length):
+            thresholds[step] = float(np.percentile([curve[step] for curve in curves if len(curve) > step],
+                                                   self.percentile))
+        return thresholds
+
+    def report(self, subset, evaluation):
+        """ Learn from a completed evaluation, or count it if it was pruned """
+        if evaluation.get("pruned"):
+            self.pruned += 1
+            self.saved_time += evaluation["saved_time"]
+            return
+
+        scores = np.asarray(evaluation["image_scores"], dtype=float)
+        if len(scores):
+            self.curves.setdefault(subset, []).append(np.cumsum(scores) / np.arange(1, len(scores) + 1))
@@ -0,0 +1,28 @@
+"""
+Randomized search, sampling the candidates from the param_grid like sklearn's RandomizedSearchCV
+"""
+
+from sklearn.model_selection import ParameterSampler
+from .base import ParameterSearch
+
+class RandomizedSearch(ParameterSearch):
+    """
+    Evaluates @ref n_iter candidates sampled from the parameter distributions, on the same folds
+    RandomizedSearchCV uses (KFold without shuffling), so it gives the same scores. Unlike it, it
+    can share its workers with other searches through a search.SearchRunner.
+    """
+
+    def __init__(self, estimator, param_distributions, n_iter=10, cv=3, n_jobs=-1, random_state=None,
+                 verbose=1):
+        super().__init__(estimator, param_distributions, cv, n_jobs, random_state, verbose)
+        self.n_iter = n_iter
+
+    def start(self, X, y):
+        super().start(X, y)
+        self._pending = list(ParameterSampler(self.param_distributions, self.n_iter,
+                                              random_state=self.random_state))
+
+    def ask(self):
+        if self.stopped_ or not self._pending:
+            return None
+        return {"params": self._pending.pop(0)}
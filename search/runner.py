@@ -0,0 +1,100 @@
+"""
+Evaluation of the candidates of several parameter searches on one shared pool of worker processes
+"""
+
+from concurrent.futures import FIRST_COMPLETED, wait
+from joblib import cpu_count
+from joblib.externals.loky import get_reusable_executor
+import numpy as np
+from .crops import shareable
+from .evaluation import evaluate
+
+
+class SearchRunner(object):
+    """
+    Runs the searches (search.ParameterSearch) of several denoisers at once, interleaving their
+    candidates on the same worker processes
+
+    Whenever a worker is free, it takes the next candidate of the search with the fewest
+    evaluations running (and then the least time spent), so a search waiting for its slowest
+    candidates (e.g. at the end of a halving rung) leaves the workers to the others instead of
+    idle. The workers are the loky reusable executor, so they persist between runs.
+
+    The candidates of searches with a pruner get its current thresholds, and report back to it.
+
+    A search can get a time budget: the seconds its evaluations may take, summed over the workers.
+    Once spent, it stops asking for new candidates (the ones already running still complete).
+    """
+
+    def __init__(self, n_jobs=-1, verbose=1):
+        self.n_jobs = cpu_count() if n_jobs is None or n_jobs < 0 else n_jobs
+        self.verbose = verbose
+
+    def run(self, searches, X, y, budgets=None, on_evaluation=None):
+        """
+        Run the searches on the same images until they are all over
+        :param searches: dict of name -> search.ParameterSearch
+        :param budgets: dict of name -> time budget in seconds (no budget for the missing ones)
+        :param on_evaluation: called with the name, task and evaluation as each evaluation completes
+        :return: dict of name -> seconds spent evaluating the candidates of each search
+        """
+        budgets = budgets or {}
+        executor = get_reusable_executor(max_workers=self.n_jobs)
+        # the executor pickles the arguments of every candidate, send the memory mapped files by path
+        X_shared = shareable(X)
+        y_shared = shareable(y)
+
+        for search in searches.values():
+            search.start(X, y)
+        spent = {name: 0. for name in searches}
+        in_flight = {name: 0 for name in searches}
+        running = {}
+
+        while True:
+            while len(running) < self.n_jobs:
+                submitted = False
+                for name in sorted(searches, key=lambda n: (in_flight[n], spent[n])):
+                    search = searches[name]
+                    if name in budgets and spent[name] >= budgets[name] and not search.stopped_:
+                        if self.verbose:
+                            print("{}: time budget of {}s spent".format(name, budgets[name]))
+                        search.stop()
+
+                    task = search.ask()
+                    if task is None:
+                        continue
+
+                    thresholds = search.pruner.thresholds(task.get("subset")) if search.pruner else None
+                    future = executor.submit(evaluate, search.estimator, task["params"], X_shared, y_shared,
+                                             search.cv, task.get("subset"), thresholds, search.measure_memory)
+                    running[future] = (name, task)
+                    in_flight[name] += 1
+                    submitted = True
+                    break
+
+                if not submitted:
+                    break
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, task = running.pop(future)
+                evaluation = future.result()
+                in_flight[name] -= 1
+                spent[name] += sum(evaluation["score_times"])
+
+                if searches[name].pruner:
+                    searches[name].pruner.report(task.get("subset"), evaluation)
+                searches[name].tell(task, evaluation)
+                if on_evaluation:
+                    on_evaluation(name, task, evaluation)
+                if self.verbose:
+                    print("{}: evaluation {} scored {:.4f}{}".format(name, len(searches[name].evaluations_),
+                                                                    np.mean(evaluation["scores"]),
+                                                                    " (pruned)" if evaluation["pruned"] else ""))
+
+        for search in searches.values():
+            search.finish()
+        return spent
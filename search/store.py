@@ -0,0 +1,91 @@
+"""
+Persistent store of the scores of the denoisers, shared by all the parameter searches
+"""
+
+import hashlib
+import json
+from caching import SQLiteCache
+
+
+def canonical(values):
+    """ Return a canonical JSON representation of a dict of parameters (sorted keys, numpy scalars
+        as python ones), so equal parameters always give the same string """
+    return json.dumps(values, sort_keys=True,
+                      default=lambda value: value.item() if hasattr(value, "item") else str(value))
+
+
+class EvaluationStore(SQLiteCache):
+    """
+    Scores of denoisers on single crops, keyed by the denoiser (name, version, parameters and
+    output options), the content of the crop (noisy and reference images) and the metric (name and
+    version)
+
+    Denoiser.score() looks up each crop here before denoising it, so a search evaluating
+    parameters that an earlier search already evaluated on the same crops (e.g. an interrupted
+    search run again with the same --seed) only computes the missing scores. The stored scores
+    can also warm-start a new search through @ref evaluations().
+    """
+
+    table = "evaluations"
+    columns = (("denoiser", "TEXT"), ("version", "INTEGER"), ("options", "TEXT"), ("params", "TEXT"),
+               ("crop", "TEXT"), ("metric", "TEXT"), ("value", "REAL"))
+
+    # each crop is looked up once per candidate
+    hash_memo_size = 64
+
+    def __init__(self, path, max_entries=10000000, timeout=60.):
+        super().__init__(path, max_size=max_entries, timeout=timeout)
+
+    def _create_tables(self):
+        super()._create_tables()
+        with self._connection:
+            self._connection.execute("CREATE INDEX IF NOT EXISTS evaluations_denoiser ON evaluations "
+                                     "(denoiser, metric)")
+
+    @staticmethod
+    def _metric_name(metric):
+        return "{}:{}".format(metric.name, metric.version)
+
+    def crop(self, noisy, ref):
+        """ Return the identity of a crop: the hashes of its noisy and reference images """
+        return "{}-{}".format(self._hash(noisy), self._hash(ref))
+
+    def _row(self, denoiser, metric, noisy, ref):
+        params = canonical({p: getattr(denoiser, p, None) for p in denoiser.param_grid})
+        return (denoiser.name, denoiser.version, canonical(denoiser.get_output_options()), params,
+                self.crop(noisy, ref), self._metric_name(metric))
+
+    def key(self, denoiser, metric, noisy, ref):
+        name, version, options, params, crop, metric_name = self._row(denoiser, metric, noisy, ref)
+        description = "{}:{}:{}".format(version, options, params)
+        params_hash = hashlib.blake2b(description.encode(), digest_size=8).hexdigest()
+        return "{}:{}:{}:{}".format(name, params_hash, crop, metric_name)
+
+    def get(self, denoiser, metric, noisy, ref):
+        """ Return the stored score of the denoiser (with its current parameters) for a crop, or
+            None if it was not evaluated yet """
+        row = self._get(self.key(denoiser, metric, noisy, ref))
+        return None if row is None else row[-1]
+
+    def put(self, denoiser, metric, noisy, ref, value):
+        self._put(self.key(denoiser, metric, noisy, ref),
+                  self._row(denoiser, metric, noisy, ref) + (float(value),))
+
+    def evaluations(self, denoiser, metric, X, y):
+        """
+        Return the parameters of the denoiser already evaluated on all the given crops (with the
+        same version and output options as @ref denoiser), to warm-start a search
+        :return: a list of (params, mean score) tuples
+        """
+        crops = {self.crop(noisy, ref) for noisy, ref in zip(X, y)}
+        values = {}
+        for params, crop, value in self.connection.execute(
+                "SELECT params, crop, value FROM evaluations WHERE denoiser = ? AND metric = ? "
+                "AND version = ? AND options = ?",
+                (denoiser.name, self._metric_name(metric), denoiser.version,
+                 canonical(denoiser.get_output_options()))):
+            if crop in crops:
+                values.setdefault(params, []).append(value)
+
+        return [(json.loads(params), sum(scores) / len(scores))
+                for params, scores in values.items() if len(scores) == len(crops)]
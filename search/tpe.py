@@ -0,0 +1,295 @@
+"""
+Tree-structured Parzen Estimator (TPE) search: a sequential model-based optimizer that proposes the
+next parameters from the scores of the previous ones, instead of sampling them blindly
+"""
+
+import json
+import os
+import numpy as np
+from scipy.stats import norm, truncnorm
+from .base import ParameterSearch
+
+
+def _python(value):
+    """ Convert numpy scalars to python ones, so the parameters can be stored in JSON """
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class ParameterSpace(object):
+    """
+    The parameters of a denoiser param_grid, mapped to the unit interval
+
+    The scipy distributions are searched in the space of their CDF (so uniform(0, 255) and a
+    log-uniform distribution are both searched evenly in what they consider likely), ranges as
+    ordered integers and any other list as unordered categories.
+    """
+
+    def __init__(self, param_grid):
+        self.numeric = {}
+        self.categorical = {}
+        for name, values in sorted(param_grid.items()):
+            if hasattr(values, "ppf") or isinstance(values, range):
+                self.numeric[name] = values
+            else:
+                self.categorical[name] = list(values)
+
+    def to_params(self, point):
+        """ Return the parameter values of a point (dict of name -> position in [0, 1] or category index) """
+        params = {}
+        for name, values in self.numeric.items():
+            u = point[name]
+            if isinstance(values, range):
+                params[name] = values[min(int(u * len(values)), len(values) - 1)]
+            else:
+                # keep away from the infinite ends of unbounded distributions
+                params[name] = _python(values.ppf(np.clip(u, 1e-6, 1 - 1e-6)))
+        for name, values in self.categorical.items():
+            params[name] = _python(values[point[name]])
+        return params
+
+    def to_point(self, params):
+        """ Return the point of the given parameter values, or None if any of them is out of the space """
+        point = {}
+        try:
+            for name, values in self.numeric.items():
+                if isinstance(values, range):
+                    point[name] = (values.index(params[name]) + 0.5) / len(values)
+                else:
+                    point[name] = float(np.clip(values.cdf(params[name]), 0., 1.))
+            for name, values in self.categorical.items():
+                point[name] = values.index(params[name])
+        except (KeyError, ValueError):
+            return None
+        return point
+
+    def sample(self, rng):
+        """ Return a random point, which is a sample of the param_grid distributions """
+        point = {name: rng.uniform() for name in self.numeric}
+        point.update({name: rng.randint(len(values)) for name, values in self.categorical.items()})
+        return point
+
+
+class TPEOptimizer(object):
+    """
+    Ask/tell interface of the TPE optimizer
+
+    @ref ask() returns the next parameters to evaluate and @ref tell() reports their score (higher
+    is better). The observations are split between the best @ref gamma fraction and the rest, each
+    group is modeled with a Parzen estimator per parameter (truncated gaussians on the unit interval,
+    smoothed counts for the categories), and the next parameters are the candidate sampled from the
+    best group model which maximizes the ratio between both models.
+
+    Several asks can be pending at once (asynchronous evaluation): the pending parameters count as
+    bad observations until they are told, so the next asks look elsewhere.
+    """
+
+    def __init__(self, param_grid, n_startup=10, n_ei_candidates=24, gamma=0.25, random_state=None):
+        """
+        :param n_startup: the number of random samples before the model is used
+        :param n_ei_candidates: the number of candidates sampled from the model on each ask
+        :param gamma: the fraction of the observations considered good
+        """
+        self.space = ParameterSpace(param_grid)
+        self.n_startup = n_startup
+        self.n_ei_candidates = n_ei_candidates
+        self.gamma = gamma
+        self.rng = np.random.RandomState(random_state)
+        self.observations = []
+        self.pending = []
+
+    def ask(self):
+        """ Return the next parameters to evaluate """
+        if len(self.observations) < self.n_startup:
+            point = self.space.sample(self.rng)
+        else:
+            point = self._suggest()
+
+        params = self.space.to_params(point)
+        # store the point of the actual values, e.g. the center of the range step
+        self.pending.append(self.space.to_point(params))
+        return params
+
+    def tell(self, params, score):
+        """ Report the score of some parameters (asked before or not, e.g. from a previous search) """
+        point = self.space.to_point(params)
+        if point is None:
+            print("WARNING: parameters {} are not part of the search space, ignoring them".format(params))
+            return
+
+        if point in self.pending:
+            self.pending.remove(point)
+        if np.isfinite(score):
+            self.observations.append((point, float(score)))
+        else:
+            # a failed evaluation, keep the optimizer away from it
+            self.observations.append((point, -np.inf))
+
+    def _split(self):
+        """ Return the points of the good and bad observations (the pending ones are bad) """
+        ordered = sorted(self.observations, key=lambda o: o[1], reverse=True)
+        n_good = max(1, int(np.ceil(self.gamma * len(ordered))))
+        good = [point for point, _ in ordered[:n_good]]
+        bad = [point for point, _ in ordered[n_good:]] + self.pending
+        return good, bad
+
+    @staticmethod
+    def _bandwidth(positions):
+        # Scott's rule, bounded like hyperopt does so a few close points don't collapse the kernels
+        # (which would stop the exploration around them)
+        if len(positions) < 2:
+            return 1.
+        return float(np.clip(np.std(positions) * len(positions) ** -0.2, 1. / min(100, len(positions) + 1), 1.))
+
+    @classmethod
+    def _log_density(cls, positions, u):
+        """ Log density at @ref u of the truncated gaussian kernels at @ref positions and a uniform prior """
+        positions = np.asarray(positions)
+        sigma = cls._bandwidth(positions)
+        mass = norm.cdf((1 - positions) / sigma) - norm.cdf(-positions / sigma)
+        kernels = norm.pdf((u[:, None] - positions[None, :]) / sigma) / (sigma * mass[None, :])
+        return np.log((kernels.sum(axis=1) + 1.) / (len(positions) + 1))
+
+    def _sample_numeric(self, positions, count):
+        """ Sample @ref count values from the kernels at @ref positions and the uniform prior """
+        positions = np.asarray(positions)
+        sigma = self._bandwidth(positions)
+        component = self.rng.randint(len(positions) + 1, size=count)
+        samples = self.rng.uniform(size=count)
+        for i, c in enumerate(component):
+            if c < len(positions):
+                center = positions[c]
+                samples[i] = truncnorm.rvs(-center / sigma, (1 - center) / sigma, loc=center, scale=sigma,
+                                           random_state=self.rng)
+        return samples
+
+    @staticmethod
+    def _category_weights(indices, size):
+        counts = np.bincount(np.asarray(indices, dtype=int), minlength=size).astype(float)
+        return (counts + 1. / size) / (len(indices) + 1)
+
+    def _suggest(self):
+        good, bad = self._split()
+        count = self.n_ei_candidates
+        candidates = [{} for _ in range(count)]
+        score = np.zeros(count)
+
+        # the parameters are modeled independently, so the log ratios add up
+        for name in self.space.numeric:
+            good_positions = [p[name] for p in good]
+            bad_positions = [p[name] for p in bad]
+            samples = self._sample_numeric(good_positions, count)
+            score += self._log_density(good_positions, samples)
+            if bad_positions:
+                score -= self._log_density(bad_positions, samples)
+            for candidate, u in zip(candidates, samples):
+                candidate[name] = float(u)
+
+        for name, values in self.space.categorical.items():
+            good_weights = self._category_weights([p[name] for p in good], len(values))
+            bad_weights = self._category_weights([p[name] for p in bad], len(values))
+            samples = self.rng.choice(len(values), size=count, p=good_weights)
+            score += np.log(good_weights[samples]) - np.log(bad_weights[samples])
+            for candidate, index in zip(candidates, samples):
+                candidate[name] = int(index)
+
+        return candidates[int(np.argmax(score))]
+
+    def state(self):
+        """ Return the state of the search as a JSON serializable dict """
+        algorithm, keys, position, has_gauss, cached = self.rng.get_state()
+        return {
+            "observations": [{"params": self.space.to_params(point), "score": score}
+                             for point, score in self.observations],
+            "random_state": [algorithm, keys.tolist(), position, has_gauss, cached],
+        }
+
+    def load_state(self, state):
+        """ Restore a @ref state(), the asks that were pending when it was saved are forgotten """
+        self.observations = []
+        self.pending = []
+        for observation in state["observations"]:
+            self.tell(observation["params"], observation["score"])
+        algorithm, keys, position, has_gauss, cached = state["random_state"]
+        self.rng.set_state((algorithm, np.array(keys, dtype=np.uint32), position, has_gauss, cached))
+
+    def save(self, path):
+        temp_file = path + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump(self.state(), f, indent=4, default=_python)
+        os.replace(temp_file, path)
+
+    def load(self, path):
+        with open(path) as f:
+            self.load_state(json.load(f))
+
+
+class TPESearch(ParameterSearch):
+    """
+    Search of the parameters of a denoiser with the @ref TPEOptimizer
+
+    The candidates are evaluated asynchronously: each time one finishes, its score is told to the
+    optimizer and the next candidate is asked, so the workers never wait for the slowest candidate.
+    With a @ref checkpoint file, the observations are saved after every evaluation and a search that
+    was interrupted continues from them. Scores known from elsewhere (e.g. a search.EvaluationStore)
+    can be given as @ref warm_start, they are told to the optimizer before the first ask.
+
+    The cv_results_ have the "iter" each row was evaluated in.
+    """
+
+    def __init__(self, estimator, param_distributions, n_iter=100, cv=3, n_jobs=-1, n_startup=10,
+                 random_state=None, checkpoint=None, warm_start=None, verbose=1):
+        """
+        :param n_iter: the total number of evaluations (including the ones of the checkpoint, but
+                       not the @ref warm_start ones)
+        :param checkpoint: path of the JSON file the state of the search is saved to and resumed from
+        :param warm_start: list of (params, score) tuples already evaluated on the same images
+        """
+        super().__init__(estimator, param_distributions, cv, n_jobs, random_state, verbose)
+        self.n_iter = n_iter
+        self.n_startup = n_startup
+        self.checkpoint = checkpoint
+        self.warm_start = warm_start
+
+    def _known(self, params, score):
+        # only the scores were saved (or stored), not the folds
+        evaluation = {"params": params, "scores": [score], "score_times": [np.nan]}
+        super().tell({"extra": {"iter": len(self.evaluations_)}}, evaluation)
+
+    def start(self, X, y):
+        super().start(X, y)
+        self.optimizer_ = TPEOptimizer(self.param_distributions, n_startup=self.n_startup,
+                                       random_state=self.random_state)
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            self.optimizer_.load(self.checkpoint)
+            if self.verbose:
+                print("Resuming from {} evaluations in {}".format(len(self.optimizer_.observations), self.checkpoint))
+            for point, score in self.optimizer_.observations:
+                self._known(self.optimizer_.space.to_params(point), score)
+        resumed = len(self.evaluations_)
+
+        observed = [point for point, _ in self.optimizer_.observations]
+        for params, score in self.warm_start or []:
+            point = self.optimizer_.space.to_point(params)
+            if point is None or point in observed:
+                continue
+            self.optimizer_.tell(params, score)
+            observed.append(point)
+            self._known(self.optimizer_.space.to_params(point), score)
+        if self.verbose and len(self.evaluations_) > resumed:
+            print("Warm-starting from {} stored evaluations".format(len(self.evaluations_) - resumed))
+
+        self._total = self.n_iter + len(self.evaluations_) - resumed
+        self._submitted = len(self.evaluations_)
+
+    def ask(self):
+        if self.stopped_ or self._submitted >= self._total:
+            return None
+
+        self._submitted += 1
+        return {"params": self.optimizer_.ask(), "extra": {"iter": self._submitted - 1}}
+
+    def tell(self, task, evaluation):
+        super().tell(task, evaluation)
+        self.optimizer_.tell(evaluation["params"], np.mean(evaluation["scores"]))
+        if self.checkpoint:
+            self.optimizer_.save(self.checkpoint)
@@ -5,9 +5,11 @@ import QtGraphicalEffects 1.0
 Rectangle {
     id: container
 
-    property alias imageSource: image.source
+    // the saved image (<image>_<suffix>), shown from the tiles of its pyramid
+    property string imageName: ""
+    property variant pyramid: imageName ? result_data.pyramid(imageName) : ({})
     property string suffix: ""
-    property alias sourceSize: image.sourceSize
+    readonly property size sourceSize: pyramid.width ? Qt.size(pyramid.width, pyramid.height) : Qt.size(0, 0)
     property double imageScale: 1.
 
     property variant metrics: null
@@ -22,6 +24,71 @@ Rectangle {
     width: 300
     height: 300
 
+    // the pyramid level with at least one tile pixel per screen pixel
+    readonly property int level: pyramid.levels ?
+        Math.max(0, Math.min(pyramid.levels - 1, Math.floor(Math.log(1. / imageScale) / Math.LN2))) : 0
+
+    // the "level/row/col" of the tiles in view
+    function visibleTiles() {
+        if (!pyramid.levels)
+            return []
+
+        var factor = Math.pow(2, level)
+        var step = pyramid.tile_size * factor * imageScale
+        var rows = Math.ceil(Math.ceil(pyramid.height / factor) / pyramid.tile_size)
+        var cols = Math.ceil(Math.ceil(pyramid.width / factor) / pyramid.tile_size)
+        var tiles = []
+        for (var row = Math.max(0, Math.floor(contentY / step));
+             row < Math.min(rows, Math.ceil((contentY + imageContainer.height) / step)); row++) {
+            for (var col = Math.max(0, Math.floor(contentX / step));
+                 col < Math.min(cols, Math.ceil((contentX + imageContainer.width) / step)); col++) {
+                tiles.push(level + "/" + row + "/" + col)
+            }
+        }
+        return tiles
+    }
+
+    // update the tiles model in place, so the tiles still in view are not loaded again
+    function updateTiles() {
+        var wanted = {}
+        var tiles = visibleTiles()
+        for (var i = 0; i < tiles.length; i++)
+            wanted[tiles[i] + "/" + imageName] = tiles[i]
+
+        for (i = tilesModel.count - 1; i >= 0; i--) {
+            var key = tilesModel.get(i).key
+            if (key in wanted)
+                delete wanted[key]
+            else
+                tilesModel.remove(i)
+        }
+
+        var factor = Math.pow(2, level)
+        for (key in wanted) {
+            var parts = wanted[key].split("/")
+            var row = parseInt(parts[1])
+            var col = parseInt(parts[2])
+            var levelWidth = Math.ceil(pyramid.width / factor)
+            var levelHeight = Math.ceil(pyramid.height / factor)
+            tilesModel.append({
+                key: key,
+                source: "image://tiles/" + wanted[key] + "/" + encodeURIComponent(imageName),
+                tileX: col * pyramid.tile_size * factor,
+                tileY: row * pyramid.tile_size * factor,
+                tileWidth: Math.min(pyramid.tile_size, levelWidth - col * pyramid.tile_size) * factor,
+                tileHeight: Math.min(pyramid.tile_size, levelHeight - row * pyramid.tile_size) * factor
+            })
+        }
+    }
+
+    onPyramidChanged: updateTiles()
+    onLevelChanged: updateTiles()
+    onImageScaleChanged: updateTiles()
+    onContentXChanged: updateTiles()
+    onContentYChanged: updateTiles()
+    onWidthChanged: updateTiles()
+    onHeightChanged: updateTiles()
+
     onMetricsChanged: {
         metricsModel.clear()
         if (container.metrics != null)  {
@@ -45,16 +112,28 @@ Rectangle {
         clip: true
         boundsBehavior: Flickable.StopAtBounds
         boundsMovement: Flickable.StopAtBounds
-        Image {
+        Item {
             id: image
 
             x: 0
             y: 0
-            asynchronous: true
-            fillMode: Image.PreserveAspectFit
-            smooth: false
-            width: sourceSize.width * container.imageScale
-            height: sourceSize.height * container.imageScale
+            width: container.sourceSize.width * container.imageScale
+            height: container.sourceSize.height * container.imageScale
+
+            Repeater {
+                model: ListModel { id: tilesModel }
+                Image {
+                    x: model.tileX * container.imageScale
+                    y: model.tileY * container.imageScale
+                    width: model.tileWidth * container.imageScale
+                    height: model.tileHeight * container.imageScale
+                    source: model.source
+                    asynchronous: true
+                    // the tiles are kept in the byte bounded cache of the viewer instead
+                    cache: false
+                    smooth: false
+                }
+            }
         }
     }
 
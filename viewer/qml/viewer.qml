@@ -5,8 +5,8 @@ import QtQuick.Layouts 1.2
 Rectangle {
     id: root
 
-    function image_path(name, suffix) {
-        return result_data.image_path + "/" + name + "_" + suffix + ".png"
+    function image_name(name, suffix) {
+        return name + "_" + suffix
     }
 
     color: "#eeeeeeff"
@@ -27,6 +27,9 @@ Rectangle {
 
             property string currentImage: model[currentIndex]
 
+            // build the tiles of this image first, and prefetch the next one at the current view
+            onCurrentImageChanged: result_data.select(currentImage, reference.visibleTiles())
+
             clip: true
             focus: true
             anchors {
@@ -101,7 +104,7 @@ Rectangle {
 
         ImageViewer {
             id: reference
-            imageSource: root.image_path(imageList.currentImage, "reference")
+            imageName: root.image_name(imageList.currentImage, "reference")
             suffix: "reference"
             imageScale: scaleSlider.value
 
@@ -142,7 +145,7 @@ Rectangle {
             model: result_data.denoisers
 
             ImageViewer {
-                imageSource: root.image_path(imageList.currentImage, modelData.name)
+                imageName: root.image_name(imageList.currentImage, modelData.name)
                 suffix: modelData.name
                 interactive: false
                 contentX: reference.contentX
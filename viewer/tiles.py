@@ -0,0 +1,205 @@
+"""
+Multi-resolution tile pyramids of the images saved by denoise_comparator.py, so the viewer only
+loads the part of an image it shows, at the resolution it shows it
+"""
+
+from collections import OrderedDict
+import itertools
+import json
+import os
+import queue
+import struct
+import threading
+import cv2
+import numpy as np
+
+TILE_SIZE = 256
+
+def image_size(image_file):
+    """ Return the (width, height) of an image, from the header of PNG files instead of decoding them """
+    with open(image_file, "rb") as f:
+        header = f.read(24)
+    if header[:8] == b"\x89PNG\r\n\x1a\n":
+        return struct.unpack(">II", header[16:24])
+
+    image = cv2.imread(image_file, cv2.IMREAD_UNCHANGED)
+    return image.shape[1], image.shape[0]
+
+def level_count(width, height, tile_size=TILE_SIZE):
+    """ Return the number of levels of a pyramid, the last one fitting in a single tile """
+    levels = 1
+    while max(width, height) > tile_size * 2 ** (levels - 1):
+        levels += 1
+    return levels
+
+class TilePyramid(object):
+    """
+    The tiles of an image at full resolution (level 0) and halved at each following level, until
+    it fits in a single tile
+
+    The tiles are stored as <cache_dir>/<image name>/<level>/<row>_<col>.png, with a pyramid.json
+    written once they are all saved, so an interrupted build is done again. The pyramid is built
+    again when the image changes (its size or modification time), also while the viewer is open.
+    """
+
+    def __init__(self, image_file, cache_dir, tile_size=TILE_SIZE):
+        self.image_file = image_file
+        self.directory = os.path.join(cache_dir, os.path.splitext(os.path.basename(image_file))[0])
+        self.tile_size = tile_size
+
+    def exists(self):
+        return os.path.exists(self.image_file)
+
+    def info(self):
+        """ Return the width, height, number of levels and tile size of the pyramid """
+        width, height = image_size(self.image_file)
+        return {"width": width, "height": height, "levels": level_count(width, height, self.tile_size),
+                "tile_size": self.tile_size}
+
+    def source(self):
+        """ Return what identifies the version of the image the tiles are made of (None if there's no image) """
+        try:
+            stat = os.stat(self.image_file)
+        except OSError:
+            return None
+        return {"size": stat.st_size, "mtime": stat.st_mtime, "tile_size": self.tile_size}
+
+    def tile_file(self, level, row, col):
+        return os.path.join(self.directory, str(level), "{}_{}.png".format(row, col))
+
+    def is_built(self):
+        try:
+            with open(os.path.join(self.directory, "pyramid.json")) as f:
+                return json.load(f) == self.source()
+        except (OSError, ValueError):
+            return False
+
+    def build(self):
+        # taken before reading the image, so a rewrite meanwhile makes the next build happen
+        source = self.source()
+        image = cv2.imread(self.image_file, cv2.IMREAD_UNCHANGED)
+        if image.dtype != np.uint8:
+            # the tiles are only displayed
+            image = cv2.normalize(image, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+
+        for level in range(level_count(image.shape[1], image.shape[0], self.tile_size)):
+            os.makedirs(os.path.join(self.directory, str(level)), exist_ok=True)
+            for row in range(0, image.shape[0], self.tile_size):
+                for col in range(0, image.shape[1], self.tile_size):
+                    tile = image[row:row + self.tile_size, col:col + self.tile_size]
+                    cv2.imwrite(self.tile_file(level, row // self.tile_size, col // self.tile_size), tile,
+                                [cv2.IMWRITE_PNG_COMPRESSION, 1])
+            image = cv2.resize(image, ((image.shape[1] + 1) // 2, (image.shape[0] + 1) // 2),
+                               interpolation=cv2.INTER_AREA)
+
+        temp_file = os.path.join(self.directory, "pyramid.json.tmp")
+        with open(temp_file, "w") as f:
+            json.dump(source, f)
+        os.replace(temp_file, os.path.join(self.directory, "pyramid.json"))
+
+    def load_tile(self, level, row, col):
+        return cv2.imread(self.tile_file(level, row, col), cv2.IMREAD_UNCHANGED)
+
+class TileCache(object):
+    """ Least recently used cache of decoded tiles, bounded by the bytes they take """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        """ Return the tile of the key, calling @ref load to get it if it isn't cached (it can return None) """
+        with self._lock:
+            if key in self._tiles:
+                self._tiles.move_to_end(key)
+                return self._tiles[key]
+
+        # decode outside the lock, so the other tiles are served meanwhile
+        tile = load()
+        if tile is None:
+            return None
+
+        with self._lock:
+            if key not in self._tiles:
+                self._tiles[key] = tile
+                self.bytes += tile.nbytes
+            while self.bytes > self.max_bytes and len(self._tiles) > 1:
+                _, evicted = self._tiles.popitem(last=False)
+                self.bytes -= evicted.nbytes
+        return tile
+
+class PyramidBuilder(object):
+    """
+    Builds the pyramids in background threads, the most urgent ones first
+
+    Each @ref request() has a priority (lower is more urgent) and optionally the tiles to load in the
+    @ref cache once the pyramid is built, to prefetch what the viewer is about to show. @ref tile()
+    waits for the pyramid of the tile, building it right away if it wasn't yet, or if the image
+    changed since. The tiles are cached by the version of their image, so the ones of a rewritten
+    image are not served anymore (and get evicted as the least recently used).
+    """
+
+    def __init__(self, cache_dir, cache, jobs=2, tile_size=TILE_SIZE):
+        self.cache_dir = cache_dir
+        self.cache = cache
+        self.tile_size = tile_size
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._pyramids = {}
+        # the source (see TilePyramid.source()) each pyramid was last built from
+        self._built = {}
+        self._building = {}
+        self._lock = threading.Lock()
+
+        for _ in range(jobs):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def pyramid(self, image_file):
+        with self._lock:
+            if image_file not in self._pyramids:
+                self._pyramids[image_file] = TilePyramid(image_file, self.cache_dir, self.tile_size)
+                self._building[image_file] = threading.Lock()
+            return self._pyramids[image_file]
+
+    def request(self, image_file, priority=0, tiles=()):
+        """
+        Queue the build of the pyramid of an image
+        :param tiles: (level, row, col) of the tiles to load in the cache after the build
+        """
+        self.pyramid(image_file)
+        self._queue.put((priority, next(self._counter), image_file, tuple(tiles)))
+
+    def build(self, image_file):
+        """
+        Build the pyramid of an image, unless it already is for the current version of the image
+        :return: the pyramid and the source it was built from, (None, None) if there's no image
+        """
+        pyramid = self.pyramid(image_file)
+        source = pyramid.source()
+        if self._built.get(image_file) != source:
+            with self._building[image_file]:
+                if self._built.get(image_file) != source:
+                    try:
+                        if source is not None and not pyramid.is_built():
+                            pyramid.build()
+                    except Exception as e:
+                        print("WARNING: could not build the tiles of {}: {}".format(image_file, e))
+                    self._built[image_file] = source
+        return (pyramid, source) if source is not None else (None, None)
+
+    def tile(self, image_file, level, row, col):
+        """ Return a tile, from the cache or loaded from its pyramid (None if there's no such tile) """
+        pyramid, source = self.build(image_file)
+        if pyramid is None:
+            return None
+        return self.cache.get((image_file, source["mtime"], source["size"], level, row, col),
+                              lambda: pyramid.load_tile(level, row, col))
+
+    def _work(self):
+        while True:
+            _, _, image_file, tiles = self._queue.get()
+            for level, row, col in tiles:
+                self.tile(image_file, level, row, col)
+            self.build(image_file)
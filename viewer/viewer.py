@@ -1,16 +1,46 @@
-from PyQt5.QtQuick import QQuickView
-from PyQt5.QtGui import QGuiApplication, QWindow
-from PyQt5.QtCore import QObject, QUrl, pyqtProperty, pyqtSignal
+from PyQt5.QtQuick import QQuickView, QQuickImageProvider
+from PyQt5.QtGui import QGuiApplication, QWindow, QImage
+from PyQt5.QtCore import QObject, QUrl, QSize, pyqtProperty, pyqtSignal, pyqtSlot
+from urllib.parse import unquote
+from .tiles import TileCache, PyramidBuilder
 import os
 
+class TileImageProvider(QQuickImageProvider):
+    """
+    Serves the tiles of the saved images as image://tiles/<level>/<row>/<col>/<image name>, from the
+    tile cache or their pyramid (built on demand if the background job didn't get to it yet)
+    """
+
+    def __init__(self, image_path, builder):
+        super().__init__(QQuickImageProvider.Image)
+        self._image_path = image_path
+        self._builder = builder
+
+    def requestImage(self, id, size):
+        level, row, col, name = id.split("/", 3)
+        tile = self._builder.tile(os.path.join(self._image_path, unquote(name) + ".png"),
+                                  int(level), int(row), int(col))
+        if tile is None:
+            return QImage(), QSize()
+
+        if tile.ndim == 2:
+            format = QImage.Format_Grayscale8
+        elif tile.shape[2] == 4:
+            format = QImage.Format_ARGB32
+        else:
+            format = QImage.Format_BGR888
+        # copy, as the QImage doesn't own the memory of the tile
+        image = QImage(tile.data, tile.shape[1], tile.shape[0], tile.strides[0], format).copy()
+        return image, image.size()
+
 class DenoiserResults(QObject):
     metricsChanged = pyqtSignal()
     imageChanged = pyqtSignal()
 
-    def __init__(self, parent, name, data):
+    def __init__(self, parent, name, store):
         super().__init__(parent)
         self._name = name
-        self._data = data
+        self._store = store
         self._image = None
 
     @pyqtProperty(str, constant=True)
@@ -19,7 +49,9 @@ class DenoiserResults(QObject):
 
     @pyqtProperty('QVariantMap', notify=metricsChanged)
     def metrics(self):
-        return self._data[self._data.image == self._image].set_index("metric").value.round(4).to_dict()
+        # indexed lookup of the image, instead of filtering all the results
+        scores = self._store.image_scores(self._image).get(self._name, {})
+        return {metric: round(value, 4) for metric, value in scores.items()}
 
     @pyqtProperty(str, notify=imageChanged)
     def image(self):
@@ -33,10 +65,17 @@ class DenoiserResults(QObject):
 
 
 class Viewer(QObject):
-    def __init__(self, args, image_path, data):
+    def __init__(self, args, image_path, store, tile_cache_size=512, tile_jobs=2):
+        """
+        :param store: the results (resultstore.ResultStore)
+        :param tile_cache_size: the MB of decoded tiles kept in memory
+        :param tile_jobs: the number of threads building the tile pyramids in the background
+        """
         super().__init__()
-        self._data = data
+        self._store = store
         self._image_path = image_path
+        self._tile_cache = TileCache(tile_cache_size * 2 ** 20)
+        self._builder = PyramidBuilder(os.path.join(image_path, "_tiles"), self._tile_cache, tile_jobs)
 
 
         current_dir = os.path.abspath(os.path.dirname(__file__))
@@ -48,6 +87,14 @@ class Viewer(QObject):
         # create the denoiser list before setting it as a context property
         self.createDenoiserList()
 
+        # the pyramids of all the images are built in the background, the viewed ones first
+        self._suffixes = ["reference"] + [denoiser.name for denoiser in self._denoisers]
+        for image in self._store.images():
+            for suffix in self._suffixes:
+                self._builder.request(self.image_file(image, suffix), priority=2)
+
+        self._tile_provider = TileImageProvider(image_path, self._builder)
+        self.view.engine().addImageProvider("tiles", self._tile_provider)
         self.view.rootContext().setContextProperty("result_data", self)
         self.view.setResizeMode(QQuickView.SizeRootObjectToView)
         self.view.setSource(QUrl.fromLocalFile(os.path.join(current_dir, "qml", "viewer.qml")))
@@ -55,7 +102,7 @@ class Viewer(QObject):
 
     @pyqtProperty(list, constant=True)
     def image_names(self):
-        return self._data.image.unique().tolist()
+        return self._store.images()
 
     @pyqtProperty(str, constant=True)
     def image_path(self):
@@ -66,8 +113,32 @@ class Viewer(QObject):
         print(len(self._denoisers))
         return self._denoisers
 
+    def image_file(self, image, suffix):
+        return os.path.join(self._image_path, "{}_{}.png".format(image, suffix))
+
+    @pyqtSlot(str, result='QVariantMap')
+    def pyramid(self, name):
+        """ Return the size and levels of the tile pyramid of a saved image (empty if there's no image) """
+        pyramid = self._builder.pyramid(os.path.join(self._image_path, name + ".png"))
+        return pyramid.info() if pyramid.exists() else {}
+
+    @pyqtSlot(str, list)
+    def select(self, image, tiles):
+        """
+        Build the pyramids of the image being shown right away, and prefetch the next one
+        :param tiles: the "level/row/col" tiles visible now, loaded for the next image too
+        """
+        for suffix in self._suffixes:
+            self._builder.request(self.image_file(image, suffix), priority=0)
+
+        images = self._store.images()
+        if image in images and images.index(image) + 1 < len(images):
+            tiles = [tuple(int(i) for i in tile.split("/")) for tile in tiles]
+            for suffix in self._suffixes:
+                self._builder.request(self.image_file(images[images.index(image) + 1], suffix), 1, tiles)
+
     def createDenoiserList(self):
-        self._denoisers = [DenoiserResults(self, name, self._data[self._data.denoiser == name]) for name in self._data.denoiser.unique()]
+        self._denoisers = [DenoiserResults(self, name, self._store) for name in self._store.denoisers()]
 
     def run(self):
         self.view.showMaximized()